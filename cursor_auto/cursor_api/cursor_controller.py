@@ -1,22 +1,30 @@
-import socket
 import json
 import secrets
-import struct
-import base64
+import itertools
 import urllib.request
 import time
 import threading
 import os
 import shutil
+import socket
 import sqlite3
+import sys
+
+try:
+    import ws_codec
+except ImportError:
+    # Run from a checkout: the module lives with the Antigravity box, and only the image has a copy here
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'website', 'antigravity_auto'))
+    import ws_codec
 
 class CursorController:
     def __init__(self, host="127.0.0.1", port=9222):
         self.host = host
         self.port = port
-        self.sock = None
+        self.ws = None
         self.target_id = None
         self.lock = threading.Lock()
+        self.ids = itertools.count(1)
         
     def log(self, msg):
         print(f"[CursorController] {msg}")
@@ -32,7 +40,7 @@ class CursorController:
 
     def connect(self):
         with self.lock:
-            if self.sock: return True
+            if self.ws: return True
             
             targets = self.get_targets()
             for t in targets:
@@ -49,63 +57,18 @@ class CursorController:
                 
             self.log(f"Connecting to {self.target_id}...")
             try:
-                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.sock.settimeout(10.0)
-                self.sock.connect((self.host, self.port))
-                
-                nonce = base64.b64encode(secrets.token_bytes(16)).decode()
-                handshake = (
-                    f"GET /devtools/page/{self.target_id} HTTP/1.1\r\n"
-                    f"Host: {self.host}:{self.port}\r\n"
-                    "Upgrade: websocket\r\n"
-                    "Connection: Upgrade\r\n"
-                    f"Sec-WebSocket-Key: {nonce}\r\n"
-                    "Sec-WebSocket-Version: 13\r\n"
-                    "\r\n"
-                )
-                self.sock.sendall(handshake.encode())
-                
-                response = self.sock.recv(4096)
-                if b"101 " not in response:
-                    self.log("Handshake failed")
-                    self.sock.close()
-                    self.sock = None
-                    return False
-                    
+                self.ws = ws_codec.connect(f"ws://{self.host}:{self.port}/devtools/page/{self.target_id}", timeout=10.0)
                 self.log("Connected!")
                 return True
             except Exception as e:
                 self.log(f"Connection error: {e}")
-                if self.sock:
-                    self.sock.close()
-                    self.sock = None
                 return False
 
-    def create_ws_frame(self, message):
-        frame = bytearray([0x81])
-        payload = message.encode()
-        length = len(payload)
-        mask_key = secrets.token_bytes(4)
-        if length < 126:
-            frame.append(length | 0x80)
-        elif length < 65536:
-            frame.append(126 | 0x80)
-            frame.extend(struct.pack("!H", length))
-        else:
-            frame.append(127 | 0x80)
-            frame.extend(struct.pack("!Q", length))
-        frame.extend(mask_key)
-        masked_payload = bytearray(length)
-        for i in range(length):
-            masked_payload[i] = payload[i] ^ mask_key[i % 4]
-        frame.extend(masked_payload)
-        return frame
-
     def send_command(self, method, params=None):
         if not self.connect():
             return {"error": "Not connected"}
             
-        cmd_id = int(time.time() * 1000) % 100000
+        cmd_id = next(self.ids)
         cmd = {
             "id": cmd_id,
             "method": method
@@ -115,38 +78,42 @@ class CursorController:
             
         try:
             with self.lock:
-                self.sock.sendall(self.create_ws_frame(json.dumps(cmd)))
-                
-                # Simple read until we get response with matching ID
-                # In robust implementation, we'd have a reader thread
-                start = time.time()
-                while time.time() - start < 5:
-                    data = self.sock.recv(65536)
-                    if not data: break
-                    
-                    # Frame decoding logic
-                    # This is naive and assumes single frame response for simplicity of this framework
-                    # Ideally use a websocket lib, but keeping it dep-free for now as requested
-                    if len(data) > 2:
-                        length = data[1] & 0x7F
-                        offset = 2
-                        if length == 126: offset = 4
-                        elif length == 127: offset = 10
-                        if len(data) < offset: continue
-                        
-                        payload = data[offset:]
-                        try:
-                            msg = json.loads(payload.decode('utf-8', errors='ignore'))
-                            if msg.get("id") == cmd_id:
-                                return msg.get("result", {})
-                        except:
-                            pass
-                            
+                self.ws.send(json.dumps(cmd))
+
+                # Events and late replies to earlier commands arrive on the same socket; skip them
+                deadline = time.monotonic() + 5
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # No single recv may run past the deadline
+                    self.ws.sock.settimeout(remaining)
+                    try:
+                        text = self.ws.recv_text()
+                    except socket.timeout:
+                        # The read may have stopped inside a frame, so the stream can't be resumed
+                        self.log(f"No reply to {method} within 5 s, reconnecting on the next command")
+                        self.ws.close()
+                        self.ws = None
+                        break
+                    if text is None:
+                        self.log("Connection closed by the browser")
+                        self.ws.close()
+                        self.ws = None
+                        break
+                    try:
+                        msg = json.loads(text)
+                    except ValueError:
+                        continue
+                    if msg.get("id") == cmd_id:
+                        return msg.get("result", {})
+
             return {"status": "sent"}
         except Exception as e:
             self.log(f"Send failed: {e}")
-            self.sock.close()
-            self.sock = None
+            if self.ws:
+                self.ws.close()
+                self.ws = None
             return {"error": str(e)}
 
     def click_login(self):
@@ -3,285 +3,820 @@ import socketserver
 import json
 import urllib.request
 import socket
-import struct
-import base64
 import os
+import re
 import time
 import sys
+import threading
+
+import ws_codec
 
 PORT = 4020
 PROXY_URL = "http://localhost:5555/rpc"
 
 # --- CDP Helpers ---
-def create_mask():
-    return os.urandom(4)
-
-def encode_frame(data, mask=True):
-    frame = bytearray()
-    frame.append(0x81) # Text
-    length = len(data)
-    b2 = 0x80 if mask else 0
-    if length <= 125:
-        b2 |= length
-        frame.append(b2)
-    elif length <= 65535:
-        b2 |= 126
-        frame.append(b2)
-        frame.extend(struct.pack("!H", length))
-    else:
-        b2 |= 127
-        frame.append(b2)
-        frame.extend(struct.pack("!Q", length))
-    if mask:
-        masking_key = create_mask()
-        frame.extend(masking_key)
-        data_bytes = data.encode('utf-8')
-        masked_data = bytearray(len(data_bytes))
-        for i in range(len(data_bytes)):
-            masked_data[i] = data_bytes[i] ^ masking_key[i % 4]
-        frame.extend(masked_data)
-    else:
-        frame.extend(data.encode('utf-8'))
-    return frame
-
-def read_frame(sock):
-    try:
-        head = sock.recv(2)
-        if not head: return None
-        length = head[1] & 0x7F
-        if length == 126:
-            length = struct.unpack("!H", sock.recv(2))[0]
-        elif length == 127:
-            length = struct.unpack("!Q", sock.recv(8))[0]
-        data = b''
-        while len(data) < length:
-            chunk = sock.recv(length - len(data))
-            if not chunk: break
-            data += chunk
-        return data.decode('utf-8', errors='ignore')
-    except:
-        return None
-
-def send_cdp_command(sock, method, params=None, await_result=True):
-    msg_id = int(time.time() * 100000) % 1000000
-    msg = {"id": msg_id, "method": method}
-    if params:
-        msg["params"] = params
-    sock.send(encode_frame(json.dumps(msg)))
-    
-    if not await_result:
-        return None
-
-    start = time.time()
-    while time.time() - start < 10:
-        data = read_frame(sock)
-        if data:
-            try:
-                resp = json.loads(data)
-                if resp.get("id") == msg_id:
-                    return resp
-            except:
-                pass
-    return None
-
-def get_page_targets():
+def get_page_targets(timeout=None):
     targets = []
     try:
-        with urllib.request.urlopen("http://localhost:9222/json") as response:
+        with urllib.request.urlopen("http://localhost:9222/json", timeout=timeout) as response:
             targets = json.loads(response.read().decode())
     except Exception as e:
         print(f"Error getting targets: {e}")
         return []
     return [t for t in targets if t.get("type") == "page"]
 
-def connect_to_target(t):
-    target_ws = t.get("webSocketDebuggerUrl")
-    if not target_ws: return None
+# --- CDP Connection ---
+CDP_VERSION_URL = "http://localhost:9222/json/version"
+# Seconds a CDP command may take before its caller gives up on it
+CDP_TIMEOUT = 10
 
-    parts = target_ws.split('/')
-    host = parts[2].split(':')[0]
-    port = int(parts[2].split(':')[1])
-    path = '/' + '/'.join(parts[3:])
+class CdpSession:
+    """Commands for one page target, sent over the shared connection with its sessionId."""
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        s.connect((host, port))
-        key = base64.b64encode(os.urandom(16)).decode('utf-8')
-        req = (
-            f"GET {path} HTTP/1.1\r\n"
-            f"Host: {host}:{port}\r\n"
-            "Upgrade: websocket\r\n"
-            "Connection: Upgrade\r\n"
-            f"Sec-WebSocket-Key: {key}\r\n"
-            "Sec-WebSocket-Version: 13\r\n"
-            "\r\n"
-        )
-        s.send(req.encode())
-        while b'\r\n\r\n' not in s.recv(4096): pass
-        return s
-    except Exception as e:
-        print(f"Socket error: {e}")
+    def __init__(self, conn, target_id, session_id):
+        self.conn = conn
+        self.target_id = target_id
+        self.session_id = session_id
+
+    def send(self, method, params=None, timeout=CDP_TIMEOUT):
+        return self.conn.send(method, params, self.session_id, timeout)
+
+class CdpConnection:
+    """One long-lived browser-level CDP connection, shared by all requests.
+
+    Page targets are driven through flattened sessions (Target.attachToTarget
+    with flatten), so commands for every page go over the same socket tagged
+    with their sessionId. A reader thread hands each response to the caller
+    waiting on its id. When the connection drops, the next command reopens it.
+    """
+
+    def __init__(self):
+        self.ws = None
+        self.lock = threading.Lock()
+        self.next_id = 0
+        # message id -> [Event, response]
+        self.waiting = {}
+        # target id -> session id
+        self.session_ids = {}
+        # session id -> DomMirror; the mirror gets that session's events
+        self.mirrors = {}
+        # Page target that last held the prompt editor, tried first
+        self.editor_target = None
+        # Held while attaching, so concurrent requests share one session per target
+        self.attach_lock = threading.Lock()
+        # target id -> Lock held while a request drives that page's UI
+        self.ui_locks = {}
+
+    def connect(self):
+        with urllib.request.urlopen(CDP_VERSION_URL, timeout=5) as response:
+            ws_url = json.loads(response.read().decode())["webSocketDebuggerUrl"]
+        ws = ws_codec.connect(ws_url, timeout=5)
+        # The reader waits for messages indefinitely; callers time out on their own
+        ws.sock.settimeout(None)
+        self.ws = ws
+        self.session_ids = {}
+        self.mirrors = {}
+        threading.Thread(target=self.read_loop, args=(ws,), daemon=True).start()
+        print(f"CDP connected to {ws_url}")
+
+    def read_loop(self, ws):
+        while True:
+            try:
+                data = ws.recv_text()
+            except OSError as e:
+                print(f"CDP read failed: {e}")
+                data = None
+            if data is None:
+                break
+            try:
+                msg = json.loads(data)
+            except ValueError:
+                continue
+            if "id" in msg:
+                waiter = self.waiting.get(msg["id"])
+                if waiter:
+                    waiter[1] = msg
+                    waiter[0].set()
+            elif msg.get("method") == "Target.detachedFromTarget":
+                session_id = msg.get("params", {}).get("sessionId")
+                with self.lock:
+                    self.session_ids = {t: s for t, s in self.session_ids.items() if s != session_id}
+                    self.mirrors.pop(session_id, None)
+            elif msg.get("method", "").startswith("DOM."):
+                mirror = self.mirrors.get(msg.get("sessionId"))
+                if mirror:
+                    try:
+                        mirror.handle(msg["method"], msg.get("params", {}))
+                    except Exception as e:
+                        print(f"DOM mirror event {msg['method']} failed: {e}")
+        self.disconnected(ws)
+
+    def disconnected(self, ws):
+        with self.lock:
+            if self.ws is not ws:
+                return
+            self.ws = None
+            self.session_ids = {}
+            self.mirrors = {}
+        ws.close()
+        # Callers waiting on this connection get None instead of waiting out their timeout
+        for waiter in list(self.waiting.values()):
+            waiter[0].set()
+        print("CDP connection lost; reconnecting on the next command")
+
+    def send(self, method, params=None, session_id=None, timeout=CDP_TIMEOUT):
+        """Run a CDP command; returns its response message, or None if it failed or timed out."""
+        with self.lock:
+            if self.ws is None:
+                try:
+                    self.connect()
+                except Exception as e:
+                    print(f"CDP connect failed: {e}")
+                    return None
+            ws = self.ws
+            self.next_id += 1
+            msg_id = self.next_id
+        msg = {"id": msg_id, "method": method}
+        if params:
+            msg["params"] = params
+        if session_id:
+            msg["sessionId"] = session_id
+        waiter = [threading.Event(), None]
+        self.waiting[msg_id] = waiter
+        try:
+            ws.send(json.dumps(msg))
+            waiter[0].wait(timeout)
+        except OSError as e:
+            print(f"CDP send failed: {e}")
+            self.disconnected(ws)
+        finally:
+            self.waiting.pop(msg_id, None)
+        return waiter[1]
+
+    def session(self, target_id):
+        """A session on a page target, attaching to it the first time."""
+        with self.attach_lock:
+            with self.lock:
+                session_id = self.session_ids.get(target_id)
+            if session_id is None:
+                res = self.send("Target.attachToTarget", {"targetId": target_id, "flatten": True})
+                if not res or 'result' not in res:
+                    return None
+                session_id = res['result']['sessionId']
+                with self.lock:
+                    self.session_ids[target_id] = session_id
+        return CdpSession(self, target_id, session_id)
+
+    def ui_lock(self, target_id):
+        """Lock serialising UI interaction (clicks, typing) on one page target."""
+        with self.lock:
+            return self.ui_locks.setdefault(target_id, threading.Lock())
+
+    def dom_mirror(self, session):
+        """The seeded DomMirror of a session, creating it the first time; None if it can't be seeded."""
+        with self.lock:
+            mirror = self.mirrors.get(session.session_id)
+            if mirror is None:
+                mirror = DomMirror(session)
+                self.mirrors[session.session_id] = mirror
+        return mirror if mirror.ensure_seeded() else None
+
+    def page_sessions(self):
+        """(target info, session) of each page target, the one that last held the editor first."""
+        res = self.send("Target.getTargets")
+        if not res or 'result' not in res:
+            return
+        targets = [t for t in res['result'].get("targetInfos", []) if t.get("type") == "page"]
+        targets.sort(key=lambda t: t.get("targetId") != self.editor_target)
+        for t in targets:
+            session = self.session(t["targetId"])
+            if session:
+                yield t, session
+
+# --- DOM Mirror ---
+# Separators at which a value's leading part is indexed too, so prefix lookups
+# ("headlessui-popover-button" for "headlessui-popover-button-:r3:") are dict hits
+PREFIX_BOUNDARY_RE = re.compile(r'[\s\-_:/.,()\[\]]')
+# Longest leading part indexed; long texts would otherwise add one key per word
+MAX_PREFIX = 64
+
+def normalize(value):
+    return value.strip().lower()
+
+def prefixes(key):
+    """Leading parts of a normalized value that end at a separator, up to MAX_PREFIX chars."""
+    parts = set()
+    for m in PREFIX_BOUNDARY_RE.finditer(key, 0, MAX_PREFIX + 1):
+        part = key[:m.start()].rstrip()
+        if part:
+            parts.add(part)
+    return parts
+
+class DomMirror:
+    """Python-side copy of a page's DOM, kept current by the session's DOM events.
+
+    Seeded once from a pierced DOM.getDocument, then updated from
+    childNodeInserted/Removed, setChildNodes, attributeModified/Removed,
+    characterDataModified and shadowRootPushed/Popped. Elements are indexed by
+    attribute name and value and text nodes by their text, each also under
+    the leading parts of the value (see prefixes), so finding a node by its
+    value or a prefix of it is a dictionary lookup. Events arrive on the CDP
+    reader thread, lookups on request threads.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        # A second DOM.getDocument would renumber the nodes of one in flight
+        self.seed_lock = threading.Lock()
+        self.seeded = False
+        self.seeding = False
+        # Events received while a seed is in flight, applied once it lands
+        self.pending = []
+        # node id -> {"parent", "type", "attrs", "text", "children"}
+        self.nodes = {}
+        # attribute name -> normalized value -> node ids
+        self.attr_index = {}
+        # attribute name -> leading part of a normalized value -> node ids
+        self.attr_prefixes = {}
+        # normalized text -> text node ids
+        self.text_index = {}
+        # leading part of a normalized text -> text node ids
+        self.text_prefixes = {}
+
+    def ensure_seeded(self):
+        with self.seed_lock:
+            return self.seeded or self.seed()
+
+    def seed(self):
+        with self.lock:
+            self.seeding = True
+            self.pending = []
+        self.session.send("DOM.enable")
+        res = self.session.send("DOM.getDocument", {"depth": -1, "pierce": True})
+        with self.lock:
+            self.seeding = False
+            pending, self.pending = self.pending, []
+            if not res or 'result' not in res:
+                return False
+            self.nodes, self.attr_index, self.attr_prefixes, self.text_index, self.text_prefixes = {}, {}, {}, {}, {}
+            self.add(res['result']['root'], None)
+            self.seeded = True
+            for method, params in pending:
+                self.apply(method, params)
+        print(f"DOM mirror seeded with {len(self.nodes)} nodes")
+        return True
+
+    def handle(self, method, params):
+        with self.lock:
+            if self.seeding:
+                self.pending.append((method, params))
+            elif self.seeded:
+                self.apply(method, params)
+
+    def apply(self, method, params):
+        if method == "DOM.documentUpdated":
+            # Every node id is void; the next lookup seeds again
+            self.seeded = False
+        elif method == "DOM.childNodeInserted":
+            self.insert(params["parentNodeId"], params.get("previousNodeId"), params["node"])
+        elif method == "DOM.childNodeRemoved":
+            self.remove(params["nodeId"])
+        elif method == "DOM.setChildNodes":
+            parent = self.nodes.get(params["parentId"])
+            if parent is not None:
+                for child in list(parent["children"]):
+                    self.remove(child)
+                for node in params["nodes"]:
+                    self.add(node, params["parentId"])
+        elif method == "DOM.childNodeCountUpdated":
+            node = self.nodes.get(params["nodeId"])
+            if node is not None and params.get("childNodeCount") and not node["children"]:
+                self.request_children(params["nodeId"])
+        elif method == "DOM.attributeModified":
+            self.set_attr(params["nodeId"], params["name"], params["value"])
+        elif method == "DOM.attributeRemoved":
+            self.set_attr(params["nodeId"], params["name"], None)
+        elif method == "DOM.characterDataModified":
+            node = self.nodes.get(params["nodeId"])
+            if node is not None:
+                self.unindex_text(params["nodeId"], node)
+                node["text"] = params["characterData"]
+                self.index_text(params["nodeId"], node)
+        elif method == "DOM.shadowRootPushed":
+            self.insert(params["hostId"], None, params["root"])
+        elif method == "DOM.shadowRootPopped":
+            self.remove(params["rootId"])
+
+    def request_children(self, node_id):
+        # Called on the reader thread, so the reply must not be waited for;
+        # the children arrive as a DOM.setChildNodes event
+        self.session.send("DOM.requestChildNodes", {"nodeId": node_id, "depth": -1, "pierce": True}, timeout=0)
+
+    def insert(self, parent_id, previous_id, node):
+        parent = self.nodes.get(parent_id)
+        if parent is None:
+            return
+        self.add(node, parent_id, previous_id)
+        if node.get("childNodeCount") and not node.get("children"):
+            self.request_children(node["nodeId"])
+
+    def add(self, node, parent_id, previous_id=None):
+        node_id = node["nodeId"]
+        if node_id in self.nodes:
+            self.remove(node_id)
+        attrs = node.get("attributes", [])
+        record = {
+            "parent": parent_id,
+            "type": node.get("nodeType"),
+            "attrs": dict(zip(attrs[::2], attrs[1::2])),
+            "text": node.get("nodeValue", "") if node.get("nodeType") == 3 else "",
+            "children": [],
+        }
+        self.nodes[node_id] = record
+        parent = self.nodes.get(parent_id)
+        if parent is not None:
+            siblings = parent["children"]
+            siblings.insert(siblings.index(previous_id) + 1 if previous_id in siblings else len(siblings), node_id)
+        for name, value in record["attrs"].items():
+            self.index_attr(node_id, name, value)
+        self.index_text(node_id, record)
+        for child in node.get("children", []) + node.get("shadowRoots", []):
+            self.add(child, node_id)
+        if node.get("contentDocument"):
+            self.add(node["contentDocument"], node_id)
+
+    def remove(self, node_id):
+        record = self.nodes.pop(node_id, None)
+        if record is None:
+            return
+        parent = self.nodes.get(record["parent"])
+        if parent is not None and node_id in parent["children"]:
+            parent["children"].remove(node_id)
+        for name, value in record["attrs"].items():
+            self.unindex_attr(node_id, name, value)
+        self.unindex_text(node_id, record)
+        for child in list(record["children"]):
+            self.remove(child)
+
+    def set_attr(self, node_id, name, value):
+        record = self.nodes.get(node_id)
+        if record is None:
+            return
+        old = record["attrs"].pop(name, None)
+        if old is not None:
+            self.unindex_attr(node_id, name, old)
+        if value is not None:
+            record["attrs"][name] = value
+            self.index_attr(node_id, name, value)
+
+    def index_attr(self, node_id, name, value):
+        self.index(self.attr_index.setdefault(name, {}), self.attr_prefixes.setdefault(name, {}),
+                   normalize(value), node_id)
+
+    def unindex_attr(self, node_id, name, value):
+        self.unindex(self.attr_index.get(name), self.attr_prefixes.get(name), normalize(value), node_id)
+
+    def index_text(self, node_id, record):
+        if record["text"].strip():
+            self.index(self.text_index, self.text_prefixes, normalize(record["text"]), node_id)
+
+    def unindex_text(self, node_id, record):
+        if record["text"].strip():
+            self.unindex(self.text_index, self.text_prefixes, normalize(record["text"]), node_id)
+
+    @staticmethod
+    def index(index, prefix_index, key, node_id):
+        index.setdefault(key, set()).add(node_id)
+        for part in prefixes(key):
+            prefix_index.setdefault(part, set()).add(node_id)
+
+    @staticmethod
+    def unindex(index, prefix_index, key, node_id):
+        if index is None:
+            return
+        for table, k in [(index, key)] + [(prefix_index, part) for part in prefixes(key)]:
+            if k in table:
+                table[k].discard(node_id)
+                if not table[k]:
+                    del table[k]
+
+    @staticmethod
+    def first(index, prefix_index, part):
+        """Lowest node id filed under ``part``, else under a key starting with it.
+
+        Both are dictionary hits. Only if neither matches are the keys
+        scanned for ``part`` anywhere in them, which is logged.
+        """
+        ids = index.get(part) or prefix_index.get(part)
+        if not ids:
+            ids = set().union(*(v for k, v in index.items() if part in k))
+            if ids:
+                print(f"DOM mirror: {part!r} only found by scanning {len(index)} keys")
+        return min(ids) if ids else None
+
+    def find_attr(self, name, value_part):
+        """Node id of an element whose ``name`` attribute contains ``value_part``, or None."""
+        with self.lock:
+            return self.first(self.attr_index.get(name, {}), self.attr_prefixes.get(name, {}),
+                              normalize(value_part))
+
+    def find_text(self, text_part):
+        """Node id of the element holding a text node that contains ``text_part``, or None."""
+        with self.lock:
+            node_id = self.first(self.text_index, self.text_prefixes, normalize(text_part))
+            if node_id is None:
+                return None
+            parent_id = self.nodes[node_id]["parent"]
+            parent = self.nodes.get(parent_id)
+            return parent_id if parent is not None and parent["type"] == 1 else None
+
+cdp = CdpConnection()
+
+# Finds a node in the page and returns the viewport centre of the element to
+# click, so only a few bytes come back instead of the whole serialised DOM.
+# Walks breadth-first through the document, open shadow roots and same-origin
+# iframes, so the shallowest match wins. A query is {"attr": name, "value": part}
+# for an element whose attribute contains part, or {"text": part} for the
+# element holding a text node that contains it (case-insensitive).
+FIND_NODE_JS = """
+(function(query) {
+    const needle = (query.value || query.text).toLowerCase();
+    const queue = [[document, 0, 0]];
+    for (let i = 0; i < queue.length; i++) {
+        const [node, dx, dy] = queue[i];
+        let target = null;
+        if (query.text !== undefined) {
+            if (node.nodeType === 3 && node.nodeValue.toLowerCase().includes(needle)
+                    && node.parentNode && node.parentNode.nodeType === 1) {
+                target = node.parentNode;
+            }
+        } else if (node.nodeType === 1) {
+            const value = node.getAttribute(query.attr);
+            if (value !== null && value.toLowerCase().includes(needle)) target = node;
+        }
+        if (target) {
+            const rect = target.getBoundingClientRect();
+            if (!rect.width && !rect.height) return null;
+            return {x: dx + rect.left + rect.width / 2, y: dy + rect.top + rect.height / 2,
+                    tag: target.tagName.toLowerCase()};
+        }
+        for (const child of node.childNodes) queue.push([child, dx, dy]);
+        if (node.shadowRoot) queue.push([node.shadowRoot, dx, dy]);
+        if (node.nodeType === 1 && node.tagName === 'IFRAME') {
+            let doc = null;
+            try { doc = node.contentDocument; } catch (e) {}
+            if (doc) {
+                const rect = node.getBoundingClientRect();
+                queue.push([doc, dx + rect.left + node.clientLeft, dy + rect.top + node.clientTop]);
+            }
+        }
+    }
+    return null;
+})
+"""
+
+def find_point(session, query):
+    """Viewport {x, y, tag} of the element matching ``query`` (see FIND_NODE_JS), or None.
+
+    Looked up in the session's DomMirror; the in-page search is only used
+    when the mirror can't be seeded.
+    """
+    mirror = cdp.dom_mirror(session)
+    if mirror:
+        if "text" in query:
+            node_id = mirror.find_text(query["text"])
+        else:
+            node_id = mirror.find_attr(query["attr"], query["value"])
+        return node_point(session, node_id) if node_id else None
+    res = session.send("Runtime.evaluate", {
+        "expression": f"{FIND_NODE_JS}({json.dumps(query)})",
+        "returnByValue": True,
+    })
+    if not res or 'result' not in res or 'exceptionDetails' in res['result']:
         return None
+    return res['result'].get('result', {}).get('value')
 
-def click_node_id(sock, node_id):
-    res = send_cdp_command(sock, "DOM.getBoxModel", {"nodeId": node_id})
+def node_point(session, node_id):
+    """Viewport centre of a node's content box, or None if it isn't rendered."""
+    res = session.send("DOM.getBoxModel", {"nodeId": node_id})
     if not res or 'result' not in res or 'model' not in res['result']:
         print(f"Could not get box model for nodeId {node_id}.")
-        return False
-        
+        return None
     quad = res['result']['model']['content']
-    x = (quad[0] + quad[2] + quad[4] + quad[6]) / 4
-    y = (quad[1] + quad[3] + quad[5] + quad[7]) / 4
-    
-    print(f"Clicking nodeId {node_id} at {x}, {y}")
-    
-    send_cdp_command(sock, "Input.dispatchMouseEvent", {"type": "mousePressed", "x": x, "y": y, "button": "left", "clickCount": 1})
+    return {"x": (quad[0] + quad[2] + quad[4] + quad[6]) / 4,
+            "y": (quad[1] + quad[3] + quad[5] + quad[7]) / 4,
+            "tag": f"nodeId {node_id}"}
+
+def click_point(session, point):
+    x, y = point["x"], point["y"]
+    print(f"Clicking {point.get('tag')} at {x}, {y}")
+    session.send("Input.dispatchMouseEvent", {"type": "mousePressed", "x": x, "y": y, "button": "left", "clickCount": 1})
     time.sleep(0.05)
-    send_cdp_command(sock, "Input.dispatchMouseEvent", {"type": "mouseReleased", "x": x, "y": y, "button": "left", "clickCount": 1})
+    session.send("Input.dispatchMouseEvent", {"type": "mouseReleased", "x": x, "y": y, "button": "left", "clickCount": 1})
     return True
 
-def get_node_by_text(root, text, tag_filter=None):
-    q = [(root, None)]
-    text_lower = text.lower()
-    index = 0
-    while index < len(q):
-        node, parent = q[index]
-        index += 1
-        
-        attrs = node.get("attributes", [])
-        attr_dict = {}
-        for i in range(0, len(attrs), 2):
-            attr_dict[attrs[i]] = attrs[i+1]
-        
-        if node.get("nodeType") == 3: # Text
-            val = node.get("nodeValue", "")
-            if text_lower in val.lower():
-                 return node, parent
-        
-        children = node.get("children", [])
-        for child in children:
-            q.append((child, node))
-        shadows = node.get("shadowRoots", [])
-        for shadow in shadows:
-            q.append((shadow, node))
-        content_doc = node.get("contentDocument")
-        if content_doc:
-            q.append((content_doc, node))
-    return None, None
-
-def get_node_by_attr_includes(root, attr_name, attr_value_part):
-     q = [root]
-     attr_value_part = attr_value_part.lower()
-     index = 0
-     while index < len(q):
-        node = q[index]
-        index += 1
-        attrs = node.get("attributes", [])
-        found_id_match = False
-        for i in range(0, len(attrs), 2):
-            name = attrs[i]
-            val = attrs[i+1]
-            if name == attr_name and attr_value_part in val.lower():
-                return node
-        children = node.get("children", [])
-        for child in children:
-            q.append(child)
-        shadows = node.get("shadowRoots", [])
-        for shadow in shadows:
-            q.append(shadow)
-        content_doc = node.get("contentDocument")
-        if content_doc:
-            q.append(content_doc)
-     return None
-
 def find_and_interact(text_to_type):
-    page_targets = get_page_targets()
-    for t in page_targets:
+    for t, s in cdp.page_sessions():
         print(f"Trying target: {t.get('title')}")
-        s = connect_to_target(t)
-        if not s: continue
-        res = send_cdp_command(s, "DOM.getDocument", {"depth": -1, "pierce": True})
-        if not res or 'result' not in res:
-            s.close()
-            continue
-        root = res['result']['root']
-        editor_node = get_node_by_attr_includes(root, "data-lexical-editor", "true")
-        if editor_node:
-             print("Editor found via CDP.")
-             click_node_id(s, editor_node['nodeId'])
-             print(f"Inserting text: {text_to_type}")
-             send_cdp_command(s, "Input.insertText", {"text": text_to_type})
-             time.sleep(1.0)
-             submit_node, submit_parent = get_node_by_text(root, "Submit")
-             clicked = False
-             if submit_node and submit_parent:
-                  print(f"Submit text found. Clicking parent {submit_parent['nodeId']}...")
-                  clicked = click_node_id(s, submit_parent['nodeId'])
-             if not clicked:
-                  print("Submit click failed or not found. Dispatching Enter...")
-                  send_cdp_command(s, "Input.dispatchKeyEvent", {"type": "rawKeyDown", "windowsVirtualKeyCode": 13, "code": "Enter", "key": "Enter", "text": "\r", "unmodifiedText": "\r"})
-                  send_cdp_command(s, "Input.dispatchKeyEvent", {"type": "char", "text": "\r"})
-                  send_cdp_command(s, "Input.dispatchKeyEvent", {"type": "keyUp", "windowsVirtualKeyCode": 13, "code": "Enter", "key": "Enter"})
-             s.close()
-             return True
-        s.close()
+        with cdp.ui_lock(t["targetId"]):
+            if submit_prompt(t, s, text_to_type):
+                return True
     return False
 
+def submit_prompt(t, s, text_to_type):
+    editor = find_point(s, {"attr": "data-lexical-editor", "value": "true"})
+    if not editor:
+        return False
+    print("Editor found via CDP.")
+    cdp.editor_target = t["targetId"]
+    click_point(s, editor)
+    print(f"Inserting text: {text_to_type}")
+    s.send("Input.insertText", {"text": text_to_type})
+    time.sleep(1.0)
+    submit = find_point(s, {"text": "Submit"})
+    clicked = False
+    if submit:
+        print("Submit text found. Clicking its element...")
+        clicked = click_point(s, submit)
+    if not clicked:
+        print("Submit click failed or not found. Dispatching Enter...")
+        s.send("Input.dispatchKeyEvent", {"type": "rawKeyDown", "windowsVirtualKeyCode": 13, "code": "Enter", "key": "Enter", "text": "\r", "unmodifiedText": "\r"})
+        s.send("Input.dispatchKeyEvent", {"type": "char", "text": "\r"})
+        s.send("Input.dispatchKeyEvent", {"type": "keyUp", "windowsVirtualKeyCode": 13, "code": "Enter", "key": "Enter"})
+    return True
+
 def find_and_select_model(model_name):
-    page_targets = get_page_targets()
-    for t in page_targets:
+    for t, s in cdp.page_sessions():
         print(f"Trying target (model): {t.get('title')}")
-        s = connect_to_target(t)
-        if not s: continue
-        res = send_cdp_command(s, "DOM.getDocument", {"depth": -1, "pierce": True})
-        if not res or 'result' not in res:
-            s.close()
-            continue
-        root = res['result']['root']
-        print(f"Looking for dropdown button...")
-        btn_node = get_node_by_attr_includes(root, "id", "headlessui-popover-button")
-        if btn_node:
-             print(f"Dropdown button found (NodeId: {btn_node['nodeId']}). Clicking...")
-             if click_node_id(s, btn_node['nodeId']):
-                 time.sleep(1.0)
-                 res = send_cdp_command(s, "DOM.getDocument", {"depth": -1, "pierce": True})
-                 root = res['result']['root']
-                 print(f"Searching for model text: {model_name}")
-                 text_node, parent_node = get_node_by_text(root, model_name)
-                 if text_node and parent_node:
-                     print(f"Model text found (Parent NodeId: {parent_node['nodeId']}). Clicking parent...")
-                     if click_node_id(s, parent_node['nodeId']):
-                         print("Model clicked.")
-                         s.close()
-                         return True
-                     else:
-                         print("Failed to click model parent.")
-                 else:
-                     print("Model text not found.")
-        else:
-             print("Dropdown button not found.")
-        s.close()
+        with cdp.ui_lock(t["targetId"]):
+            if select_model(s, model_name):
+                return True
     return False
 
+def select_model(s, model_name):
+    print(f"Looking for dropdown button...")
+    button = find_point(s, {"attr": "id", "value": "headlessui-popover-button"})
+    if not button:
+        print("Dropdown button not found.")
+        return False
+    print("Dropdown button found. Clicking...")
+    click_point(s, button)
+    time.sleep(1.0)
+    print(f"Searching for model text: {model_name}")
+    option = find_point(s, {"text": model_name})
+    if not option:
+        print("Model text not found.")
+        return False
+    print("Model text found. Clicking its element...")
+    click_point(s, option)
+    print("Model clicked.")
+    return True
+
 # --- Proxy Helpers ---
-def call_proxy(method, request_class, payload):
+def call_proxy(method, request_class, payload, timeout=None, json_payload=False):
+    """Call the language server through the bridge. With ``json_payload`` the payload is
+    proto3 JSON (enums by name, oneof members by field name) instead of message fields."""
     req_body = {
         "method": method,
         "requestClass": request_class,
         "payload": payload
     }
+    if json_payload:
+        req_body["json"] = True
     data = json.dumps(req_body).encode('utf-8')
     req = urllib.request.Request(PROXY_URL, data=data, headers={'Content-Type': 'application/json'})
     try:
-        with urllib.request.urlopen(req) as response:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
             return response.status, json.loads(response.read().decode())
     except Exception as e:
         print(f"Proxy call failed: {e}")
         return 500, str(e)
 
+# --- RPC Prompts ---
+# ModelOrAlias (proto3 JSON) new messages ask for, read from the user settings on first use
+# and dropped when /model changes the model
+requested_model_cache = None
+
+def requested_model():
+    """The model the agent panel would request: the last selected one, else the base alias."""
+    global requested_model_cache
+    if requested_model_cache is None:
+        status, resp = call_proxy("getUserSettings", "GetUserSettingsRequest", {}, json_payload=True)
+        if status != 200 or not isinstance(resp, dict):
+            return None
+        settings = resp.get("userSettings") or {}
+        model = settings.get("lastSelectedCascadeModelOrAlias")
+        if not model and settings.get("lastSelectedCascadeModel"):
+            model = {"model": settings["lastSelectedCascadeModel"]}
+        requested_model_cache = model or {"alias": "MODEL_ALIAS_CASCADE_BASE"}
+    return requested_model_cache
+
+def forget_requested_model():
+    global requested_model_cache
+    requested_model_cache = None
+
+def submit_prompt_rpc(text, cascade_id=None):
+    """Send a prompt straight to the language server, without touching the UI.
+
+    Continues ``cascade_id`` if given, else starts a new cascade the way the
+    agent panel does. Returns (cascade_id, error).
+    """
+    model = requested_model()
+    if model is None:
+        return None, "could not read the selected model from the user settings"
+    if not cascade_id:
+        status, resp = call_proxy("startCascade", "StartCascadeRequest", {
+            "source": "CORTEX_TRAJECTORY_SOURCE_INTERACTIVE_CASCADE",
+            "trajectoryType": "CORTEX_TRAJECTORY_TYPE_INTERACTIVE_CASCADE",
+        }, json_payload=True)
+        if status != 200 or not isinstance(resp, dict) or not resp.get("cascadeId"):
+            return None, f"startCascade failed ({status}): {str(resp)[:200]}"
+        cascade_id = resp["cascadeId"]
+    status, resp = call_proxy("sendUserCascadeMessage", "SendUserCascadeMessageRequest", {
+        "cascadeId": cascade_id,
+        "items": [{"text": text}],
+        "cascadeConfig": {"plannerConfig": {"conversational": {}, "requestedModel": model}},
+    }, json_payload=True)
+    if status != 200:
+        return cascade_id, f"sendUserCascadeMessage failed ({status}): {str(resp)[:200]}"
+    return cascade_id, None
+
+# --- Flag Scanner ---
+# Regexes to look for (JSON list), and where to report hits; set by the manager at deploy time
+try:
+    FLAG_PATTERNS = json.loads(os.environ.get('FLAG_PATTERNS') or '[]')
+except ValueError as e:
+    print(f"FLAG_PATTERNS is not a JSON list, not scanning for flags: {e}")
+    FLAG_PATTERNS = []
+FLAG_CALLBACK_URL = os.environ.get('FLAG_CALLBACK_URL', '')
+FLAG_CALLBACK_TOKEN = os.environ.get('FLAG_CALLBACK_TOKEN', '')
+BOX_NAME = os.environ.get('BOX_NAME') or socket.gethostname()
+# Seconds between looks at the trajectories
+FLAG_SCAN_INTERVAL = float(os.environ.get('FLAG_SCAN_INTERVAL', '0.5'))
+# Reports that could not be delivered yet, kept for the next try (oldest dropped first)
+MAX_PENDING_REPORTS = 100
+
+# Step statuses after which a step's text no longer changes
+FINAL_STEP_STATUSES = {
+    'CORTEX_STEP_STATUS_DONE',
+    'CORTEX_STEP_STATUS_ERROR',
+    'CORTEX_STEP_STATUS_CANCELED',
+    'CORTEX_STEP_STATUS_CLEARED',
+    'CORTEX_STEP_STATUS_INTERRUPTED',
+    'CORTEX_STEP_STATUS_INVALID',
+}
+
+def step_scan_text(step):
+    """The text of a step a flag can show up in: command output, file contents or a planner response."""
+    step_type = step.get('type', '')
+    if step_type == 'CORTEX_STEP_TYPE_RUN_COMMAND':
+        rc = step.get('runCommand', {})
+        output = rc.get('combinedOutput', {})
+        return output.get('full') or output.get('truncated') or rc.get('stdout', '')
+    if step_type == 'CORTEX_STEP_TYPE_COMMAND_STATUS':
+        cs = step.get('commandStatus', {})
+        return cs.get('combined') or cs.get('stdout', '')
+    if step_type == 'CORTEX_STEP_TYPE_VIEW_FILE':
+        vf = step.get('viewFile', {})
+        return vf.get('content') or vf.get('rawContent', '')
+    if step_type == 'CORTEX_STEP_TYPE_PLANNER_RESPONSE':
+        pr = step.get('plannerResponse', {})
+        return pr.get('response') or pr.get('modifiedResponse', '')
+    return ''
+
+class FlagScanner:
+    """Watch this box's trajectories through the bridge and report flags to the manager.
+
+    Only steps from the first one that has not settled yet are fetched
+    (getCascadeTrajectorySteps with a step offset), so each step is read
+    until it reaches a final status and never again. Each flag is reported
+    once per conversation.
+    """
+
+    def __init__(self, patterns, callback_url):
+        # A bad pattern only loses that pattern; the others are still scanned for
+        self.patterns = []
+        for p in patterns:
+            try:
+                self.patterns.append(re.compile(p))
+            except (re.error, TypeError) as e:
+                print(f"Skipping flag pattern {p!r}: {e}")
+        self.callback_url = callback_url
+        # cascade id -> {"offset": first unsettled step, "seen": summary fields at the last fetch}
+        self.cascades = {}
+        self.reported = set()
+        self.pending = []
+
+    def scan_once(self):
+        status, resp = call_proxy("getAllCascadeTrajectories", "GetAllCascadeTrajectoriesRequest", {}, timeout=5)
+        if status != 200 or not isinstance(resp, dict):
+            return
+        for cascade_id, summary in resp.get("trajectorySummaries", {}).items():
+            state = self.cascades.setdefault(cascade_id, {"offset": 0, "seen": None})
+            seen = (summary.get("lastModifiedTime"), summary.get("stepCount"), summary.get("status"))
+            # Nothing new, and every step read so far has settled
+            if seen == state["seen"] and state["offset"] >= (summary.get("stepCount") or 0):
+                continue
+            status, resp = call_proxy("getCascadeTrajectorySteps", "GetCascadeTrajectoryStepsRequest",
+                                      {"cascadeId": cascade_id, "stepOffset": state["offset"]}, timeout=10)
+            if status != 200 or not isinstance(resp, dict):
+                continue
+            steps = resp.get("steps", [])
+            offset = state["offset"]
+            settled = True
+            for i, step in enumerate(steps):
+                self.scan_step(cascade_id, offset + i, step)
+                if settled and step.get("status") in FINAL_STEP_STATUSES:
+                    state["offset"] += 1
+                else:
+                    settled = False
+            state["seen"] = seen
+        self.deliver()
+
+    def scan_step(self, cascade_id, index, step):
+        text = step_scan_text(step)
+        if not text:
+            return
+        for pattern in self.patterns:
+            for match in pattern.finditer(text):
+                flag = match.group(0)
+                if (cascade_id, flag) in self.reported:
+                    continue
+                self.reported.add((cascade_id, flag))
+                print(f"Flag found in step {index} of {cascade_id}: {flag}")
+                self.pending.append({
+                    "container": BOX_NAME,
+                    "token": FLAG_CALLBACK_TOKEN,
+                    "cascade_id": cascade_id,
+                    "step": index,
+                    "step_type": step.get("type", ""),
+                    "flag": flag,
+                    "found_at": time.time(),
+                })
+        del self.pending[:-MAX_PENDING_REPORTS]
+
+    def deliver(self):
+        while self.pending:
+            data = json.dumps(self.pending[0]).encode('utf-8')
+            req = urllib.request.Request(self.callback_url, data=data, headers={'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(req, timeout=5):
+                    pass
+            except Exception as e:
+                print(f"Flag report failed, retrying on the next scan: {e}")
+                return
+            self.pending.pop(0)
+
+    def run(self):
+        print(f"Scanning trajectories for {len(self.patterns)} flag pattern(s), reporting to {self.callback_url}")
+        while True:
+            try:
+                self.scan_once()
+            except Exception as e:
+                print(f"Flag scan failed: {e}")
+            time.sleep(FLAG_SCAN_INTERVAL)
+
+# --- Health ---
+# Seconds each readiness check may take
+HEALTH_TIMEOUT = 3
+
+def timed_check(check):
+    """Run one readiness check; returns {"ok", "ms", "error"}."""
+    started = time.time()
+    try:
+        ok, error = check()
+    except Exception as e:
+        ok, error = False, str(e)
+    return {"ok": ok, "ms": round((time.time() - started) * 1000), "error": error}
+
+def check_window():
+    # The Antigravity window is a CDP page target; it disappears when the window crashes
+    if get_page_targets(timeout=HEALTH_TIMEOUT):
+        return True, None
+    return False, "no Antigravity window on CDP port 9222"
+
+def check_bridge():
+    status, resp = call_proxy("getAllCascadeTrajectories", "GetAllCascadeTrajectoriesRequest", {},
+                              timeout=HEALTH_TIMEOUT)
+    if status == 200:
+        return True, None
+    return False, f"bridge on :5555 answered {status}: {str(resp)[:200]}"
+
+def readiness():
+    checks = {"window": timed_check(check_window), "bridge": timed_check(check_bridge)}
+    return {"ready": all(c["ok"] for c in checks.values()), "checks": checks}
+
 class PromptHandler(http.server.BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path == '/conversations':
+        if self.path == '/health':
+            result = readiness()
+            self.send_response(200 if result["ready"] else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(result).encode('utf-8'))
+
+        elif self.path == '/conversations':
             status, resp = call_proxy("getAllCascadeTrajectories", "GetAllCascadeTrajectoriesRequest", {})
             if status == 200 and isinstance(resp, dict):
                 # Extract IDs and names (summary)
@@ -290,7 +825,9 @@ class PromptHandler(http.server.BaseHTTPRequestHandler):
                 for k, v in summaries.items():
                     conversations.append({
                         "id": k,
-                        "name": v.get("summary", "Untitled")
+                        "name": v.get("summary", "Untitled"),
+                        "status": v.get("status", ""),
+                        "steps": v.get("stepCount", 0)
                     })
                 self.send_response(200)
                 self.end_headers()
@@ -337,6 +874,21 @@ class PromptHandler(http.server.BaseHTTPRequestHandler):
                 self.wfile.write(b"Missing 'text' field")
                 return
 
+            if data.get('mode') == 'rpc':
+                print(f"Received RPC prompt: {text[:200]}")
+                cascade_id, error = submit_prompt_rpc(text, data.get('cascade_id'))
+                if error:
+                    print(f"RPC prompt failed: {error}")
+                    self.send_response(500)
+                    self.end_headers()
+                    self.wfile.write(error.encode('utf-8'))
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({"cascade_id": cascade_id}).encode('utf-8'))
+                return
+
             print(f"Received prompt: {text}")
             success = find_and_interact(text)
             
@@ -359,6 +911,7 @@ class PromptHandler(http.server.BaseHTTPRequestHandler):
 
             print(f"Received model request: {model}")
             success = find_and_select_model(model)
+            forget_requested_model()
             
             if success:
                 self.send_response(200)
@@ -373,10 +926,19 @@ class PromptHandler(http.server.BaseHTTPRequestHandler):
             self.send_response(404)
             self.end_headers()
 
-class ReuseAddrTCPServer(socketserver.TCPServer):
+class ReuseAddrThreadingTCPServer(socketserver.ThreadingTCPServer):
+    """One thread per request: bridge reads never queue behind a prompt's UI work.
+
+    Requests that drive the UI take their page's ui_lock instead.
+    """
     allow_reuse_address = True
+    daemon_threads = True
 
 if __name__ == "__main__":
-    with ReuseAddrTCPServer(("", PORT), PromptHandler) as httpd:
+    if FLAG_PATTERNS and FLAG_CALLBACK_URL:
+        scanner = FlagScanner(FLAG_PATTERNS, FLAG_CALLBACK_URL)
+        if scanner.patterns:
+            threading.Thread(target=scanner.run, daemon=True).start()
+    with ReuseAddrThreadingTCPServer(("", PORT), PromptHandler) as httpd:
         print(f"Server serving at port {PORT}")
         httpd.serve_forever()
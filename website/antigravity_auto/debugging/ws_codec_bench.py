@@ -0,0 +1,168 @@
+"""Micro-benchmark of ws_codec against the framing code it replaced.
+
+Encodes client (masked) frames and decodes server frames for a short prompt,
+a long prompt and a multi-MB DOM snapshot. The old code is the per-byte mask
+loop from autoprompt_server.encode_frame / CursorController.create_ws_frame
+and the old read_frame that grew its payload with ``data += chunk``. Reads go
+through an in-memory socket that hands out at most CHUNK bytes per call, like
+a loopback TCP socket. Decoding reads a stream of the same frame from one
+connection, about STREAM_BYTES in total, as a CDP client does.
+
+Decoding 100 KB frames is at parity: about 60% of the time is the UTF-8
+decode both versions do, and the rest is the one copy of the payload each
+makes (old: concatenating two recv chunks; new: receiving into a buffer of
+the payload's size). The gains are in encoding and in multi-MB frames.
+
+    python ws_codec_bench.py --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ws_codec  # noqa: E402
+
+CHUNK = 1 << 16
+STREAM_BYTES = 4 << 20
+
+
+def old_encode_frame(data):
+    frame = bytearray()
+    frame.append(0x81)
+    data_bytes = data.encode('utf-8')
+    length = len(data_bytes)
+    if length <= 125:
+        frame.append(0x80 | length)
+    elif length <= 65535:
+        frame.append(0x80 | 126)
+        frame.extend(struct.pack("!H", length))
+    else:
+        frame.append(0x80 | 127)
+        frame.extend(struct.pack("!Q", length))
+    masking_key = os.urandom(4)
+    frame.extend(masking_key)
+    masked_data = bytearray(length)
+    for i in range(length):
+        masked_data[i] = data_bytes[i] ^ masking_key[i % 4]
+    frame.extend(masked_data)
+    return frame
+
+
+def old_read_frame(sock):
+    head = sock.recv(2)
+    if not head:
+        return None
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", sock.recv(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", sock.recv(8))[0]
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data.decode('utf-8', errors='ignore')
+
+
+class MemorySocket:
+    """Serves ``data`` through recv / recv_into, at most CHUNK bytes per call."""
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def recv(self, n):
+        n = min(n, CHUNK, len(self.view) - self.pos)
+        data = bytes(self.view[self.pos:self.pos + n])
+        self.pos += n
+        return data
+
+    def recv_into(self, buffer):
+        n = min(len(buffer), CHUNK, len(self.view) - self.pos)
+        buffer[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def prompt(size):
+    line = "Find the flag in /challenge. Try strings, binwalk and ltrace on every binary first.\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+def dom_snapshot(size):
+    nodes = []
+    total = 0
+    node_id = 0
+    while total < size:
+        node = {"nodeId": node_id, "nodeName": "DIV", "localName": "div",
+                "attributes": ["class", f"monaco-list-row row-{node_id}", "role", "treeitem"],
+                "nodeValue": "", "childNodeCount": 3}
+        nodes.append(node)
+        total += len(json.dumps(node))
+        node_id += 1
+    return json.dumps({"id": 7, "result": {"root": {"nodeId": 0, "children": nodes}}})
+
+
+def old_decode(stream, count):
+    sock = MemorySocket(stream)
+    for _ in range(count):
+        old_read_frame(sock)
+
+
+def new_decode(stream, count):
+    ws = ws_codec.WebSocket(MemorySocket(stream))
+    for _ in range(count):
+        ws.recv_text()
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(name, size, op, old, new):
+    """One result row; ``old`` and ``new`` are seconds per byte."""
+    print(f"{name:<16} {size:>10} {op:<7} {old * 1e9:>10.3f} {new * 1e9:>10.3f} {old / new:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case; the best is reported')
+    args = parser.parse_args()
+
+    cases = [
+        ('prompt 1 KB', prompt(1 << 10)),
+        ('prompt 100 KB', prompt(100 << 10)),
+        ('DOM snapshot', dom_snapshot(4 << 20)),
+    ]
+    print(f"{'case':<16} {'size':>10} {'op':<7} {'old ms/MB':>10} {'new ms/MB':>10} {'speedup':>8}")
+    for name, text in cases:
+        size = len(text.encode('utf-8'))
+        # Frames go out masked (client to browser) and come back unmasked
+        server_frame = ws_codec.encode_frame(text, masked=False)
+        assert ws_codec.WebSocket(MemorySocket(ws_codec.encode_frame(text))).read_frame()[2] == text.encode()
+        assert old_read_frame(MemorySocket(server_frame)) == text
+        assert ws_codec.WebSocket(MemorySocket(server_frame)).recv_text() == text
+
+        old = timed(lambda: old_encode_frame(text), args.repeat)
+        new = timed(lambda: ws_codec.encode_frame(text), args.repeat)
+        report(name, size, 'encode', old / size, new / size)
+
+        count = max(1, STREAM_BYTES // len(server_frame))
+        stream = server_frame * count
+        old = timed(lambda: old_decode(stream, count), args.repeat)
+        new = timed(lambda: new_decode(stream, count), args.repeat)
+        report(name, size, 'decode', old / len(stream), new / len(stream))
+
+
+if __name__ == '__main__':
+    main()
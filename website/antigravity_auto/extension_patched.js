@@ -75,7 +75,14 @@
                              // Merge metadata into payload if not present, or create new object
                              const requestData = Object.assign({ metadata: meta }, payload);
                              
-                             const reqObj = new protos[requestClassName](requestData);
+                             let reqObj;
+                             if (data.json) {
+                                 // Payload in proto3 JSON form: enums by name, oneof members by field name
+                                 reqObj = protos[requestClassName].fromJson(payload, { ignoreUnknownFields: true });
+                                 if (meta && !reqObj.metadata) reqObj.metadata = meta;
+                             } else {
+                                 reqObj = new protos[requestClassName](requestData);
+                             }
                              
                              rpcClient[methodName](reqObj).then(response => {
                                  res.writeHead(200, {'Content-Type': 'application/json'});
@@ -0,0 +1,251 @@
+# WebSocket client framing (RFC 6455) for the CDP clients, standard library only.
+# The Cursor box uses this file too; its image build copies it in (see cursor_auto/docker-compose.yml).
+import os
+import socket
+import struct
+import base64
+import hashlib
+import threading
+import urllib.parse
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+HANDSHAKE_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Size of a connection's receive buffer; larger payloads are read into their own buffer
+BUFFER_SIZE = 1 << 16
+MAX_HANDSHAKE_BYTES = 1 << 14
+
+
+class WebSocketError(OSError):
+    """The peer broke the protocol (bad handshake or frame)."""
+
+
+def mask(payload, key):
+    """XOR ``payload`` with the 4-byte ``key`` repeated, as one big-int operation instead of a byte loop."""
+    n = len(payload)
+    if not n:
+        return b""
+    keystream = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "little") ^ int.from_bytes(keystream, "little")).to_bytes(n, "little")
+
+
+def frame_header(length, opcode=OP_TEXT, fin=True, masked=True):
+    first = (0x80 if fin else 0) | opcode
+    mask_bit = 0x80 if masked else 0
+    if length < 126:
+        return struct.pack("!BB", first, mask_bit | length)
+    if length < 1 << 16:
+        return struct.pack("!BBH", first, mask_bit | 126, length)
+    return struct.pack("!BBQ", first, mask_bit | 127, length)
+
+
+def encode_frame(payload, opcode=OP_TEXT, masked=True):
+    """One complete frame carrying ``payload`` (str is sent as UTF-8). Clients must mask."""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    if not masked:
+        return frame_header(len(payload), opcode, masked=False) + payload
+    key = os.urandom(4)
+    return b"".join((frame_header(len(payload), opcode), key, mask(payload, key)))
+
+
+class WebSocket:
+    """A client WebSocket over a connected socket.
+
+    Incoming bytes are read with recv_into into one reusable buffer, and
+    payloads are copied out once; a payload larger than the buffer is read
+    straight into a buffer of its own instead. Fragmented messages are reassembled, pings
+    answered, pongs dropped, and a close frame is answered and ends the
+    connection. send is safe to call from several threads; only one thread
+    may receive.
+    """
+
+    def __init__(self, sock, initial=b""):
+        self.sock = sock
+        self.buffer = bytearray(max(BUFFER_SIZE, len(initial)))
+        self.buffer[:len(initial)] = initial
+        self.start = 0
+        self.end = len(initial)
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def _fill(self, n):
+        """Make ``n`` bytes available from ``start``; False if the connection ends first."""
+        if self.end - self.start >= n:
+            return True
+        pending = self.end - self.start
+        if len(self.buffer) - self.start < n:
+            if n > len(self.buffer):
+                grown = bytearray(max(n, 2 * len(self.buffer)))
+                grown[:pending] = self.buffer[self.start:self.end]
+                self.buffer = grown
+            else:
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        with memoryview(self.buffer) as view:
+            while self.end - self.start < n:
+                got = self.sock.recv_into(view[self.end:])
+                if not got:
+                    return False
+                self.end += got
+        return True
+
+    def _read_payload(self, n):
+        """A bytearray of the next ``n`` bytes, received directly into it; None if the connection ends.
+
+        Going through the shared buffer would grow it, move the bytes that
+        follow the payload on every frame and copy the payload out again.
+        """
+        payload = bytearray(n)
+        buffered = min(n, self.end - self.start)
+        with memoryview(self.buffer) as source, memoryview(payload) as view:
+            view[:buffered] = source[self.start:self.start + buffered]
+            self.start += buffered
+            if self.start == self.end:
+                self.start = self.end = 0
+            received = buffered
+            while received < n:
+                got = self.sock.recv_into(view[received:])
+                if not got:
+                    return None
+                received += got
+        return payload
+
+    def _take(self, n):
+        with memoryview(self.buffer) as view:
+            data = bytes(view[self.start:self.start + n])
+        self.start += n
+        if self.start == self.end:
+            self.start = self.end = 0
+        return data
+
+    def read_frame(self):
+        """(fin, opcode, payload) of the next frame, or None if the connection ended.
+
+        The payload is bytes, or a bytearray if it was larger than BUFFER_SIZE.
+        """
+        if not self._fill(2):
+            return None
+        first, second = self.buffer[self.start], self.buffer[self.start + 1]
+        length = second & 0x7F
+        header = 2 if length < 126 else 4 if length == 126 else 10
+        masked = second & 0x80
+        if not self._fill(header + 4 if masked else header):
+            return None
+        start = self.start
+        if length == 126:
+            length = struct.unpack_from("!H", self.buffer, start + 2)[0]
+        elif length == 127:
+            length = struct.unpack_from("!Q", self.buffer, start + 2)[0]
+        key = None
+        if masked:
+            key = bytes(self.buffer[start + header:start + header + 4])
+            header += 4
+        self.start = start + header
+        if length > BUFFER_SIZE:
+            payload = self._read_payload(length)
+            if payload is None:
+                return None
+        elif not self._fill(length):
+            return None
+        else:
+            payload = self._take(length)
+        if key:
+            payload = mask(payload, key)
+        return bool(first & 0x80), first & 0x0F, payload
+
+    def recv_message(self):
+        """(opcode, payload) of the next text or binary message, or None once the connection is closed."""
+        parts = []
+        opcode = None
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                self.closed = True
+                return None
+            fin, op, payload = frame
+            if op == OP_PING:
+                self.send(payload, OP_PONG)
+                continue
+            if op == OP_PONG:
+                continue
+            if op == OP_CLOSE:
+                try:
+                    self.send(payload[:2], OP_CLOSE)
+                except OSError:
+                    pass
+                self.closed = True
+                return None
+            if op != OP_CONTINUATION:
+                opcode = op
+                parts = []
+            elif opcode is None:
+                raise WebSocketError("continuation frame without a message to continue")
+            parts.append(payload)
+            if fin:
+                return opcode, parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def recv_text(self):
+        """The next message decoded as UTF-8, or None once the connection is closed."""
+        message = self.recv_message()
+        return None if message is None else message[1].decode("utf-8", errors="replace")
+
+    def send(self, payload, opcode=OP_TEXT):
+        frame = encode_frame(payload, opcode)
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.send(struct.pack("!H", 1000), OP_CLOSE)
+            except OSError:
+                pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def connect(url, timeout=None):
+    """Open a WebSocket to a ws:// URL. The socket keeps ``timeout`` for later reads."""
+    parts = urllib.parse.urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        key = base64.b64encode(os.urandom(16))
+        sock.sendall((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key.decode()}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "\r\n"
+        ).encode())
+        response = b""
+        while b"\r\n\r\n" not in response:
+            chunk = sock.recv(4096)
+            if not chunk or len(response) > MAX_HANDSHAKE_BYTES:
+                raise WebSocketError("connection closed during the WebSocket handshake")
+            response += chunk
+        head, initial = response.split(b"\r\n\r\n", 1)
+        lines = head.split(b"\r\n")
+        if b" 101" not in lines[0]:
+            raise WebSocketError(f"WebSocket handshake refused: {lines[0][:100]!r}")
+        accept = base64.b64encode(hashlib.sha1(key + HANDSHAKE_GUID).digest())
+        headers = dict(line.split(b":", 1) for line in lines[1:] if b":" in line)
+        if {k.strip().lower(): v.strip() for k, v in headers.items()}.get(b"sec-websocket-accept") != accept:
+            raise WebSocketError("WebSocket handshake answered with the wrong Sec-WebSocket-Accept")
+        # Frames sent right after the handshake may have arrived with it
+        return WebSocket(sock, initial)
+    except Exception:
+        sock.close()
+        raise
@@ -4,8 +4,25 @@ import shutil
 import docker
 import requests
 import time
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+import threading
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
 from werkzeug.utils import secure_filename
+from trajectory_archive import TrajectoryArchive, is_valid_run_id
+from search_index import SearchIndex
+from trajectory import decode_conversation, decode_trajectory, trajectory_steps, step_records
+from profiler import profile_trajectory, parse_timestamp
+from store import Store, summarize_usage, ANALYTICS_GROUPS, CONTAINER_FILTERS
+from nodes import NodePool, load_nodes, copy_into_container, copy_files_into_container, NODE_LABEL
+from health import HealthScorer, HealthTracker, parse_docker_stats, WEDGED
+from boxlogs import LogRing, LineSplitter, LogFilter, tail, follow, LOG_SOURCES, BOX_LOG_FILES
+from images import ContextHasher, ImageNotReady, image_tag, built_images, pick_image, build_image, prune_images
+from resources import load_profiles, box_limits, NodeUsage, best_fit, parse_cpuset
+from model_seed import seed_model, ModelSeedError
+from blobs import (BlobStore, BlobFile, BlobHashMismatch, ChunkedUploads, UploadError,
+                   is_valid_sha256, is_valid_upload_id)
+from benchmark import (list_corpora, load_corpus, find_flag_step, measure_attempt, benchmark_report,
+                       ATTEMPT_PENDING, ATTEMPT_RUNNING, ATTEMPT_SOLVED, ATTEMPT_FAILED,
+                       ATTEMPT_TIMEOUT, ATTEMPT_ERROR, FINISHED_ATTEMPT_STATES)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', '/app/uploads')
@@ -16,8 +33,70 @@ app.config['CONTAINER_DATA_PATH'] = os.environ.get('CONTAINER_DATA_PATH', '/app/
 # Host paths for Docker volume mounts (when running in Docker, need host paths for sibling containers)
 app.config['HOST_CONTAINER_DATA_PATH'] = os.environ.get('HOST_CONTAINER_DATA_PATH', '/app/container_data')
 app.config['HOST_ACCOUNTS_PATH'] = os.environ.get('HOST_ACCOUNTS_PATH', '/accounts')
+# Content-addressed challenge files, bind-mounted read-only into boxes; keep it under CONTAINER_DATA_PATH so
+# nodes with shared storage can see it
+app.config['BLOB_PATH'] = os.environ.get('BLOB_PATH', os.path.join(app.config['CONTAINER_DATA_PATH'], '.blobs'))
+# Blobs no box uses, older than this many seconds, are deleted
+app.config['BLOB_GC_AGE'] = int(os.environ.get('BLOB_GC_AGE', '86400'))
+# Chunk size of resumable uploads (/api/uploads)
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
 # Docker host for accessing sibling containers' published ports
 app.config['DOCKER_HOST'] = os.environ.get('DOCKER_HOST_ADDRESS', 'host.docker.internal')
+# Docker daemons boxes are placed on: JSON list or path to a JSON file (empty = local daemon only)
+app.config['DOCKER_NODES'] = os.environ.get('DOCKER_NODES', '')
+# Boxes per node when a node does not set its own capacity (0 = unlimited)
+app.config['NODE_CAPACITY'] = int(os.environ.get('NODE_CAPACITY', '0'))
+# Box resource profiles (JSON or a JSON file path; see README), and how far CPU quotas may overcommit a node's shared cores
+app.config['RESOURCE_PROFILES'] = os.environ.get('RESOURCE_PROFILES', '')
+app.config['CPU_OVERCOMMIT'] = float(os.environ.get('CPU_OVERCOMMIT', '2'))
+# Trajectory archive (kept after containers are deleted)
+app.config['ARCHIVE_PATH'] = os.environ.get('ARCHIVE_PATH', '/app/archive')
+app.config['ARCHIVE_INTERVAL'] = int(os.environ.get('ARCHIVE_INTERVAL', '5'))
+app.config['SEARCH_DB_PATH'] = os.environ.get('SEARCH_DB_PATH', os.path.join(app.config['ARCHIVE_PATH'], 'search.db'))
+# Manager database (usage analytics)
+app.config['DATA_PATH'] = os.environ.get('DATA_PATH', '/app/data')
+app.config['DB_PATH'] = os.environ.get('DB_PATH', os.path.join(app.config['DATA_PATH'], 'manager.db'))
+# Model benchmarks: corpus directories of solved challenges
+app.config['BENCHMARK_CORPUS_PATH'] = os.environ.get('BENCHMARK_CORPUS_PATH', '/app/benchmarks')
+app.config['BENCHMARK_TIMEOUT'] = int(os.environ.get('BENCHMARK_TIMEOUT', '3600'))
+app.config['BENCHMARK_POLL_INTERVAL'] = int(os.environ.get('BENCHMARK_POLL_INTERVAL', '10'))
+# Background worker (worker.py): only the holder of this lock runs the periodic jobs
+app.config['WORKER_LOCK_PATH'] = os.environ.get('WORKER_LOCK_PATH', os.path.join(app.config['DATA_PATH'], 'worker.lock'))
+app.config['STATUS_INTERVAL'] = int(os.environ.get('STATUS_INTERVAL', '5'))
+# Container listing (/api/containers): default and largest page size, and how long removals stay visible
+app.config['CONTAINER_PAGE_SIZE'] = int(os.environ.get('CONTAINER_PAGE_SIZE', '200'))
+app.config['CONTAINER_PAGE_SIZE_MAX'] = int(os.environ.get('CONTAINER_PAGE_SIZE_MAX', '1000'))
+app.config['CONTAINER_TOMBSTONE_AGE'] = int(os.environ.get('CONTAINER_TOMBSTONE_AGE', '86400'))
+app.config['FLAG_CHECK_INTERVAL'] = int(os.environ.get('FLAG_CHECK_INTERVAL', '10'))
+# Flag scanning on the boxes: default regexes (JSON list; empty = DEFAULT_FLAG_PATTERNS), and the URL
+# boxes push hits to (empty = this manager through the Docker host, which only boxes on its own host reach)
+app.config['FLAG_PATTERNS'] = os.environ.get('FLAG_PATTERNS', '')
+app.config['FLAG_CALLBACK_URL'] = os.environ.get('FLAG_CALLBACK_URL', '')
+# How the initial prompt reaches a box: 'rpc' (straight to the language server through its bridge,
+# typed into the UI if that fails) or 'ui' (typed into the chat box)
+app.config['PROMPT_MODE'] = os.environ.get('PROMPT_MODE', 'rpc')
+# Box health: probe interval, failed probes before a box counts as wedged, grace after (re)start
+app.config['HEALTH_INTERVAL'] = int(os.environ.get('HEALTH_INTERVAL', '15'))
+app.config['HEALTH_PROBE_FAILURES'] = int(os.environ.get('HEALTH_PROBE_FAILURES', '3'))
+app.config['HEALTH_STARTUP_GRACE'] = int(os.environ.get('HEALTH_STARTUP_GRACE', '300'))
+# Restarts of a wedged box (within HEALTH_RESTART_WINDOW seconds) before it is redeployed instead
+app.config['HEALTH_MAX_RESTARTS'] = int(os.environ.get('HEALTH_MAX_RESTARTS', '1'))
+app.config['HEALTH_RESTART_WINDOW'] = int(os.environ.get('HEALTH_RESTART_WINDOW', '3600'))
+# Set to 0 to only report wedged boxes instead of restarting / redeploying them
+app.config['HEALTH_AUTO_REMEDIATE'] = os.environ.get('HEALTH_AUTO_REMEDIATE', '1') == '1'
+# Box logs kept per box (KB; 0 = do not collect), and the longest a log follow may stay open (seconds)
+app.config['LOG_BUFFER_KB'] = int(os.environ.get('LOG_BUFFER_KB', '256'))
+app.config['LOG_FOLLOW_TIMEOUT'] = int(os.environ.get('LOG_FOLLOW_TIMEOUT', '3600'))
+# Box images: seconds between checks of the build context (0 = never build; images are built by hand),
+# earlier builds kept per node for rollback, seconds before a failed build of the same context is
+# retried, and an image tag to pin boxes to
+app.config['IMAGE_CHECK_INTERVAL'] = int(os.environ.get('IMAGE_CHECK_INTERVAL', '60'))
+app.config['IMAGE_KEEP'] = int(os.environ.get('IMAGE_KEEP', '3'))
+app.config['IMAGE_RETRY_INTERVAL'] = int(os.environ.get('IMAGE_RETRY_INTERVAL', '600'))
+app.config['BOX_IMAGE'] = os.environ.get('BOX_IMAGE', '')
+# Flag extraction endpoint (OpenAI-compatible; the load-test harness points this at a stub)
+app.config['GROQ_API_URL'] = os.environ.get('GROQ_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
+app.config['PORT'] = int(os.environ.get('PORT', '8080'))
 
 NETWORK_NAME = 'boxnet'
 NETWORK_SUBNET = '10.4.4.0/24'
@@ -34,12 +113,90 @@ AVAILABLE_MODELS = [
     "GPT-OSS 120B (Medium)",
 ]
 
-def get_docker_client():
-    return docker.from_env()
+_node_pool = None
+
+def get_node_pool():
+    """Get the Docker nodes boxes are placed on, reading the node list on first use."""
+    global _node_pool
+    if _node_pool is None:
+        _node_pool = NodePool(load_nodes(app.config['DOCKER_NODES'], app.config['DOCKER_HOST'],
+                                         app.config['HOST_CONTAINER_DATA_PATH'], app.config['NODE_CAPACITY']))
+    return _node_pool
+
+_resource_profiles = None
+
+def get_resource_profiles():
+    """Get the box resource profiles, reading RESOURCE_PROFILES on first use."""
+    global _resource_profiles
+    if _resource_profiles is None:
+        _resource_profiles = load_profiles(app.config['RESOURCE_PROFILES'])
+    return _resource_profiles
+
+_archive = None
+
+def get_archive():
+    """Get the shared trajectory archive, opening it on first use."""
+    global _archive
+    if _archive is None:
+        _archive = TrajectoryArchive(app.config['ARCHIVE_PATH'])
+    return _archive
+
+_blob_store = None
+
+def get_blob_store():
+    """Get the content-addressed challenge file store, creating it on first use."""
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = BlobStore(app.config['BLOB_PATH'])
+    return _blob_store
+
+_chunked_uploads = None
+
+def get_chunked_uploads():
+    """Get the resumable upload sessions (kept next to the blob store)."""
+    global _chunked_uploads
+    if _chunked_uploads is None:
+        _chunked_uploads = ChunkedUploads(get_blob_store(), os.path.join(app.config['BLOB_PATH'], 'uploads'),
+                                          app.config['UPLOAD_CHUNK_SIZE'])
+    return _chunked_uploads
+
+_search_index = None
+
+def get_search_index():
+    """Get the shared full-text search index, opening it on first use."""
+    global _search_index
+    if _search_index is None:
+        _search_index = SearchIndex(app.config['SEARCH_DB_PATH'])
+    return _search_index
+
+_store = None
+
+def get_store():
+    """Get the manager database, opening it on first use."""
+    global _store
+    if _store is None:
+        _store = Store(app.config['DB_PATH'])
+        import_flags_file(_store)
+    return _store
+
+def get_box_api_url(container):
+    """Base URL of a container's autoprompt API (on whichever node it runs)."""
+    return f"http://{container['host']}:{container['api_port']}"
+
+def load_container_metadata(container_name):
+    """Read a container's metadata.json, or {} if it is missing."""
+    import json
+    metadata_file = os.path.join(app.config['CONTAINER_DATA_PATH'], container_name, 'metadata.json')
+    if not os.path.exists(metadata_file):
+        return {}
+    try:
+        with open(metadata_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-def ensure_network_exists():
-    """Ensure the boxnet network exists with the correct subnet."""
-    client = get_docker_client()
+def ensure_network_exists(client):
+    """Ensure the boxnet network exists on a node with the correct subnet."""
     try:
         network = client.networks.get(NETWORK_NAME)
         # Check if subnet is correct
@@ -64,14 +221,16 @@ def get_accounts():
             if os.path.isdir(os.path.join(accounts_path, d))]
 
 def get_next_container_number():
-    """Get the next available container number."""
-    client = get_docker_client()
-    containers = client.containers.list(all=True)
+    """Get the next available container number (unique across all nodes)."""
+    names = [c.name for _, c in get_node_pool().list_containers(CONTAINER_PREFIX)]
+    # Data directories also cover boxes on nodes that are unreachable right now
+    if os.path.exists(app.config['CONTAINER_DATA_PATH']):
+        names.extend(os.listdir(app.config['CONTAINER_DATA_PATH']))
     existing_numbers = []
-    for container in containers:
-        if container.name.startswith(CONTAINER_PREFIX):
+    for name in names:
+        if name.startswith(CONTAINER_PREFIX):
             try:
-                num = int(container.name.replace(CONTAINER_PREFIX, ''))
+                num = int(name.replace(CONTAINER_PREFIX, ''))
                 existing_numbers.append(num)
             except ValueError:
                 pass
@@ -80,11 +239,9 @@ def get_next_container_number():
     return max(existing_numbers) + 1
 
 def get_deployed_containers():
-    """Get list of all deployed antibox containers."""
-    client = get_docker_client()
-    containers = client.containers.list(all=True)
+    """Get list of all deployed antibox containers on every reachable node."""
     antibox_containers = []
-    for container in containers:
+    for node, container in get_node_pool().list_containers(CONTAINER_PREFIX):
         if container.name.startswith(CONTAINER_PREFIX):
             # Get container IP
             ip_address = None
@@ -123,21 +280,94 @@ def get_deployed_containers():
                 'display_name': nickname,
                 'id': container.short_id,
                 'status': container.status,
+                'started_at': parse_timestamp((container.attrs.get('State') or {}).get('StartedAt')),
                 'ip_address': ip_address,
                 'ports': ports,
                 'novnc_port': ports.get('6080/tcp'),
-                'api_port': ports.get('4020/tcp')
+                'api_port': ports.get('4020/tcp'),
+                'node': node.name,
+                'host': node.host,
+                'public_host': node.public_host,
+                'limits': box_limits(container.attrs.get('HostConfig'), (container.attrs.get('Config') or {}).get('Labels')),
             })
 
     # Sort by container number
     antibox_containers.sort(key=lambda x: int(x['name'].replace(CONTAINER_PREFIX, '')))
     return antibox_containers
 
-def find_available_port(start_port, count=3):
-    """Find a set of consecutive available ports."""
+def registry_entry(container, metadata=None):
+    """Registry row (see Store.list_containers) for a container from get_deployed_containers."""
+    if metadata is None:
+        metadata = load_container_metadata(container['name'])
+    return {
+        'name': container['name'],
+        'number': int(container['name'].replace(CONTAINER_PREFIX, '')),
+        'display_name': container['display_name'],
+        'container_id': container['id'],
+        'status': container['status'],
+        'node': container['node'],
+        'host': container['host'],
+        'public_host': container['public_host'],
+        'ip_address': container['ip_address'],
+        'ports': container['ports'],
+        'account': metadata.get('account'),
+        'model': metadata.get('model'),
+        'group_name': metadata.get('group'),
+        'challenge': metadata.get('challenge'),
+        'limits': container.get('limits'),
+    }
+
+def sync_container_registry():
+    """List the containers on every node into the registry; returns the listing.
+
+    Boxes on nodes that could not be listed keep their last known state.
+    """
+    containers = get_deployed_containers()
+    pool = get_node_pool()
+    available = {node.name for node in pool.available_nodes()}
+    unreachable = [node.name for node in pool.nodes if node.name not in available]
+    store = get_store()
+    store.sync_containers([registry_entry(c) for c in containers], unreachable)
+    store.set_meta('containers_synced_at', time.time())
+    return containers
+
+def ensure_container_registry():
+    """Fill the registry on first use, before the worker's first sweep."""
+    if get_store().get_meta('containers_synced_at') is None:
+        sync_container_registry()
+
+def registry_containers():
+    """Every listed box, from the registry the worker keeps; request handlers use this, not Docker."""
+    ensure_container_registry()
+    containers, _, _, _ = get_store().list_containers()
+    return containers
+
+def registry_container(container_name):
+    """One box from the registry, or None."""
+    ensure_container_registry()
+    return get_store().get_container(container_name)
+
+def find_box(container_name):
+    """(node, Docker container) of a box, asking the node the registry lists it on before all nodes.
+
+    Raises docker.errors.NotFound if there is no such container.
+    """
+    pool = get_node_pool()
+    entry = registry_container(container_name)
+    node = pool.get(entry['node']) if entry and entry['node'] else None
+    if node:
+        try:
+            return node, pool.client(node).containers.get(container_name)
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            pool.mark_down(node, e)
+    return pool.find_container(container_name)
+
+def find_available_port(node, start_port, count=3):
+    """Find a set of consecutive available ports on a node."""
     import socket
-    client = get_docker_client()
-    containers = client.containers.list(all=True)
+    containers = get_node_pool().client(node).containers.list(all=True)
 
     # Collect all used ports
     used_ports = set()
@@ -158,7 +388,9 @@ def find_available_port(start_port, count=3):
             if (port + i) in used_ports:
                 ports_available = False
                 break
-            # Also check if port is in use by system
+            # Also check if port is in use by system (only visible for the local node)
+            if not node.is_local:
+                continue
             try:
                 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                     s.settimeout(1)
@@ -187,53 +419,73 @@ def deploy():
         model = request.form.get('model', 'Gemini Pro 3 High')
         nickname = request.form.get('nickname', '')
         flag_detection = request.form.get('flag_detection', 'off') == 'on'
+        flag_pattern = request.form.get('flag_pattern', '').strip()
         challenge_description = request.form.get('challenge_description', '')
+        group = request.form.get('group', '').strip()
 
-        # Handle file uploads
+        # Files already in the blob store (uploaded through /api/blobs), plus any sent inline
+        import json
         files = request.files.getlist('files')
+        try:
+            blob_refs = json.loads(request.form.get('blobs') or '[]')
+        except ValueError:
+            return jsonify({'error': 'Invalid blobs list'}), 400
+        if not isinstance(blob_refs, list):
+            return jsonify({'error': 'blobs must be a list of {sha256, name} objects'}), 400
 
         # Validate
         if not account:
             return jsonify({'error': 'Please select an account'}), 400
+        import re
+        try:
+            re.compile(flag_pattern)
+        except re.error as e:
+            return jsonify({'error': f'Invalid flag pattern: {e}'}), 400
+        store = get_blob_store()
+        for ref in blob_refs:
+            if not isinstance(ref, dict) or not is_valid_sha256(ref.get('sha256')) \
+                    or not isinstance(ref.get('name'), str) or not ref['name']:
+                return jsonify({'error': f'Invalid blob reference: {ref}'}), 400
+        missing = store.missing([ref['sha256'] for ref in blob_refs])
+        if missing:
+            return jsonify({'error': 'Files are not uploaded yet', 'missing': missing}), 409
+        files = [BlobFile(store, ref['sha256'], ref['name']) for ref in blob_refs] + files
 
         try:
-            result = deploy_container(account, model, nickname, flag_detection, challenge_description, files)
+            result = deploy_container(account, model, nickname, flag_detection, challenge_description, files,
+                                      group=group, flag_patterns=[flag_pattern] if flag_detection and flag_pattern else None)
             return jsonify(result)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
     # GET request - show deploy form
     accounts = get_accounts()
-    return render_template('deploy.html', accounts=accounts, models=AVAILABLE_MODELS)
-
-def deploy_container(account, model, nickname, flag_detection, challenge_description, files):
-    """Deploy a new antibox container."""
-    client = get_docker_client()
-
-    # Ensure network exists
-    ensure_network_exists()
+    return render_template('deploy.html', accounts=accounts, models=AVAILABLE_MODELS,
+                           groups=get_container_groups())
+
+def deploy_container(account, model, nickname, flag_detection, challenge_description, files, challenge=None,
+                     group=None, auto_redeploy=True, replaces=None, flag_patterns=None):
+    """Deploy a new antibox container.
+
+    ``challenge`` labels the box in analytics; the nickname is used when it is not given.
+    ``group`` is a free-form label the container listing can be filtered on.
+    ``auto_redeploy`` lets the health monitor move the run to a fresh box if
+    this one wedges; ``replaces`` names the box this one was redeployed from.
+    ``flag_patterns`` are the regexes the box scans its trajectories for; with
+    flag detection on they default to the configured ones.
+    """
+    pool = get_node_pool()
 
     # Get next container number and name
     container_num = get_next_container_number()
     container_name = f"{CONTAINER_PREFIX}{container_num}"
 
-    # Find available ports (need 3: 6080, 5000, 4020)
-    base_port = find_available_port(6080 + (container_num - 1) * 10, 3)
-    port_6080 = base_port
-    port_5000 = base_port + 1
-    port_4020 = base_port + 2
-
     # Create temporary directories for this container
     # Local paths (inside this container, for file operations)
     container_data_path = os.path.join(app.config['CONTAINER_DATA_PATH'], container_name)
     chal_path = os.path.join(container_data_path, 'chal')
     antigravity_data_path = os.path.join(container_data_path, 'antigravity-data')
 
-    # Host paths (for Docker volume mounts on sibling containers)
-    host_container_data_path = os.path.join(app.config['HOST_CONTAINER_DATA_PATH'], container_name)
-    host_chal_path = os.path.join(host_container_data_path, 'chal')
-    host_antigravity_data_path = os.path.join(host_container_data_path, 'antigravity-data')
-
     # Clean up if exists
     if os.path.exists(container_data_path):
         shutil.rmtree(container_data_path)
@@ -243,12 +495,28 @@ def deploy_container(account, model, nickname, flag_detection, challenge_descrip
 
     # Save container metadata (nickname, etc.)
     import json
+    import secrets
     metadata = {
+        # Box names are reused once a box is removed; this tells the deploys apart
+        'deploy_id': secrets.token_hex(8),
         'nickname': nickname or container_name,
         'account': account,
         'model': model,
-        'flag_detection': flag_detection
+        'flag_detection': flag_detection,
+        'challenge': challenge or nickname or container_name,
+        'group': group or None,
+        # Everything needed to redeploy the run on a fresh box
+        'challenge_description': challenge_description,
+        'files': [],
+        'auto_redeploy': auto_redeploy,
+        'replaces': replaces
     }
+    # The box scans its own trajectories and pushes hits to /api/flag_event, signed with this token
+    if flag_patterns is None and flag_detection:
+        flag_patterns = default_flag_patterns()
+    flag_patterns = valid_flag_patterns(flag_patterns or [])
+    metadata['flag_patterns'] = flag_patterns
+    metadata['flag_token'] = secrets.token_urlsafe(16) if flag_patterns else None
     with open(os.path.join(container_data_path, 'metadata.json'), 'w') as f:
         json.dump(metadata, f)
 
@@ -271,55 +539,81 @@ def deploy_container(account, model, nickname, flag_detection, challenge_descrip
     if os.path.exists(account_source):
         shutil.copytree(account_source, antigravity_data_path, dirs_exist_ok=True, ignore=ignore_special_files)
 
-    # Save uploaded files to chal directory
+    # Boot the IDE on the chosen model, instead of picking it in the UI once it is up
+    try:
+        seed_model(antigravity_data_path, model)
+        metadata['model_seeded'] = True
+    except ModelSeedError as e:
+        print(f"Could not pre-seed the model of {container_name}, selecting it after boot: {e}")
+        metadata['model_seeded'] = False
+
+    # Challenge files stay in the blob store and are mounted into the box; a later file of the same name wins
+    chal_files = {}
     for file in files:
         if file and file.filename:
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(chal_path, filename))
-
-    # Build the image if not exists
-    image_name = 'antigravity_auto'
-    try:
-        client.images.get(image_name)
-    except docker.errors.ImageNotFound:
-        # Build from antigravity_auto directory
-        print(f"Building image {image_name}...")
-        client.images.build(
-            path=app.config['ANTIGRAVITY_AUTO_PATH'],
-            tag=image_name,
-            rm=True
-        )
+            chal_files[secure_filename(file.filename)] = store_challenge_file(file).sha256
+    metadata['files'] = [{'name': name, 'sha256': sha256} for name, sha256 in chal_files.items()]
+
+    # Place the box on the node its resource profile fits tightest; if a node fails, fall over to the next one
+    profile = get_resource_profiles().profile_for(model, metadata['challenge'])
+    metadata['profile'] = profile.name
+    with _placement_lock:
+        containers = get_deployed_containers()
+        load = {}
+        for c in containers:
+            load[c['node']] = load.get(c['node'], 0) + 1
+        candidates = best_fit(node_usages(pool.placement_order(load), containers), profile)
+        if not candidates:
+            shutil.rmtree(container_data_path, ignore_errors=True)
+            raise Exception(f'No Docker node has room for another box with the {profile.name!r} resource profile')
+        last_error = None
+        for node, usage in candidates:
+            cpuset = usage.pick_cores(profile) if profile.dedicated else (usage.shared_cores() if usage.dedicated_cores else None)
+            try:
+                container, ports = start_box_on_node(node, container_name, container_num,
+                                                     chal_path, antigravity_data_path, profile, cpuset,
+                                                     flag_scan_environment(container_name, metadata),
+                                                     metadata['files'])
+                break
+            except (docker.errors.APIError, ImageNotReady) as e:
+                # The daemon answered but refused (e.g. out of memory) or has no image yet; try the next node
+                print(f"Failed to start {container_name} on node {node.name}: {e}")
+                last_error = e
+            except Exception as e:
+                pool.mark_down(node, e)
+                last_error = e
+        else:
+            shutil.rmtree(container_data_path, ignore_errors=True)
+            raise Exception(f'Could not start the box on any node: {last_error}')
+        if profile.dedicated:
+            rebalance_cpusets(node)
+    port_6080, port_5000, port_4020 = ports
+
+    metadata['node'] = node.name
+    metadata['image'] = container.attrs.get('Config', {}).get('Image')
+    with open(os.path.join(container_data_path, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f)
 
-    # Calculate IP address for this container
+    # Calculate IP address for this container (on the node's own boxnet)
     ip_address = f"10.4.4.{container_num + 1}"
 
-    # Create and start container (use host paths for volumes so sibling containers can access)
-    container = client.containers.run(
-        image_name,
-        name=container_name,
-        hostname=container_name,
-        detach=True,
-        ports={
-            '6080/tcp': port_6080,
-            '5000/tcp': port_5000,
-            '4020/tcp': port_4020
-        },
-        volumes={
-            host_chal_path: {'bind': '/home/chal', 'mode': 'rw'},
-            host_antigravity_data_path: {'bind': '/root/.config/antigravity-data', 'mode': 'rw'}
-        },
-        environment={
-            'VNC_RESOLUTION': '1280x800'
-        },
-        shm_size='2g',
-        network=NETWORK_NAME
-    )
+    # List the box right away instead of on the worker's next sweep
+    get_store().upsert_container(registry_entry({
+        'name': container_name,
+        'display_name': metadata['nickname'],
+        'id': container.short_id,
+        'status': 'running',
+        'node': node.name,
+        'host': node.host,
+        'public_host': node.public_host,
+        'ip_address': ip_address,
+        'ports': {'6080/tcp': str(port_6080), '5000/tcp': str(port_5000), '4020/tcp': str(port_4020)},
+        'limits': box_limits(container.attrs.get('HostConfig'), (container.attrs.get('Config') or {}).get('Labels')),
+    }, metadata))
 
     # Start background initialization (model change, prompt) so deploy returns immediately
-    import threading
     def background_init():
-        docker_host = app.config['DOCKER_HOST']
-        api_url = f"http://{docker_host}:{port_4020}"
+        api_url = f"http://{node.host}:{port_4020}"
         
         # Wait for API to be available
         max_retries = 60
@@ -335,8 +629,8 @@ def deploy_container(account, model, nickname, flag_detection, challenge_descrip
         # Wait additional time for the Antigravity extension to fully initialize
         time.sleep(15)
         
-        # Change model if not default
-        if model != "Gemini Pro 3 (High)":
+        # Change model if not default and not already seeded into the profile
+        if not metadata['model_seeded'] and model != "Gemini Pro 3 (High)":
             try:
                 requests.post(
                     f"{api_url}/model",
@@ -349,11 +643,18 @@ def deploy_container(account, model, nickname, flag_detection, challenge_descrip
         # Send challenge description as prompt
         if challenge_description:
             try:
-                requests.post(
+                response = requests.post(
                     f"{api_url}/prompt",
-                    json={'text': challenge_description},
+                    json={'text': challenge_description, 'mode': app.config['PROMPT_MODE']},
                     timeout=30
                 )
+                if app.config['PROMPT_MODE'] == 'rpc' and response.status_code != 200:
+                    print(f"RPC prompt failed on {container_name} ({response.text[:200]}); typing it instead")
+                    requests.post(
+                        f"{api_url}/prompt",
+                        json={'text': challenge_description},
+                        timeout=30
+                    )
             except requests.exceptions.RequestException as e:
                 print(f"Warning: Failed to send prompt: {e}")
     
@@ -362,7 +663,9 @@ def deploy_container(account, model, nickname, flag_detection, challenge_descrip
     return {
         'success': True,
         'container_name': container_name,
+        'deploy_id': metadata['deploy_id'],
         'container_id': container.short_id,
+        'node': node.name,
         'ip_address': ip_address,
         'ports': {
             'novnc': port_6080,
@@ -371,67 +674,471 @@ def deploy_container(account, model, nickname, flag_detection, challenge_descrip
         }
     }
 
+def chal_file_mounts(node, files):
+    """Read-only bind mounts of challenge files the node can see, and (path, name) of those it cannot.
+
+    A node sees the blob store when it has shared storage and BLOB_PATH is
+    under CONTAINER_DATA_PATH; every box then reads the one stored copy and
+    cannot write to it. Elsewhere the files are copied into the box.
+    """
+    store = get_blob_store()
+    mounts = []
+    copies = []
+    for f in files:
+        source = store.path(f['sha256'])
+        relative = os.path.relpath(source, app.config['CONTAINER_DATA_PATH'])
+        if node.data_path and not relative.startswith(os.pardir):
+            mounts.append(docker.types.Mount(f"/home/chal/{f['name']}", os.path.join(node.data_path, relative),
+                                             type='bind', read_only=True))
+        else:
+            copies.append((source, f['name']))
+    return mounts, copies
+
+def start_box_on_node(node, container_name, container_num, chal_path, antigravity_data_path, profile, cpuset=None,
+                      environment=None, files=()):
+    """Create and start a box on one node with a resource profile's limits (pinned to ``cpuset``).
+
+    ``environment`` is added to the box's environment (e.g. its flag scanner settings).
+    ``files`` are the challenge files ({name, sha256}) put into /home/chal from the blob store.
+
+    Returns (container, (novnc, reserved, api) ports).
+    """
+    client = get_node_pool().client(node)
+
+    # Ensure network exists
+    ensure_network_exists(client)
+
+    # Find available ports (need 3: 6080, 5000, 4020)
+    base_port = find_available_port(node, 6080 + (container_num - 1) * 10, 3)
+    port_6080 = base_port
+    port_5000 = base_port + 1
+    port_4020 = base_port + 2
+
+    # Images are built by the worker ahead of time; never build on the deploy path
+    image_name = pick_image(client, get_context_hasher().hash(), app.config['BOX_IMAGE'])
+
+    volumes = {}
+    if node.data_path:
+        # Node sees container_data: use its paths for volumes so sibling containers can access
+        host_container_data_path = os.path.join(node.data_path, container_name)
+        volumes = {
+            os.path.join(host_container_data_path, 'chal'): {'bind': '/home/chal', 'mode': 'rw'},
+            os.path.join(host_container_data_path, 'antigravity-data'): {'bind': '/root/.config/antigravity-data', 'mode': 'rw'}
+        }
+    mounts, copies = chal_file_mounts(node, files)
+
+    container = client.containers.create(
+        image_name,
+        name=container_name,
+        hostname=container_name,
+        ports={
+            '6080/tcp': port_6080,
+            '5000/tcp': port_5000,
+            '4020/tcp': port_4020
+        },
+        volumes=volumes,
+        mounts=mounts,
+        environment=dict({
+            'VNC_RESOLUTION': '1280x800'
+        }, **(environment or {})),
+        # Lets the box's flag scanner reach a manager on the Docker host
+        extra_hosts={'host.docker.internal': 'host-gateway'},
+        labels=dict(profile.labels(), **{NODE_LABEL: node.name}),
+        network=NETWORK_NAME,
+        **profile.container_kwargs(cpuset)
+    )
+    try:
+        if not node.data_path:
+            # No shared storage on this node: copy the files in before the first start
+            copy_into_container(container, chal_path, '/home/chal')
+            copy_into_container(container, antigravity_data_path, '/root/.config/antigravity-data')
+        if copies:
+            copy_files_into_container(container, copies, '/home/chal')
+        container.start()
+    except Exception:
+        container.remove(force=True)
+        raise
+    return container, (port_6080, port_5000, port_4020)
+
+# ============== BOX RESOURCES ==============
+
+# Placement reads what each node has left and then claims part of it; one deploy at a time
+_placement_lock = threading.Lock()
+
+def node_usage(node, containers):
+    """What the boxes on a node were given (from their containers' limits) against its CPUs and memory."""
+    capacity = get_node_pool().resources(node)
+    usage = NodeUsage(capacity['cpus'], capacity['memory'], app.config['CPU_OVERCOMMIT'])
+    for c in containers:
+        # Stopped boxes hold nothing until they are started again
+        if c['node'] == node.name and c['status'] not in ('exited', 'dead'):
+            usage.add(c['limits'])
+    return usage
+
+def node_usages(nodes, containers):
+    """(node, NodeUsage) for each node that answers."""
+    pool = get_node_pool()
+    usages = []
+    for node in nodes:
+        try:
+            usages.append((node, node_usage(node, containers)))
+        except Exception as e:
+            pool.mark_down(node, e)
+    return usages
+
+def rebalance_cpusets(node):
+    """Keep a node's shared boxes off the cores of its dedicated boxes, and give freed cores back."""
+    containers = get_deployed_containers()
+    usage = node_usage(node, containers)
+    shared = usage.shared_cores()
+    client = get_node_pool().client(node)
+    for c in containers:
+        if c['node'] != node.name or c['limits']['dedicated']:
+            continue
+        current = parse_cpuset(c['limits']['cpuset']) if c['limits']['cpuset'] else list(range(usage.cpus))
+        if current != shared:
+            try:
+                client.containers.get(c['name']).update(cpuset_cpus=','.join(map(str, shared)))
+            except Exception as e:
+                print(f"Could not move {c['name']} to the shared cores of node {node.name}: {e}")
+
+@app.route('/api/resources')
+def api_resources():
+    """Resource profiles, and per node what its boxes were given against what it has."""
+    pool = get_node_pool()
+    containers = registry_containers()
+    return jsonify({
+        'profiles': get_resource_profiles().to_dict(),
+        'nodes': {node.name: usage.to_dict() for node, usage in node_usages(pool.available_nodes(), containers)},
+    })
+
+# ============== BOX IMAGES ==============
+
+_context_hasher = None
+
+def get_context_hasher():
+    """Get the digest of the box image's build context (ANTIGRAVITY_AUTO_PATH)."""
+    global _context_hasher
+    if _context_hasher is None:
+        _context_hasher = ContextHasher(app.config['ANTIGRAVITY_AUTO_PATH'])
+    return _context_hasher
+
+def ensure_node_image(node, context_hash, failed):
+    """Build the current context's image on a node if it is missing. Returns the node's image status.
+
+    ``failed`` maps (node, context hash) to when a build last failed, so a
+    broken context is not rebuilt on every check.
+    """
+    pool = get_node_pool()
+    tag = image_tag(context_hash)
+    status = {'state': 'ready', 'error': None}
+    try:
+        client = pool.client(node)
+        tags = [t for _, t, _ in built_images(client)]
+        if tag not in tags:
+            failed_at = failed.get((node.name, context_hash))
+            if failed_at is not None and time.time() - failed_at < app.config['IMAGE_RETRY_INTERVAL']:
+                status['state'] = 'failed'
+                status['error'] = 'Build failed; retrying later'
+            else:
+                print(f"Building image {tag} on node {node.name}...")
+                started = time.time()
+                try:
+                    build_image(client, app.config['ANTIGRAVITY_AUTO_PATH'], context_hash)
+                    failed.pop((node.name, context_hash), None)
+                    print(f"Built image {tag} on node {node.name} in {time.time() - started:.0f}s")
+                except (docker.errors.BuildError, docker.errors.APIError) as e:
+                    failed[(node.name, context_hash)] = time.time()
+                    print(f"Building image {tag} on node {node.name} failed: {e}")
+                    status['state'] = 'failed'
+                    status['error'] = str(e)
+        if status['state'] == 'ready':
+            for removed in prune_images(client, app.config['IMAGE_KEEP']):
+                print(f"Removed old image {removed} from node {node.name}")
+        status['images'] = [t for _, t, _ in built_images(client)]
+        pool.mark_up(node)
+    except Exception as e:
+        pool.mark_down(node, e)
+        status = {'state': 'unreachable', 'error': str(e), 'images': []}
+    status['updated_at'] = time.time()
+    return status
+
+def background_image_builder():
+    """Build the box image on every node at startup and whenever its build context changes.
+
+    Each build is tagged with the context's digest; until a node has the new
+    one, boxes there keep starting from its newest earlier build.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    if not app.config['IMAGE_CHECK_INTERVAL']:
+        return
+    print("Starting image builder...")
+    failed = {}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        while True:
+            try:
+                context_hash = get_context_hasher().hash()
+                nodes = get_node_pool().available_nodes()
+                statuses = executor.map(lambda n: ensure_node_image(n, context_hash, failed), nodes)
+                get_store().set_meta('images', {
+                    'context_hash': context_hash,
+                    'tag': image_tag(context_hash),
+                    'nodes': {node.name: status for node, status in zip(nodes, statuses)},
+                })
+            except Exception as e:
+                print(f"Image builder error: {e}")
+            time.sleep(app.config['IMAGE_CHECK_INTERVAL'])
+
+@app.route('/api/images')
+def api_images():
+    """The current box image tag and, per node, whether it is built and which builds are kept."""
+    images = get_store().get_meta('images', {'context_hash': None, 'tag': None, 'nodes': {}})
+    images['pinned'] = app.config['BOX_IMAGE'] or None
+    return jsonify(images)
+
+# ============== UPLOADS ==============
+
+def store_challenge_file(file):
+    """Put an uploaded or benchmark corpus file into the blob store; returns it as a BlobFile."""
+    if isinstance(file, BlobFile):
+        return file
+    store = get_blob_store()
+    if hasattr(file, 'path'):
+        sha256, _ = store.put_file(file.path)
+    else:
+        sha256, _ = store.put_stream(file.stream)
+    return BlobFile(store, sha256, file.filename)
+
+@app.route('/api/uploads/check', methods=['POST'])
+def api_uploads_check():
+    """Which of the given SHA-256 digests still need uploading."""
+    hashes = (request.get_json(silent=True) or {}).get('hashes', [])
+    if not isinstance(hashes, list) or not all(is_valid_sha256(h) for h in hashes):
+        return jsonify({'error': 'hashes must be a list of lowercase hex SHA-256 digests'}), 400
+    return jsonify({'missing': get_blob_store().missing(hashes)})
+
+@app.route('/api/blobs/<sha256>', methods=['PUT'])
+def api_put_blob(sha256):
+    """Store the request body under its SHA-256, streamed to disk and verified."""
+    if not is_valid_sha256(sha256):
+        return jsonify({'error': 'Invalid SHA-256'}), 400
+    store = get_blob_store()
+    if store.has(sha256):
+        return jsonify({'sha256': sha256, 'existing': True})
+    try:
+        sha256, size = store.put_stream(request.stream, sha256)
+    except BlobHashMismatch as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'sha256': sha256, 'size': size, 'existing': False})
+
+@app.route('/api/blobs', methods=['POST'])
+def api_post_blob():
+    """Store the request body and return its SHA-256 (for clients that cannot hash locally)."""
+    sha256, size = get_blob_store().put_stream(request.stream)
+    return jsonify({'sha256': sha256, 'size': size})
+
+@app.route('/api/uploads', methods=['POST'])
+def api_create_upload():
+    """Start or resume a chunked upload of ``{"name", "size", "sha256"}`` (sha256 optional).
+
+    The response lists the chunk size, chunk count and chunks already
+    received; a file the store already has comes back ``complete``.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = get_chunked_uploads().create(data.get('name') or 'file', data.get('size'), data.get('sha256'))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(upload)
+
+@app.route('/api/uploads/<upload_id>')
+def api_get_upload(upload_id):
+    """State of a chunked upload; ``sha256`` is the file handle for /deploy once ``complete``."""
+    upload = get_chunked_uploads().get(upload_id) if is_valid_upload_id(upload_id) else None
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload)
+
+@app.route('/api/uploads/<upload_id>/chunk/<int:index>', methods=['PUT'])
+def api_put_upload_chunk(upload_id, index):
+    """Store one chunk (raw body); X-Chunk-SHA256 is checked when sent."""
+    if not is_valid_upload_id(upload_id):
+        return jsonify({'error': 'Upload not found'}), 404
+    chunk_sha256 = request.headers.get('X-Chunk-SHA256')
+    if chunk_sha256 is not None and not is_valid_sha256(chunk_sha256):
+        return jsonify({'error': 'Invalid X-Chunk-SHA256'}), 400
+    try:
+        get_chunked_uploads().put_chunk(upload_id, index, request.stream, chunk_sha256)
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except (UploadError, BlobHashMismatch) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'index': index, 'stored': True})
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def api_complete_upload(upload_id):
+    """Assemble a fully received upload into the blob store in the background."""
+    if not is_valid_upload_id(upload_id):
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        upload = get_chunked_uploads().complete(upload_id)
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(upload), 200 if upload['state'] == 'complete' else 202
+
+def referenced_blobs():
+    """Hashes of the challenge files of every box that still has a data directory."""
+    data_path = app.config['CONTAINER_DATA_PATH']
+    hashes = set()
+    if os.path.exists(data_path):
+        for name in os.listdir(data_path):
+            if name.startswith(CONTAINER_PREFIX):
+                hashes.update(f['sha256'] for f in load_container_metadata(name).get('files', []))
+    return hashes
+
+def background_blob_gc():
+    """Periodically delete challenge files no box uses any more, and abandoned uploads."""
+    print("Starting blob garbage collector...")
+    while True:
+        try:
+            get_chunked_uploads().collect_garbage(app.config['BLOB_GC_AGE'])
+            freed = get_blob_store().collect_garbage(app.config['BLOB_GC_AGE'], referenced_blobs())
+            if freed:
+                print(f"Blob GC freed {freed} bytes")
+        except Exception as e:
+            print(f"Blob GC error: {e}")
+        time.sleep(3600)
+
+# ============== CONTAINER LISTING ==============
+
+def get_container_groups():
+    """Groups of the listed containers, for the deploy and monitor filters."""
+    ensure_container_registry()
+    containers, _, _, _ = get_store().list_containers()
+    return sorted({c['group'] for c in containers if c['group']})
+
+def parse_container_filters(args):
+    """Filters from the query string; each may repeat or hold comma-separated values."""
+    filters = {}
+    for key in CONTAINER_FILTERS:
+        values = [v for arg in args.getlist(key) for v in arg.split(',') if v]
+        if values:
+            filters[key] = values
+    return filters
+
 @app.route('/monitor')
 def monitor():
-    containers = get_deployed_containers()
-    return render_template('monitor.html', containers=containers)
+    ensure_container_registry()
+    containers, _, as_of, _ = get_store().list_containers()
+    groups = sorted({c['group'] for c in containers if c['group']})
+    return render_template('monitor.html', containers=containers, containers_as_of=as_of, groups=groups,
+                           compact_field_limit=COMPACT_FIELD_LIMIT)
 
 @app.route('/api/containers')
 def api_containers():
-    """Get list of deployed containers."""
-    return jsonify(get_deployed_containers())
+    """List deployed containers from the registry the worker keeps.
+
+    Filters: ``status``, ``group``, ``model``, ``account``, ``node``. Pages hold
+    ``limit`` containers; pass ``next_cursor`` back as ``cursor`` for the next
+    one. ``changed_since`` (the ``as_of`` of an earlier listing) returns only
+    containers changed since, with removed ones as ``{'name', 'removed': true}``.
+    """
+    limit = request.args.get('limit', app.config['CONTAINER_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['CONTAINER_PAGE_SIZE_MAX']))
+    ensure_container_registry()
+    containers, next_cursor, as_of, reset = get_store().list_containers(
+        parse_container_filters(request.args), request.args.get('cursor', type=int), limit,
+        request.args.get('changed_since', type=float))
+    return jsonify({'containers': containers, 'next_cursor': next_cursor, 'as_of': as_of, 'reset': reset})
+
+def get_box_status(container):
+    """Ask a box which of its conversations are still running."""
+    container_info = {
+        'name': container['name'],
+        'status': container['status'],
+        'conversations': []
+    }
+    if container['status'] != 'running' or not container.get('api_port'):
+        return container_info
+    api_url = get_box_api_url(container)
+    # Every call's outcome feeds the box's API error rate (see BOX HEALTH)
+    tracker = get_health_tracker()
+    try:
+        # Get conversations list
+        response = requests.get(f"{api_url}/conversations", timeout=5)
+        tracker.record_call(container['name'], response.status_code == 200)
+        if response.status_code == 200 and response.text:
+            for conv in response.json():
+                conv_status = {'id': conv.get('id'), 'name': conv.get('name', ''), 'completed': False}
+                if 'status' in conv:
+                    # Boxes list each conversation's run status; older ones need the conversation fetched
+                    conv_status['completed'] = conv['status'] == 'CASCADE_RUN_STATUS_IDLE'
+                    conv_status['run_status'] = conv['status']
+                    container_info['conversations'].append(conv_status)
+                    continue
+                # Get individual conversation status
+                try:
+                    conv_response = requests.get(f"{api_url}/conversation/{conv['id']}", timeout=5)
+                    tracker.record_call(container['name'], conv_response.status_code == 200)
+                    if conv_response.status_code == 200:
+                        status = decode_trajectory(conv_response.text).status
+                        conv_status['completed'] = status == 'CASCADE_RUN_STATUS_IDLE'
+                        conv_status['run_status'] = status
+                except requests.exceptions.RequestException:
+                    tracker.record_call(container['name'], False)
+                except ValueError:
+                    pass
+                container_info['conversations'].append(conv_status)
+    except requests.exceptions.RequestException:
+        tracker.record_call(container['name'], False)
+    except ValueError:
+        pass
+    return container_info
+
+def background_status_poller():
+    """Periodically refresh the container registry and poll every box's conversation status into the store."""
+    from concurrent.futures import ThreadPoolExecutor
+    print("Starting background status poller...")
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        while True:
+            try:
+                boxes = list(pool.map(get_box_status, sync_container_registry()))
+                get_store().replace_box_status(boxes)
+                get_store().prune_container_tombstones(app.config['CONTAINER_TOMBSTONE_AGE'])
+            except Exception as e:
+                print(f"Background status poller error: {e}")
+            time.sleep(app.config['STATUS_INTERVAL'])
+
+@app.route('/api/nodes')
+def api_nodes():
+    """Docker nodes with reachability and how many boxes each holds."""
+    load = {}
+    for c in registry_containers():
+        load[c['node']] = load.get(c['node'], 0) + 1
+    return jsonify(get_node_pool().status(load))
 
 @app.route('/api/containers/status')
 def api_containers_status():
-    """Get status of all containers including conversation completion state."""
-    containers = get_deployed_containers()
-    docker_host = app.config['DOCKER_HOST']
-    result = []
-    
-    for container in containers:
-        container_info = {
-            'name': container['name'],
-            'status': container['status'],
-            'conversations': []
-        }
-        
-        if container['status'] == 'running' and container.get('api_port'):
-            try:
-                # Get conversations list
-                response = requests.get(
-                    f"http://{docker_host}:{container['api_port']}/conversations",
-                    timeout=5
-                )
-                if response.status_code == 200 and response.text:
-                    conversations = response.json()
-                    for conv in conversations:
-                        conv_status = {'id': conv.get('id'), 'name': conv.get('name', ''), 'completed': False}
-                        # Get individual conversation status
-                        try:
-                            conv_response = requests.get(
-                                f"http://{docker_host}:{container['api_port']}/conversation/{conv['id']}",
-                                timeout=5
-                            )
-                            if conv_response.status_code == 200:
-                                conv_data = conv_response.json()
-                                status = conv_data.get('status', '')
-                                conv_status['completed'] = status == 'CASCADE_RUN_STATUS_IDLE'
-                                conv_status['run_status'] = status
-                        except:
-                            pass
-                        container_info['conversations'].append(conv_status)
-            except:
-                pass
-        
-        result.append(container_info)
-    
-    return jsonify(result)
+    """Get status of all containers including conversation completion state.
+
+    Served from the snapshots the worker keeps in the store, so this never waits on a box.
+    """
+    health = {box['name']: box for box in get_store().list_box_health()}
+    return jsonify([
+        {'name': box['name'], 'status': box['status'], 'conversations': box['conversations'],
+         'updated_at': box['updated_at'],
+         'health': health[box['name']]['state'] if box['name'] in health else None,
+         'health_reasons': health[box['name']]['reasons'] if box['name'] in health else [],
+         'resources': health[box['name']]['resources'] if box['name'] in health else None}
+        for box in get_store().list_box_status()
+    ])
 
 @app.route('/api/container/<container_name>/conversations')
 def api_conversations(container_name):
     """Get conversations for a specific container."""
-    containers = get_deployed_containers()
-    container = next((c for c in containers if c['name'] == container_name), None)
+    container = registry_container(container_name)
 
     if not container:
         return jsonify({'error': 'Container not found'}), 404
@@ -444,9 +1151,8 @@ def api_conversations(container_name):
         return jsonify({'error': 'API port not found'}), 400
 
     try:
-        docker_host = app.config['DOCKER_HOST']
         response = requests.get(
-            f"http://{docker_host}:{api_port}/conversations",
+            f"{get_box_api_url(container)}/conversations",
             timeout=10
         )
         if response.status_code != 200:
@@ -460,93 +1166,904 @@ def api_conversations(container_name):
     except requests.exceptions.RequestException as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/container/<container_name>/conversation/<cascade_id>')
-def api_conversation_detail(container_name, cascade_id):
-    """Get conversation details for a specific container."""
-    containers = get_deployed_containers()
-    container = next((c for c in containers if c['name'] == container_name), None)
+def fetch_conversation(container_name, cascade_id):
+    """Get a conversation from a running container, or from the archive otherwise.
 
-    if not container:
-        return jsonify({'error': 'Container not found'}), 404
+    Returns (payload, status_code); payload has an 'error' key on failure.
+    """
+    container = registry_container(container_name)
 
-    if container['status'] != 'running':
-        return jsonify({'error': 'Container is not running'}), 400
+    if not container or container['status'] != 'running':
+        # Fall back to the archive for stopped or deleted containers
+        if is_valid_run_id(cascade_id):
+            archived = get_archive().get_conversation(cascade_id)
+            if archived:
+                return archived, 200
+        if not container:
+            return {'error': 'Container not found'}, 404
+        return {'error': 'Container is not running'}, 400
 
     api_port = container.get('api_port')
     if not api_port:
-        return jsonify({'error': 'API port not found'}), 400
+        return {'error': 'API port not found'}, 400
 
     try:
-        docker_host = app.config['DOCKER_HOST']
         response = requests.get(
-            f"http://{docker_host}:{api_port}/conversation/{cascade_id}",
+            f"{get_box_api_url(container)}/conversation/{cascade_id}",
             timeout=10
         )
         if response.status_code != 200:
-            return jsonify({'error': f'API returned status {response.status_code}: {response.text[:200]}'}), response.status_code
+            return {'error': f'API returned status {response.status_code}: {response.text[:200]}'}, response.status_code
         if not response.text:
-            return jsonify({'error': 'Empty response from API'}), 500
+            return {'error': 'Empty response from API'}, 500
         try:
-            return jsonify(response.json())
+            return decode_conversation(response.text), 200
         except ValueError as e:
-            return jsonify({'error': f'Invalid JSON response: {response.text[:200]}'}), 500
+            return {'error': f'Invalid JSON response: {response.text[:200]}'}, 500
     except requests.exceptions.RequestException as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+# Text fields longer than this are cut in compact (?since=) responses; the monitor loads them on demand
+COMPACT_FIELD_LIMIT = 4000
+# Step fields that can hold large command output or file contents: (step key, path inside it)
+LARGE_STEP_FIELDS = [
+    ('runCommand', ('combinedOutput', 'full')),
+    ('runCommand', ('combinedOutput', 'truncated')),
+    ('commandStatus', ('combined',)),
+    ('commandStatus', ('stdout',)),
+    ('commandStatus', ('stderr',)),
+    ('viewFile', ('content',)),
+    ('viewFile', ('rawContent',)),
+]
+
+def compact_step(step):
+    """Copy of a step with large text fields cut to COMPACT_FIELD_LIMIT.
+
+    Cut fields are listed in '_truncated' (dotted path -> full length) so the
+    client knows to fetch the whole step when it is expanded.
+    """
+    truncated = {}
+    for key, path in LARGE_STEP_FIELDS:
+        parent = step.get(key)
+        for name in path[:-1]:
+            parent = parent.get(name) if isinstance(parent, dict) else None
+        value = parent.get(path[-1]) if isinstance(parent, dict) else None
+        if not isinstance(value, str) or len(value) <= COMPACT_FIELD_LIMIT:
+            continue
+        if not truncated:
+            step = dict(step)
+        # Copy the dicts along the path so the cached conversation is left alone
+        container = step[key] = dict(step[key])
+        for name in path[:-1]:
+            container[name] = dict(container[name])
+            container = container[name]
+        container[path[-1]] = value[:COMPACT_FIELD_LIMIT]
+        truncated['.'.join((key,) + path)] = len(value)
+    if truncated:
+        step['_truncated'] = truncated
+    return step
+
+def conversation_page(conv_data, since):
+    """Steps from index ``since`` on, compacted, for incremental rendering in the monitor."""
+    steps = trajectory_steps(conv_data)
+    since = max(0, min(since, len(steps)))
+    return {
+        'status': conv_data.get('status'),
+        'numTotalSteps': len(steps),
+        'since': since,
+        'steps': [compact_step(step) for step in steps[since:]],
+    }
+
+@app.route('/api/container/<container_name>/conversation/<cascade_id>')
+def api_conversation_detail(container_name, cascade_id):
+    """Get conversation details for a specific container.
+
+    With ``?since=<n>`` only steps from index n on are returned, with large
+    outputs cut (see conversation_page).
+    """
+    data, status_code = fetch_conversation(container_name, cascade_id)
+    since = request.args.get('since', type=int)
+    if status_code == 200 and since is not None:
+        data = conversation_page(data, since)
+    return jsonify(data), status_code
+
+@app.route('/api/container/<container_name>/conversation/<cascade_id>/step/<int:step_index>')
+def api_conversation_step(container_name, cascade_id, step_index):
+    """Get a single step of a conversation in full."""
+    data, status_code = fetch_conversation(container_name, cascade_id)
+    if status_code != 200:
+        return jsonify(data), status_code
+    steps = trajectory_steps(data)
+    if not 0 <= step_index < len(steps):
+        return jsonify({'error': 'Step not found'}), 404
+    return jsonify(steps[step_index])
+
+@app.route('/api/container/<container_name>/conversation/<cascade_id>/profile')
+def api_conversation_profile(container_name, cascade_id):
+    """Latency breakdown of a conversation: per step type, critical path and idle gaps."""
+    data, status_code = fetch_conversation(container_name, cascade_id)
+    if status_code != 200:
+        return jsonify(data), status_code
+    return jsonify(profile_trajectory(step_records(trajectory_steps(data))))
+
+def remove_container(container_name):
+    """Archive, stop and remove a container and its data directory.
+
+    Raises docker.errors.NotFound if there is no such container.
+    """
+    _, container = find_box(container_name)
+
+    # Take a last snapshot of the trajectories before the box goes away
+    deployed = registry_container(container_name)
+    if deployed and deployed['status'] == 'running':
+        try:
+            archive_container(deployed)
+        except Exception as e:
+            print(f"Warning: Failed to archive {container_name} before delete: {e}")
+
+    container.stop()
+    container.remove()
+    get_store().remove_container(container_name)
+    node = get_node_pool().get(deployed['node']) if deployed else None
+    if node and deployed['limits'].get('dedicated'):
+        # Hand the box's cores back to the shared boxes
+        with _placement_lock:
+            rebalance_cpusets(node)
+
+    # Also clean up the data directory
+    container_data_path = os.path.join(app.config['CONTAINER_DATA_PATH'], container_name)
+    if os.path.exists(container_data_path):
+        shutil.rmtree(container_data_path)
 
 @app.route('/api/container/<container_name>/delete', methods=['POST'])
 def api_delete_container(container_name):
     """Delete a specific container."""
-    client = get_docker_client()
-
     try:
-        container = client.containers.get(container_name)
-        container.stop()
-        container.remove()
-
-        # Also clean up the data directory
-        container_data_path = os.path.join(app.config['CONTAINER_DATA_PATH'], container_name)
-        if os.path.exists(container_data_path):
-            shutil.rmtree(container_data_path)
-
+        remove_container(container_name)
         return jsonify({'success': True})
     except docker.errors.NotFound:
         return jsonify({'error': 'Container not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ============== BOX HEALTH ==============
+
+_health_tracker = None
+# Redeploys pick container numbers and ports; one remediation at a time keeps them from colliding
+_remediation_lock = threading.Lock()
+
+def get_health_tracker():
+    """Per-box observations, shared by the worker's status poller and health monitor."""
+    global _health_tracker
+    if _health_tracker is None:
+        _health_tracker = HealthTracker()
+    return _health_tracker
+
+def probe_box(container):
+    """Readiness probe result of a box, or None if it did not answer.
+
+    Boxes built before /health existed are probed through /conversations,
+    which only answers when the :5555 bridge does.
+    """
+    api_url = get_box_api_url(container)
+    try:
+        response = requests.get(f"{api_url}/health", timeout=10)
+        if response.status_code in (200, 503):
+            return response.json()
+        if response.status_code == 404:
+            response = requests.get(f"{api_url}/conversations", timeout=5)
+            ok = response.status_code == 200
+            return {'ready': ok, 'checks': {'bridge': {'ok': ok, 'error': None if ok else response.text[:200]}}}
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+    return None
+
+def box_resources(container):
+    """CPU and memory use of a box from Docker stats, with its limits; None if unavailable."""
+    pool = get_node_pool()
+    node = pool.get(container['node'])
+    if node is None:
+        return None
+    try:
+        stats = pool.client(node).containers.get(container['name']).stats(stream=False)
+    except Exception:
+        return None
+    resources = parse_docker_stats(stats)
+    resources['limits'] = container.get('limits')
+    cpus = (container.get('limits') or {}).get('cpus')
+    if cpus and resources['cpus_used'] is not None:
+        resources['cpu_quota_fraction'] = resources['cpus_used'] / cpus
+    return resources
+
+def add_box_event(container_name, event, detail=None):
+    """Record a run event against the deploy that is running under ``container_name`` now."""
+    get_store().add_run_event(container_name, event, detail, load_container_metadata(container_name).get('deploy_id'))
+
+def restart_box(container, health):
+    """Restart a wedged box; returns False if Docker could not restart it."""
+    name = container['name']
+    try:
+        _, docker_container = find_box(name)
+        docker_container.restart(timeout=10)
+    except Exception as e:
+        add_box_event(name, 'restart_failed', {'error': str(e)})
+        print(f"Health: failed to restart {name}: {e}")
+        return False
+    health.restarted()
+    add_box_event(name, 'restarted', {'restarts': len(health.restarts)})
+    print(f"Health: restarted wedged box {name}")
+    return True
+
+def redeploy_box(container, health):
+    """Move a wedged box's run to a fresh box with the same files, description and model.
+
+    The old box is stopped, not deleted, so it can still be inspected.
+    """
+    import json
+    name = container['name']
+    health.given_up = True
+    metadata = load_container_metadata(name)
+    if not metadata.get('auto_redeploy', True):
+        add_box_event(name, 'redeploy_skipped', {'reason': 'auto_redeploy is off for this box'})
+        return None
+    store = get_blob_store()
+    files = [BlobFile(store, f['sha256'], f['name']) for f in metadata.get('files', [])]
+    missing = store.missing([f.sha256 for f in files])
+    if not metadata.get('account') or missing:
+        reason = 'challenge files are no longer stored' if missing else 'no account recorded for this box'
+        add_box_event(name, 'redeploy_failed', {'error': reason})
+        return None
+    try:
+        deployed = deploy_container(
+            metadata['account'], metadata.get('model'), metadata.get('nickname'),
+            metadata.get('flag_detection', False), metadata.get('challenge_description', ''), files,
+            challenge=metadata.get('challenge'), group=metadata.get('group'), replaces=name,
+            flag_patterns=metadata.get('flag_patterns') or None)
+    except Exception as e:
+        add_box_event(name, 'redeploy_failed', {'error': str(e)})
+        print(f"Health: failed to redeploy {name}: {e}")
+        return None
+    new_name = deployed['container_name']
+    add_box_event(name, 'redeployed', {'to': new_name})
+    add_box_event(new_name, 'redeployed_from', {'from': name})
+    print(f"Health: redeployed wedged box {name} as {new_name}")
+
+    metadata['replaced_by'] = new_name
+    metadata_file = os.path.join(app.config['CONTAINER_DATA_PATH'], name, 'metadata.json')
+    with open(metadata_file, 'w') as f:
+        json.dump(metadata, f)
+    try:
+        _, docker_container = find_box(name)
+        docker_container.stop(timeout=10)
+    except Exception as e:
+        print(f"Health: failed to stop replaced box {name}: {e}")
+    return new_name
+
+def remediate_box(container, health):
+    """Restart a wedged box; once restarts are used up (or fail), redeploy its run."""
+    if health.given_up:
+        return
+    window_start = time.time() - app.config['HEALTH_RESTART_WINDOW']
+    recent_restarts = [t for t in health.restarts if t >= window_start]
+    if len(recent_restarts) < app.config['HEALTH_MAX_RESTARTS'] and restart_box(container, health):
+        return
+    redeploy_box(container, health)
+
+def check_box_health(container, scorer):
+    """Probe one running box and score it; returns its health snapshot row."""
+    health = get_health_tracker().get(container['name'], container.get('started_at'))
+    health.record_probe(probe_box(container))
+    health.record_resources(box_resources(container))
+    state, reasons = scorer.score(health)
+    if state == WEDGED and app.config['HEALTH_AUTO_REMEDIATE']:
+        with _remediation_lock:
+            remediate_box(container, health)
+    return {
+        'name': container['name'],
+        'state': state,
+        'reasons': reasons,
+        'probe': health.probe,
+        'error_rate': health.error_rate(),
+        'resources': health.resources,
+        'restarts': len(health.restarts),
+    }
+
+def background_health_monitor():
+    """Periodically score every running box; restart or redeploy the wedged ones."""
+    from concurrent.futures import ThreadPoolExecutor
+    print("Starting box health monitor...")
+    scorer = HealthScorer(app.config['HEALTH_PROBE_FAILURES'], app.config['HEALTH_STARTUP_GRACE'])
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        while True:
+            try:
+                containers = [c for c in get_deployed_containers()
+                              if c['status'] == 'running' and c.get('api_port')]
+                get_health_tracker().forget_except(c['name'] for c in containers)
+                boxes = list(pool.map(lambda c: check_box_health(c, scorer), containers))
+                get_store().replace_box_health(boxes)
+            except Exception as e:
+                print(f"Box health monitor error: {e}")
+            time.sleep(app.config['HEALTH_INTERVAL'])
+
+@app.route('/api/containers/health')
+def api_containers_health():
+    """Health state, reasons, probe result and resource use of every running box."""
+    return jsonify(get_store().list_box_health())
+
+@app.route('/api/container/<container_name>/events')
+def api_container_events(container_name):
+    """Restarts, redeploys and other events recorded for the box's current deploy."""
+    deploy_id = load_container_metadata(container_name).get('deploy_id')
+    return jsonify(get_store().run_events(container_name=container_name, deploy_id=deploy_id))
+
+# ============== BOX LOGS ==============
+
+# Seconds between checks for boxes whose logs are not being followed
+LOG_COLLECTOR_INTERVAL = 10
+# Lines of docker logs taken when a box's logs are followed for the first time
+LOG_INITIAL_LINES = 200
+
+def box_log_path(container_name):
+    """Directory of a box's log ring; it goes away with the box's data directory."""
+    return os.path.join(app.config['CONTAINER_DATA_PATH'], container_name, 'logs')
+
+def open_log_stream(docker_container, source, ring):
+    """Byte chunks of one log source of a box, following it until the box stops.
+
+    A ring that already holds lines (e.g. after a worker restart) resumes
+    where it stopped instead of taking the backlog again.
+    """
+    resume = not ring.is_empty()
+    if source == 'docker':
+        if resume:
+            return docker_container.logs(stream=True, follow=True, since=int(ring.last_write()))
+        return docker_container.logs(stream=True, follow=True, tail=LOG_INITIAL_LINES)
+    start = ['-n', '0'] if resume else ['-c', str(app.config['LOG_BUFFER_KB'] * 1024)]
+    # -F keeps following across the file being recreated (e.g. after a restart)
+    return docker_container.exec_run(['tail'] + start + ['-F', BOX_LOG_FILES[source]], stream=True).output
+
+def collect_box_log(container, source, ring, failing):
+    """Copy one log source of a box into its ring until the stream ends."""
+    key = (container['name'], source)
+    try:
+        node = get_node_pool().get(container['node'])
+        docker_container = get_node_pool().client(node).containers.get(container['name'])
+        splitter = LineSplitter()
+        for chunk in open_log_stream(docker_container, source, ring):
+            failing.discard(key)
+            for line in splitter.feed(chunk):
+                ring.append(source, line)
+        for line in splitter.flush():
+            ring.append(source, line)
+    except Exception as e:
+        # Retried on the next sweep; only the first failure in a row is reported
+        if key not in failing:
+            print(f"Log collector: {source} logs of {container['name']} failed: {e}")
+            failing.add(key)
+
+def background_log_collector():
+    """Follow every running box's container output and in-box log files into its log ring."""
+    if not app.config['LOG_BUFFER_KB']:
+        return
+    print("Starting box log collector...")
+    rings, followers, failing = {}, {}, set()
+    while True:
+        try:
+            containers = [c for c in get_deployed_containers() if c['status'] == 'running'
+                          and os.path.isdir(os.path.join(app.config['CONTAINER_DATA_PATH'], c['name']))]
+            for container in containers:
+                name = container['name']
+                if name not in rings:
+                    rings[name] = LogRing(box_log_path(name), app.config['LOG_BUFFER_KB'] * 1024)
+                for source in LOG_SOURCES:
+                    thread = followers.get((name, source))
+                    if thread is None or not thread.is_alive():
+                        thread = threading.Thread(target=collect_box_log, name=f'logs-{name}-{source}',
+                                                  args=(container, source, rings[name], failing), daemon=True)
+                        followers[(name, source)] = thread
+                        thread.start()
+            # Streams of boxes that stopped or went away have ended; close their rings
+            running = {c['name'] for c in containers}
+            for name in list(rings):
+                if name not in running and not any(followers[(name, s)].is_alive() for s in LOG_SOURCES):
+                    rings.pop(name).close()
+                    for source in LOG_SOURCES:
+                        followers.pop((name, source), None)
+        except Exception as e:
+            print(f"Box log collector error: {e}")
+        time.sleep(LOG_COLLECTOR_INTERVAL)
+
+@app.route('/api/container/<container_name>/logs')
+def api_container_logs(container_name):
+    """Recent logs of a box from its log ring, as plain text lines "<time> <source> <message>".
+
+    ``tail`` (default 200) lines are sent first; with ``follow=1`` new lines
+    are streamed as they arrive. ``source`` (comma-separated) and ``grep`` (a
+    regular expression on the message; ``ignore_case=1``) filter on the server.
+    """
+    import re
+    if container_name != secure_filename(container_name) or not container_name.startswith(CONTAINER_PREFIX):
+        return jsonify({'error': 'Invalid container name'}), 400
+    directory = box_log_path(container_name)
+    if not os.path.isdir(directory):
+        return jsonify({'error': 'No logs collected for this container'}), 404
+    sources = [s for s in request.args.get('source', '').split(',') if s]
+    unknown = set(sources) - set(LOG_SOURCES)
+    if unknown:
+        return jsonify({'error': f"Unknown log source(s): {', '.join(sorted(unknown))}"}), 400
+    try:
+        keep = LogFilter(sources, request.args.get('grep'), request.args.get('ignore_case') == '1')
+    except re.error as e:
+        return jsonify({'error': f'Invalid grep pattern: {e}'}), 400
+    count = max(0, request.args.get('tail', 200, type=int))
+    follow_new = request.args.get('follow') == '1'
+    lines, position = tail(directory, count, keep)
+
+    def generate():
+        for line in lines:
+            yield line + '\n'
+        if follow_new:
+            for line in follow(directory, position, keep, timeout=app.config['LOG_FOLLOW_TIMEOUT']):
+                yield line + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='text/plain',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
+
+# ============== TRAJECTORY ARCHIVE ==============
+
+def archive_container(container):
+    """Stream all of a running container's trajectories into the archive."""
+    api_url = get_box_api_url(container)
+    response = requests.get(f"{api_url}/conversations", timeout=10)
+    if response.status_code != 200 or not response.text:
+        return 0
+    metadata = load_container_metadata(container['name'])
+    archive = get_archive()
+    archived = 0
+    for conv in response.json():
+        cascade_id = conv.get('id')
+        if not is_valid_run_id(cascade_id):
+            continue
+        detail = requests.get(f"{api_url}/conversation/{cascade_id}", timeout=10)
+        if detail.status_code != 200 or not detail.text:
+            continue
+        conv_data = decode_conversation(detail.text)
+        steps = trajectory_steps(conv_data)
+        run_info = {
+            'name': conv.get('name', ''),
+            'status': conv_data.get('status', ''),
+            'container_name': container['name'],
+            'container_id': container['id'],
+            'deploy_id': metadata.get('deploy_id'),
+            'display_name': container.get('display_name', container['name']),
+            'account': metadata.get('account'),
+            'model': metadata.get('model'),
+            'node': container.get('node'),
+            'challenge': metadata.get('challenge') or metadata.get('nickname'),
+        }
+        changed = archive.append_steps(cascade_id, steps, run_info)
+        if changed:
+            records = step_records(steps)
+            get_search_index().index_steps(cascade_id, records, changed, run_info)
+            get_store().record_usage(cascade_id, records, changed, run_info)
+        archived += 1
+    return archived
+
+def backfill_search_index():
+    """Index archived runs the search index has never seen (e.g. after deleting search.db)."""
+    archive = get_archive()
+    search_index = get_search_index()
+    indexed = search_index.indexed_runs()
+    for run in archive.list_runs():
+        if run['run_id'] in indexed:
+            continue
+        steps = archive.get_step_records(run['run_id'])
+        search_index.index_steps(run['run_id'], steps, range(len(steps)), run)
+
+def backfill_usage():
+    """Record usage of archived runs the manager database has never seen."""
+    archive = get_archive()
+    store = get_store()
+    recorded = store.usage_runs()
+    for run in archive.list_runs():
+        if run['run_id'] in recorded:
+            continue
+        steps = archive.get_step_records(run['run_id'])
+        store.record_usage(run['run_id'], steps, range(len(steps)), run)
+
+def background_archiver():
+    """Periodically copy new trajectory steps of every running container into the archive."""
+    print("Starting background trajectory archiver...")
+    try:
+        backfill_search_index()
+    except Exception as e:
+        print(f"Search index backfill error: {e}")
+    try:
+        backfill_usage()
+    except Exception as e:
+        print(f"Usage backfill error: {e}")
+    while True:
+        try:
+            for container in get_deployed_containers():
+                if container['status'] == 'running' and container.get('api_port'):
+                    try:
+                        archive_container(container)
+                    except Exception as e:
+                        print(f"Error archiving {container['name']}: {e}")
+        except Exception as e:
+            print(f"Background archiver error: {e}")
+        time.sleep(app.config['ARCHIVE_INTERVAL'])
+
+@app.route('/api/archive/runs')
+def api_archive_runs():
+    """List archived runs, optionally only those of one container."""
+    runs = get_archive().list_runs()
+    container_name = request.args.get('container')
+    if container_name:
+        runs = [r for r in runs if r.get('container_name') == container_name]
+    return jsonify(runs)
+
+@app.route('/api/archive/run/<run_id>')
+def api_archive_run(run_id):
+    """Get an archived run in the same shape as a live conversation (``?since=`` as for live ones)."""
+    if not is_valid_run_id(run_id):
+        return jsonify({'error': 'Invalid run id'}), 400
+    conversation = get_archive().get_conversation(run_id)
+    if not conversation:
+        return jsonify({'error': 'Run not found'}), 404
+    since = request.args.get('since', type=int)
+    if since is not None:
+        conversation = conversation_page(conversation, since)
+    conversation['events'] = get_store().run_events(run_id=run_id)
+    return jsonify(conversation)
+
+@app.route('/api/archive/run/<run_id>/step/<int:step_index>')
+def api_archive_step(run_id, step_index):
+    """Get a single archived step."""
+    if not is_valid_run_id(run_id):
+        return jsonify({'error': 'Invalid run id'}), 400
+    step = get_archive().get_step(run_id, step_index)
+    if step is None:
+        return jsonify({'error': 'Step not found'}), 404
+    return jsonify(step)
+
+@app.route('/api/archive/run/<run_id>/profile')
+def api_archive_profile(run_id):
+    """Latency breakdown of an archived run."""
+    if not is_valid_run_id(run_id):
+        return jsonify({'error': 'Invalid run id'}), 400
+    archive = get_archive()
+    if not archive.get_run(run_id):
+        return jsonify({'error': 'Run not found'}), 404
+    return jsonify(profile_trajectory(archive.get_step_records(run_id)))
+
+@app.route('/api/search')
+def api_search():
+    """Full-text search over command output, file reads and planner responses of all runs."""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+    kind = request.args.get('kind') or None
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    results, took_ms = get_search_index().search(query, kind=kind, limit=limit)
+    return jsonify({'results': results, 'took_ms': round(took_ms, 2)})
+
+# ============== ANALYTICS ==============
+
+def get_solved_deploys():
+    """(container name, deploy id) of the deploys that found a real flag."""
+    return {(f['container_name'], f.get('deploy_id')) for f in load_flags() if f.get('flag') != NO_FLAG_MARKER}
+
+@app.route('/analytics')
+def analytics():
+    """Display fleet-wide spend and throughput."""
+    return render_template('analytics.html', groups=ANALYTICS_GROUPS)
+
+@app.route('/api/analytics')
+def api_analytics():
+    """Credits, tokens and cost per solved flag, grouped by model, account, challenge or run."""
+    group = request.args.get('group', 'model')
+    if group not in ANALYTICS_GROUPS:
+        return jsonify({'error': f'group must be one of {", ".join(ANALYTICS_GROUPS)}'}), 400
+    rows = summarize_usage(get_store().run_totals(), group, get_solved_deploys())
+    return jsonify({'group': group, 'rows': rows})
+
+# ============== BENCHMARKS ==============
+
+def wait_for_attempt(container_name, deploy_id, flag, started):
+    """Follow a benchmark box (the deploy ``deploy_id``) until the flag shows up, the run goes idle, or it times out.
+
+    Returns (status, run_id, steps).
+    """
+    deadline = started + app.config['BENCHMARK_TIMEOUT']
+    run_id = None
+    steps = []
+    idle_polls = 0
+    while time.time() < deadline:
+        time.sleep(app.config['BENCHMARK_POLL_INTERVAL'])
+        container = next((c for c in get_deployed_containers() if c['name'] == container_name), None)
+        if not container:
+            raise Exception('Container disappeared')
+        if container['status'] != 'running' or not container.get('api_port'):
+            continue
+        api_url = get_box_api_url(container)
+        try:
+            response = requests.get(f"{api_url}/conversations", timeout=10)
+            conversations = response.json() if response.status_code == 200 and response.text else []
+            if not conversations:
+                continue
+            run_id = conversations[0].get('id')
+            # The box pushes the flag as soon as it sees it; until then, or until the run goes idle,
+            # there is no need to download the trajectory
+            solved = any(f['flag'] == flag for f in box_flags(container_name, deploy_id))
+            run_status = conversations[0].get('status')
+            if not solved and run_status is not None and run_status != 'CASCADE_RUN_STATUS_IDLE':
+                idle_polls = 0
+                continue
+            detail = requests.get(f"{api_url}/conversation/{run_id}", timeout=10)
+            if detail.status_code != 200 or not detail.text:
+                continue
+            trajectory = decode_trajectory(detail.text)
+        except (requests.exceptions.RequestException, ValueError):
+            continue
+        steps = trajectory.steps
+        if solved or find_flag_step(steps, flag) is not None:
+            return ATTEMPT_SOLVED, run_id, steps
+        # Idle on two polls in a row: the model stopped without finding the flag
+        if trajectory.status == 'CASCADE_RUN_STATUS_IDLE' and steps:
+            idle_polls += 1
+            if idle_polls >= 2:
+                return ATTEMPT_FAILED, run_id, steps
+        else:
+            idle_polls = 0
+    return ATTEMPT_TIMEOUT, run_id, steps
+
+def run_benchmark_attempt(benchmark, attempt, challenge):
+    """Run one (challenge, model) attempt on a fresh box and record the result."""
+    import re
+    store = get_store()
+    started = time.time()
+    store.update_attempt(attempt['id'], status=ATTEMPT_RUNNING, started_at=started)
+    container_name = None
+    fields = {'status': ATTEMPT_ERROR}
+    try:
+        nickname = f"bench{benchmark['id']} {challenge['name']} {attempt['model']} #{attempt['attempt']}"
+        deployed = deploy_container(benchmark['account'], attempt['model'], nickname, False,
+                                    challenge['description'], challenge['files'], challenge=challenge['name'],
+                                    # A redeployed attempt would not be comparable; let it time out instead
+                                    group=f"bench{benchmark['id']}", auto_redeploy=False,
+                                    flag_patterns=[re.escape(challenge['flag'])])
+        container_name = deployed['container_name']
+        store.update_attempt(attempt['id'], container_name=container_name)
+        status, run_id, steps = wait_for_attempt(container_name, deployed['deploy_id'], challenge['flag'], started)
+        measured = measure_attempt(steps, challenge['flag'])
+        fields = {
+            'status': status,
+            'run_id': run_id,
+            'time_to_flag': measured['time_to_flag'],
+            'steps': measured['steps'],
+            'credits': measured['credits'],
+            'model_cost': measured['model_cost'],
+            'output_tokens': measured['output_tokens'],
+        }
+    except Exception as e:
+        print(f"Benchmark {benchmark['id']} attempt {attempt['id']} failed: {e}")
+        fields['error'] = str(e)
+    finally:
+        if container_name:
+            try:
+                remove_container(container_name)
+            except Exception as e:
+                print(f"Warning: Failed to remove benchmark box {container_name}: {e}")
+    finished = time.time()
+    store.update_attempt(attempt['id'], finished_at=finished, wall_seconds=finished - started, **fields)
+
+def run_benchmark(benchmark_id):
+    """Run every pending attempt of a benchmark, at most ``concurrency`` boxes at a time."""
+    from concurrent.futures import ThreadPoolExecutor
+    store = get_store()
+    benchmark = store.get_benchmark(benchmark_id)
+    store.update_benchmark(benchmark_id, status='running')
+    try:
+        corpus = load_corpus(os.path.join(app.config['BENCHMARK_CORPUS_PATH'], benchmark['corpus']))
+        challenges = {c['name']: c for c in corpus}
+        with ThreadPoolExecutor(max_workers=benchmark['concurrency']) as pool:
+            for attempt in store.benchmark_attempts(benchmark_id):
+                if attempt['status'] != ATTEMPT_PENDING:
+                    continue
+                if attempt['challenge'] not in challenges:
+                    store.update_attempt(attempt['id'], status=ATTEMPT_ERROR, error='Challenge missing from corpus')
+                    continue
+                pool.submit(run_benchmark_attempt, benchmark, attempt, challenges[attempt['challenge']])
+        store.update_benchmark(benchmark_id, status='finished', finished_at=time.time())
+    except Exception as e:
+        print(f"Benchmark {benchmark_id} error: {e}")
+        store.update_benchmark(benchmark_id, status='error', finished_at=time.time())
+
+def background_benchmark_scheduler():
+    """Start benchmarks queued by the web app, and resume ones a worker restart interrupted."""
+    print("Starting background benchmark scheduler...")
+    store = get_store()
+    store.reset_interrupted_attempts()
+    for benchmark in store.benchmarks_with_status('running'):
+        threading.Thread(target=run_benchmark, args=(benchmark['id'],), daemon=True).start()
+    while True:
+        try:
+            for benchmark in store.benchmarks_with_status('pending'):
+                store.update_benchmark(benchmark['id'], status='running')
+                threading.Thread(target=run_benchmark, args=(benchmark['id'],), daemon=True).start()
+        except Exception as e:
+            print(f"Benchmark scheduler error: {e}")
+        time.sleep(app.config['BENCHMARK_POLL_INTERVAL'])
+
+@app.route('/benchmarks')
+def benchmarks():
+    """Display the model benchmark page."""
+    return render_template('benchmarks.html', accounts=get_accounts(), models=AVAILABLE_MODELS,
+                           corpora=list_corpora(app.config['BENCHMARK_CORPUS_PATH']))
+
+@app.route('/api/benchmarks', methods=['GET'])
+def api_benchmarks():
+    """List benchmarks with attempt progress."""
+    store = get_store()
+    results = []
+    for benchmark in store.list_benchmarks():
+        attempts = store.benchmark_attempts(benchmark['id'])
+        benchmark['attempts'] = len(attempts)
+        benchmark['finished'] = sum(1 for a in attempts if a['status'] in FINISHED_ATTEMPT_STATES)
+        benchmark['solved'] = sum(1 for a in attempts if a['status'] == ATTEMPT_SOLVED)
+        results.append(benchmark)
+    return jsonify(results)
+
+@app.route('/api/benchmarks', methods=['POST'])
+def api_start_benchmark():
+    """Start a benchmark: every challenge of a corpus on each model, ``repeats`` times."""
+    data = request.get_json(silent=True) or {}
+    corpus = data.get('corpus', '')
+    account = data.get('account')
+    models = data.get('models') or []
+    try:
+        repeats = int(data.get('repeats', 1))
+        concurrency = int(data.get('concurrency', 2))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'repeats and concurrency must be numbers'}), 400
+
+    if corpus not in list_corpora(app.config['BENCHMARK_CORPUS_PATH']):
+        return jsonify({'error': 'Unknown corpus'}), 400
+    if account not in get_accounts():
+        return jsonify({'error': 'Please select an account'}), 400
+    if not models or any(m not in AVAILABLE_MODELS for m in models):
+        return jsonify({'error': 'Please select models from the available list'}), 400
+    if not 1 <= repeats <= 50 or not 1 <= concurrency <= 20:
+        return jsonify({'error': 'repeats must be 1-50 and concurrency 1-20'}), 400
+    try:
+        challenges = load_corpus(os.path.join(app.config['BENCHMARK_CORPUS_PATH'], corpus))
+    except (OSError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Left pending; the worker picks it up
+    benchmark_id = get_store().create_benchmark(
+        data.get('name') or corpus, corpus, account, models, repeats, concurrency,
+        [c['name'] for c in challenges])
+    return jsonify({'success': True, 'benchmark_id': benchmark_id})
+
+@app.route('/api/benchmark/<int:benchmark_id>')
+def api_benchmark(benchmark_id):
+    """A benchmark's attempts and its percentile report."""
+    store = get_store()
+    benchmark = store.get_benchmark(benchmark_id)
+    if not benchmark:
+        return jsonify({'error': 'Benchmark not found'}), 404
+    attempts = store.benchmark_attempts(benchmark_id)
+    return jsonify({'benchmark': benchmark, 'attempts': attempts, 'report': benchmark_report(attempts)})
+
+@app.route('/api/benchmarks/compare')
+def api_compare_benchmarks():
+    """Per-model reports of several benchmarks side by side (``?ids=1,2,3``)."""
+    store = get_store()
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of numbers'}), 400
+    results = []
+    for benchmark_id in ids:
+        benchmark = store.get_benchmark(benchmark_id)
+        if benchmark:
+            report = benchmark_report(store.benchmark_attempts(benchmark_id))
+            results.append({'benchmark': benchmark, 'models': report['models']})
+    return jsonify(results)
+
 # ============== FLAGS FUNCTIONALITY ==============
 
-FLAGS_FILE = os.path.join(os.path.dirname(__file__), 'flags.json')
+FLAGS_FILE = os.environ.get('FLAGS_FILE', os.path.join(os.path.dirname(__file__), 'flags.json'))
+# Recorded for containers that finished without a flag, so they are not checked again
+NO_FLAG_MARKER = '[No flag detected]'
+# Seconds between worker heartbeats in the store
+WORKER_HEARTBEAT_INTERVAL = 5
+# Regexes boxes scan for when neither the deploy nor FLAG_PATTERNS gives any: flag{...}, picoCTF{...}, HTB{...}, ...
+DEFAULT_FLAG_PATTERNS = [r'(?i)\b[a-z0-9_]*(?:flag|ctf)\{[^{}\s]{1,200}\}', r'\b(?:HTB|THM)\{[^{}\s]{1,200}\}']
+
+def valid_flag_patterns(patterns):
+    """The patterns that are strings and compile; the rest are logged and dropped."""
+    import re
+    valid = []
+    for pattern in patterns:
+        try:
+            re.compile(pattern)
+        except (re.error, TypeError) as e:
+            print(f"Dropping flag pattern {pattern!r}: {e}")
+            continue
+        valid.append(pattern)
+    return valid
+
+def default_flag_patterns():
+    """Flag regexes for boxes deployed with flag detection and no pattern of their own.
+
+    A FLAG_PATTERNS setting that is not a JSON list, or has no usable
+    pattern in it, falls back to DEFAULT_FLAG_PATTERNS.
+    """
+    import json
+    if app.config['FLAG_PATTERNS']:
+        try:
+            patterns = json.loads(app.config['FLAG_PATTERNS'])
+        except ValueError as e:
+            print(f"FLAG_PATTERNS is not valid JSON, using the defaults: {e}")
+            patterns = []
+        patterns = valid_flag_patterns(patterns if isinstance(patterns, list) else [])
+        if patterns:
+            return patterns
+    return DEFAULT_FLAG_PATTERNS
+
+def flag_scan_environment(container_name, metadata):
+    """Environment that turns on a box's own flag scanner (empty if it has no patterns)."""
+    import json
+    if not metadata.get('flag_patterns'):
+        return {}
+    return {
+        'FLAG_PATTERNS': json.dumps(metadata['flag_patterns']),
+        'FLAG_CALLBACK_URL': app.config['FLAG_CALLBACK_URL'] or f"http://host.docker.internal:{app.config['PORT']}/api/flag_event",
+        'FLAG_CALLBACK_TOKEN': metadata['flag_token'],
+        'BOX_NAME': container_name,
+    }
 
 def get_groq_key():
-    """Read Groq API key from file."""
+    """Read Groq API key from GROQ_API_KEY or, failing that, from file."""
+    if os.environ.get('GROQ_API_KEY'):
+        return os.environ['GROQ_API_KEY']
     key_file = os.path.join(os.path.dirname(__file__), 'groq_key.txt')
     if os.path.exists(key_file):
         with open(key_file, 'r') as f:
             return f.read().strip()
     return None
 
+def import_flags_file(store):
+    """Move flags.json (where flags were kept before the manager database) into the store."""
+    import json
+    if not os.path.exists(FLAGS_FILE):
+        return
+    try:
+        with open(FLAGS_FILE, 'r') as f:
+            flags = json.load(f)
+        for flag in flags:
+            store.add_flag(flag['container_name'], flag.get('display_name'), flag['flag'], flag['timestamp'])
+        os.replace(FLAGS_FILE, FLAGS_FILE + '.imported')
+    except (OSError, ValueError, KeyError) as e:
+        # The other process may have imported it first
+        print(f"Warning: Failed to import {FLAGS_FILE}: {e}")
+
 def load_flags():
     """Load flags from storage."""
-    if os.path.exists(FLAGS_FILE):
-        with open(FLAGS_FILE, 'r') as f:
-            import json
-            return json.load(f)
-    return []
+    return get_store().list_flags()
 
-def save_flag(container_name, display_name, flag):
+def save_flag(container_name, display_name, flag, deploy_id=None):
     """Save a found flag to storage."""
-    import json
     from datetime import datetime
-    flags = load_flags()
-    flags.append({
-        'container_name': container_name,
-        'display_name': display_name,
-        'flag': flag,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    })
-    with open(FLAGS_FILE, 'w') as f:
-        json.dump(flags, f, indent=2)
+    get_store().add_flag(container_name, display_name, flag, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                         deploy_id)
+
+def box_flags(container_name, deploy_id):
+    """Flags recorded for one deploy of a box, not for earlier boxes that had its name."""
+    return [f for f in load_flags() if f['container_name'] == container_name and f.get('deploy_id') == deploy_id]
 
 def extract_flag_with_groq(text):
     """Use Groq API to extract flag from text."""
@@ -556,7 +2073,7 @@ def extract_flag_with_groq(text):
     
     try:
         response = requests.post(
-            'https://api.groq.com/openai/v1/chat/completions',
+            app.config['GROQ_API_URL'],
             headers={
                 'Authorization': f'Bearer {groq_key}',
                 'Content-Type': 'application/json'
@@ -621,8 +2138,7 @@ def process_container_flag(container_name):
         return {'flag_detection': False, 'message': 'Flag detection not enabled'}
     
     # Get container info
-    containers = get_deployed_containers()
-    container = next((c for c in containers if c['name'] == container_name), None)
+    container = registry_container(container_name)
     
     if not container or container['status'] != 'running':
         return {'error': 'Container not running', 'code': 400}
@@ -631,11 +2147,11 @@ def process_container_flag(container_name):
     if not api_port:
         return {'error': 'API port not found', 'code': 400}
     
-    docker_host = app.config['DOCKER_HOST']
+    api_url = get_box_api_url(container)
     
     try:
         # Get conversations
-        conv_response = requests.get(f"http://{docker_host}:{api_port}/conversations", timeout=10)
+        conv_response = requests.get(f"{api_url}/conversations", timeout=10)
         if conv_response.status_code != 200:
             return {'error': 'Failed to get conversations', 'code': 500}
         
@@ -643,30 +2159,37 @@ def process_container_flag(container_name):
         if not conversations:
             return {'no_conversations': True}
         
+        # Boxes that scan their own trajectories push flags to /api/flag_event; all that is
+        # left here is to record the ones that finished without a flag
+        if metadata.get('flag_patterns') and 'status' in conversations[0]:
+            status = conversations[0]['status']
+            if status != 'CASCADE_RUN_STATUS_IDLE':
+                return {'completed': False, 'status': status}
+            if box_flags(container_name, metadata.get('deploy_id')):
+                return {'completed': True, 'already_checked': True}
+            save_flag(container_name, metadata.get('nickname', container_name), NO_FLAG_MARKER,
+                      metadata.get('deploy_id'))
+            return {'completed': True, 'flag_found': False}
+        
         # Check the first (main) conversation
         conv_id = conversations[0].get('id')
-        detail_response = requests.get(f"http://{docker_host}:{api_port}/conversation/{conv_id}", timeout=10)
+        detail_response = requests.get(f"{api_url}/conversation/{conv_id}", timeout=10)
         
         if detail_response.status_code != 200:
             return {'error': 'Failed to get conversation details', 'code': 500}
         
-        conv_data = detail_response.json()
-        status = conv_data.get('status', '')
+        trajectory = decode_trajectory(detail_response.text)
+        status = trajectory.status
         
         if status != 'CASCADE_RUN_STATUS_IDLE':
             return {'completed': False, 'status': status}
         
         # Check if we already found a flag for this container
-        existing_flags = load_flags()
-        if any(f['container_name'] == container_name for f in existing_flags):
+        if box_flags(container_name, metadata.get('deploy_id')):
             return {'completed': True, 'already_checked': True}
         
         # Get the final response text from the conversation
-        steps = []
-        if conv_data.get('state') and conv_data['state'].get('trajectory'):
-            steps = conv_data['state']['trajectory'].get('steps', [])
-        elif conv_data.get('trajectory'):
-            steps = conv_data['trajectory'].get('steps', [])
+        steps = trajectory.steps
         
         # Find text from the last few steps (both model responses and tool outputs)
         final_text = ''
@@ -676,25 +2199,19 @@ def process_container_flag(container_name):
         
         for step in recent_steps:
             # Check planner response
-            if step.get('type') == 'CORTEX_STEP_TYPE_PLANNER_RESPONSE':
-                planner_resp = step.get('plannerResponse', {})
-                text = planner_resp.get('rawModelResponse', '') or planner_resp.get('response', '')
-                if text:
-                    final_text += text + "\n\n"
+            if step.type == 'CORTEX_STEP_TYPE_PLANNER_RESPONSE':
+                if step.response:
+                    final_text += step.response + "\n\n"
             
             # Check tool outputs (e.g. if flag was printed)
-            elif step.get('type') == 'CORTEX_STEP_TYPE_RUN_COMMAND':
-                cmd_resp = step.get('runCommandResponse', {})
-                output = cmd_resp.get('stdout', '')
-                if output:
-                    final_text += f"Command Output: {output}\n\n"
+            elif step.type in ('CORTEX_STEP_TYPE_RUN_COMMAND', 'CORTEX_STEP_TYPE_COMMAND_STATUS'):
+                if step.output:
+                    final_text += f"Command Output: {step.output}\n\n"
             
             # Check file reads
-            elif step.get('type') == 'CORTEX_STEP_TYPE_READ_FILE':
-                read_resp = step.get('readFileResponse', {})
-                content = read_resp.get('content', '')
-                if content:
-                    final_text += f"File Content: {content}\n\n"
+            elif step.type == 'CORTEX_STEP_TYPE_VIEW_FILE':
+                if step.file_content:
+                    final_text += f"File Content: {step.file_content}\n\n"
 
         if not final_text:
             return {'completed': True, 'no_content': True}
@@ -704,27 +2221,57 @@ def process_container_flag(container_name):
         
         if flag:
             display_name = metadata.get('nickname', container_name)
-            save_flag(container_name, display_name, flag)
+            save_flag(container_name, display_name, flag, metadata.get('deploy_id'))
             return {'completed': True, 'flag_found': True, 'flag': flag}
         
         # Mark as checked even if no flag found (to avoid repeated checks)
-        save_flag(container_name, metadata.get('nickname', container_name), '[No flag detected]')
+        save_flag(container_name, metadata.get('nickname', container_name), NO_FLAG_MARKER,
+                  metadata.get('deploy_id'))
         return {'completed': True, 'flag_found': False}
         
     except Exception as e:
         return {'error': str(e), 'code': 500}
 
+@app.route('/api/flag_event', methods=['POST'])
+def api_flag_event():
+    """Record a flag a box's scanner found in its trajectory (pushed by the box as it happens)."""
+    import hmac
+    event = request.get_json(silent=True) or {}
+    container_name = event.get('container')
+    flag = event.get('flag')
+    if not isinstance(container_name, str) or not container_name.startswith(CONTAINER_PREFIX) \
+            or not container_name[len(CONTAINER_PREFIX):].isdigit() or not isinstance(flag, str) or not flag:
+        return jsonify({'error': 'container and flag are required'}), 400
+    metadata = load_container_metadata(container_name)
+    token = metadata.get('flag_token')
+    if not token or not hmac.compare_digest(token, str(event.get('token', ''))):
+        return jsonify({'error': 'Unknown box or bad token'}), 403
+    # The token is issued per deploy, so this is the box that is running under the name now
+    if not any(f['flag'] == flag for f in box_flags(container_name, metadata.get('deploy_id'))):
+        save_flag(container_name, metadata.get('nickname', container_name), flag, metadata.get('deploy_id'))
+        add_box_event(container_name, 'flag_found', {
+            'flag': flag, 'cascade_id': event.get('cascade_id'), 'step': event.get('step'),
+            'step_type': event.get('step_type'), 'found_at': event.get('found_at')})
+        print(f"Flag pushed by {container_name}: {flag}")
+    return jsonify({'ok': True})
+
 @app.route('/api/container/<container_name>/check_flag', methods=['POST'])
 def api_check_flag(container_name):
-    """Check for flag in container's completed conversation."""
-    result = process_container_flag(container_name)
-    if 'error' in result:
-        return jsonify(result), result.get('code', 500)
-    return jsonify(result)
+    """Report the flag check result for a container.
+
+    The check itself (box calls and the Groq request) runs in the worker's flag
+    monitor; until it has looked at the container this reports not completed.
+    """
+    found = box_flags(container_name, load_container_metadata(container_name).get('deploy_id'))
+    if not found:
+        return jsonify({'completed': False, 'pending': True})
+    flag = found[-1]['flag']
+    if flag == NO_FLAG_MARKER:
+        return jsonify({'completed': True, 'flag_found': False})
+    return jsonify({'completed': True, 'flag_found': True, 'flag': flag})
 
 def background_flag_monitor():
     """Periodically check all running containers for flags."""
-    import time
     print("Starting background flag monitor...")
     while True:
         try:
@@ -739,20 +2286,26 @@ def background_flag_monitor():
                     except Exception as e:
                         print(f"Error checking flag for {container['name']}: {e}")
             
-            # Sleep for 10 seconds
-            time.sleep(10)
+            time.sleep(app.config['FLAG_CHECK_INTERVAL'])
         except Exception as e:
             print(f"Background monitor error: {e}")
-            time.sleep(10)
+            time.sleep(app.config['FLAG_CHECK_INTERVAL'])
+
+@app.route('/api/worker')
+def api_worker():
+    """Heartbeat of the background worker (worker.py), to tell whether monitoring is running."""
+    worker = get_store().get_meta('worker')
+    if not worker:
+        return jsonify({'running': False})
+    age = time.time() - worker['heartbeat_at']
+    return jsonify(dict(worker, running=age < 3 * WORKER_HEARTBEAT_INTERVAL, heartbeat_age=age))
 
 if __name__ == '__main__':
     # Ensure upload and container data directories exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['CONTAINER_DATA_PATH'], exist_ok=True)
+    os.makedirs(app.config['ARCHIVE_PATH'], exist_ok=True)
+    os.makedirs(app.config['DATA_PATH'], exist_ok=True)
 
-    # Start background flag monitor
-    import threading
-    monitoring_thread = threading.Thread(target=background_flag_monitor, daemon=True)
-    monitoring_thread.start()
-
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    # Flag monitoring, archiving and other periodic jobs run in worker.py
+    app.run(host='0.0.0.0', port=app.config['PORT'], debug=True)
@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+
+from profiler import percentile
+from search_index import extract_step_texts
+from store import step_usage
+
+# Each challenge in a corpus is a directory holding this file, plus optional files/
+CHALLENGE_FILE = 'challenge.json'
+
+# Attempt states
+ATTEMPT_PENDING = 'pending'
+ATTEMPT_RUNNING = 'running'
+ATTEMPT_SOLVED = 'solved'
+ATTEMPT_FAILED = 'failed'
+ATTEMPT_TIMEOUT = 'timeout'
+ATTEMPT_ERROR = 'error'
+FINISHED_ATTEMPT_STATES = {ATTEMPT_SOLVED, ATTEMPT_FAILED, ATTEMPT_TIMEOUT, ATTEMPT_ERROR}
+
+
+class CorpusFile:
+    """A challenge file, passed to deploy_container like an uploaded file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.filename = os.path.basename(path)
+
+    def save(self, destination):
+        shutil.copyfile(self.path, destination)
+
+
+def list_corpora(root):
+    """Names of the corpus directories under ``root``."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+
+
+def load_corpus(path):
+    """Load every challenge of a corpus directory.
+
+    Layout:
+        <corpus>/<challenge>/challenge.json   {"description": ..., "flag": ...}
+        <corpus>/<challenge>/files/...        uploaded to /home/chal
+    """
+    if not os.path.isdir(path):
+        raise ValueError(f'Corpus not found: {path}')
+    challenges = []
+    for name in sorted(os.listdir(path)):
+        challenge_file = os.path.join(path, name, CHALLENGE_FILE)
+        if not os.path.isfile(challenge_file):
+            continue
+        with open(challenge_file, 'r') as f:
+            spec = json.load(f)
+        if not spec.get('description') or not spec.get('flag'):
+            raise ValueError(f'{challenge_file} needs a description and a flag')
+        files_path = os.path.join(path, name, 'files')
+        files = []
+        if os.path.isdir(files_path):
+            files = [CorpusFile(os.path.join(files_path, f)) for f in sorted(os.listdir(files_path))
+                     if os.path.isfile(os.path.join(files_path, f))]
+        challenges.append({
+            'name': spec.get('name', name),
+            'description': spec['description'],
+            'flag': spec['flag'],
+            'files': files,
+        })
+    if not challenges:
+        raise ValueError(f'No challenges (*/{CHALLENGE_FILE}) in {path}')
+    return challenges
+
+
+def find_flag_step(steps, flag):
+    """Index of the first step whose text contains the expected flag, or None."""
+    for index, step in enumerate(steps):
+        if any(flag in text for _, text in extract_step_texts(step)):
+            return index
+    return None
+
+
+def measure_attempt(steps, flag):
+    """Steps, credits and time-to-flag of one attempt's trajectory."""
+    flag_step = find_flag_step(steps, flag)
+    credits = model_cost = 0.0
+    output_tokens = 0
+    first_at = None
+    for step in steps:
+        usage = step_usage(step)
+        credits += usage['flow_credits'] + usage['prompt_credits']
+        model_cost += usage['model_cost']
+        output_tokens += usage['output_tokens']
+        if first_at is None:
+            first_at = usage['created_at']
+    time_to_flag = None
+    if flag_step is not None and first_at is not None:
+        found_at = steps[flag_step].completed_at or steps[flag_step].created_at
+        if found_at is not None:
+            time_to_flag = found_at - first_at
+    return {
+        'steps': len(steps),
+        'credits': credits,
+        'model_cost': model_cost,
+        'output_tokens': output_tokens,
+        'flag_step': flag_step,
+        'time_to_flag': time_to_flag,
+        'success': flag_step is not None,
+    }
+
+
+def _distribution(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {
+        'p50': percentile(values, 0.5),
+        'p90': percentile(values, 0.9),
+        'mean': sum(values) / len(values),
+        'max': values[-1],
+    }
+
+
+def benchmark_report(attempts):
+    """Summarize finished attempts per model and per (challenge, model).
+
+    Time-to-flag is measured from the first step of the trajectory, so box
+    start-up time does not count against a model.
+    """
+    def summarize(group):
+        finished = [a for a in group if a['status'] in FINISHED_ATTEMPT_STATES]
+        solved = [a for a in finished if a['status'] == ATTEMPT_SOLVED]
+        return {
+            'attempts': len(group),
+            'finished': len(finished),
+            'solved': len(solved),
+            'success_rate': len(solved) / len(finished) if finished else None,
+            'time_to_flag': _distribution(a['time_to_flag'] for a in solved),
+            'wall_seconds': _distribution(a['wall_seconds'] for a in finished),
+            'steps': _distribution(a['steps'] for a in finished),
+            'credits': _distribution(a['credits'] for a in finished),
+            'credits_per_solve': sum(a['credits'] or 0 for a in finished) / len(solved) if solved else None,
+        }
+
+    by_model = {}
+    by_challenge = {}
+    for attempt in attempts:
+        by_model.setdefault(attempt['model'], []).append(attempt)
+        by_challenge.setdefault((attempt['challenge'], attempt['model']), []).append(attempt)
+    return {
+        'models': [dict(summarize(group), model=model) for model, group in sorted(by_model.items())],
+        'challenges': [dict(summarize(group), challenge=challenge, model=model)
+                       for (challenge, model), group in sorted(by_challenge.items())],
+    }
@@ -0,0 +1,352 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+import threading
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32,64}$')
+BLOB_DIR_RE = re.compile(r'^[0-9a-f]{2}$')
+# Bytes read per chunk when streaming uploads and hashing files
+CHUNK_SIZE = 1024 * 1024
+# Stored blobs get this mtime; a blob whose mtime differs was written through a
+# hardlink inside a box deployed before blobs were mounted read-only, and is no
+# longer the content its name claims
+BLOB_MTIME = 1
+# An upload whose meta still says assembling after this many seconds was interrupted
+ASSEMBLY_TIMEOUT = 6 * 3600
+
+
+def is_valid_sha256(value):
+    return isinstance(value, str) and bool(SHA256_RE.match(value))
+
+
+def is_valid_upload_id(value):
+    return isinstance(value, str) and bool(UPLOAD_ID_RE.match(value))
+
+
+class BlobHashMismatch(ValueError):
+    """Uploaded content did not hash to the digest it was sent under."""
+
+
+class BlobStore:
+    """Content-addressed store for challenge files, keyed by SHA-256.
+
+    Each distinct file is written once to ``root/<sha[:2]>/<sha>`` (read-only)
+    and bind-mounted read-only into every box that uses it, so deploying the
+    same file again costs no upload and no extra disk, and no box can change
+    what another box sees.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_path = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_path, exist_ok=True)
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def has(self, sha256):
+        """True if the blob is stored and intact; a tampered blob is dropped so it gets uploaded again."""
+        path = self.path(sha256)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if int(st.st_mtime) != BLOB_MTIME:
+            print(f"Blob {sha256} was modified through a hardlink, dropping it")
+            os.unlink(path)
+            return False
+        return True
+
+    def missing(self, hashes):
+        return [h for h in hashes if not self.has(h)]
+
+    def put_stream(self, stream, expected_sha256=None):
+        """Store everything read from ``stream``; returns (sha256, size).
+
+        The content is hashed while it is written to a temporary file, and
+        only moved into place once complete (and, if ``expected_sha256`` is
+        given, verified). Raises BlobHashMismatch on a digest mismatch.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            sha256 = digest.hexdigest()
+            if expected_sha256 and sha256 != expected_sha256:
+                raise BlobHashMismatch(f'Content hashes to {sha256}, not {expected_sha256}')
+            if not self.has(sha256):
+                self._commit(tmp, sha256)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return sha256, size
+
+    def put_file(self, path):
+        """Store a local file; returns (sha256, size). Nothing is written if it is already stored."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        if self.has(sha256):
+            return sha256, os.path.getsize(path)
+        with open(path, 'rb') as f:
+            return self.put_stream(f, sha256)
+
+    def _commit(self, tmp, sha256):
+        os.chmod(tmp, 0o444)
+        os.utime(tmp, (BLOB_MTIME, BLOB_MTIME))
+        os.makedirs(os.path.dirname(self.path(sha256)), exist_ok=True)
+        # rename is atomic: a concurrent upload of the same content just replaces it
+        os.replace(tmp, self.path(sha256))
+
+    def collect_garbage(self, min_age, referenced=()):
+        """Remove unreferenced blobs and stale temp files; returns bytes freed.
+
+        A blob is kept while its hash is in ``referenced`` (the files of the
+        boxes that mount it or may be redeployed) or a box deployed before
+        blobs were mounted still hardlinks it (link count above 1). ``min_age`` seconds of
+        grace keep blobs that were just uploaded for a deploy that has not
+        recorded them yet; blob mtimes are fixed, so ctime (set when the blob
+        was stored or last unlinked) is used.
+        """
+        referenced = set(referenced)
+        freed = 0
+        cutoff = time.time() - min_age
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if not (prefix == 'tmp' or BLOB_DIR_RE.match(prefix)):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                    if prefix == 'tmp' or (name not in referenced and st.st_nlink == 1):
+                        if st.st_ctime < cutoff:
+                            os.unlink(path)
+                            freed += st.st_size
+                except FileNotFoundError:
+                    pass
+        return freed
+
+
+class BlobFile:
+    """A stored blob passed to deploy_container like an uploaded file."""
+
+    def __init__(self, store, sha256, filename):
+        self.store = store
+        self.sha256 = sha256
+        self.filename = filename
+
+
+class UploadError(ValueError):
+    """A chunked upload request that cannot be accepted."""
+
+
+class ChunkedUploads:
+    """Resumable uploads in fixed-size chunks, assembled into a BlobStore.
+
+    Each upload is a directory under ``root`` holding ``upload.json`` and one
+    file per received chunk, so uploads survive restarts and chunks can
+    arrive in any order and in parallel. An upload of known content
+    (``sha256``) uses the digest as its id, so starting it again resumes it.
+    Completing an upload assembles the chunks into the store in a background
+    thread; its state then goes from ``assembling`` to ``complete`` (with the
+    blob's ``sha256``) or ``failed``.
+    """
+
+    def __init__(self, store, root, chunk_size):
+        self.store = store
+        self.root = root
+        self.chunk_size = chunk_size
+        self._assembling = set()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, upload_id, name='upload.json'):
+        return os.path.join(self.root, upload_id, name)
+
+    def _write_meta(self, meta):
+        tmp = self._path(meta['id'], 'upload.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(meta['id']))
+
+    def create(self, name, size, sha256=None):
+        """Start (or resume) an upload; returns its status."""
+        if not isinstance(size, int) or size < 0:
+            raise UploadError('size must be a non-negative integer')
+        if sha256 is not None and not is_valid_sha256(sha256):
+            raise UploadError('Invalid SHA-256')
+        upload_id = sha256 or uuid.uuid4().hex
+        existing = self.get(upload_id)
+        if existing and existing['size'] == size and existing['state'] != 'failed':
+            # A complete upload whose blob was garbage collected since has to be sent again
+            if existing['state'] != 'complete' or (existing['sha256'] and self.store.has(existing['sha256'])):
+                return existing
+        if existing:
+            shutil.rmtree(os.path.join(self.root, upload_id), ignore_errors=True)
+        os.makedirs(os.path.join(self.root, upload_id), exist_ok=True)
+        meta = {
+            'id': upload_id,
+            'name': name,
+            'size': size,
+            'sha256': sha256,
+            'chunk_size': self.chunk_size,
+            'chunks': max(1, -(-size // self.chunk_size)),
+            'state': 'uploading',
+            'error': None,
+            'created_at': time.time(),
+        }
+        if sha256 and self.store.has(sha256):
+            # Content already stored: nothing to upload
+            meta['state'] = 'complete'
+        self._write_meta(meta)
+        return self.get(upload_id)
+
+    def _read_meta(self, upload_id):
+        try:
+            with open(self._path(upload_id), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get(self, upload_id):
+        """Status of an upload (with the indices of received chunks), or None."""
+        meta = self._read_meta(upload_id)
+        if meta is None:
+            return None
+        directory = os.path.join(self.root, upload_id)
+        meta['received'] = sorted(int(n) for n in os.listdir(directory) if n.isdigit())
+        if meta['state'] == 'assembling' and upload_id not in self._assembling:
+            # Interrupted by a restart; completing it again restarts assembly
+            meta['state'] = 'uploading'
+        return meta
+
+    def expected_length(self, meta, index):
+        if index == meta['chunks'] - 1:
+            return meta['size'] - index * meta['chunk_size']
+        return meta['chunk_size']
+
+    def put_chunk(self, upload_id, index, stream, sha256=None):
+        """Store one chunk, verifying its length and (if given) its SHA-256."""
+        meta = self.get(upload_id)
+        if meta is None:
+            raise KeyError(upload_id)
+        if meta['state'] != 'uploading':
+            raise UploadError(f"Upload is {meta['state']}")
+        if not 0 <= index < meta['chunks']:
+            raise UploadError(f"Chunk index out of range (0-{meta['chunks'] - 1})")
+        expected = self.expected_length(meta, index)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, upload_id), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if size > expected:
+                        raise UploadError(f'Chunk {index} is longer than {expected} bytes')
+                    digest.update(chunk)
+                    f.write(chunk)
+            if size != expected:
+                raise UploadError(f'Chunk {index} has {size} bytes, expected {expected}')
+            if sha256 and digest.hexdigest() != sha256:
+                raise BlobHashMismatch(f'Chunk {index} hashes to {digest.hexdigest()}, not {sha256}')
+            os.replace(tmp, self._path(upload_id, str(index)))
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def complete(self, upload_id):
+        """Start assembling a fully received upload; returns its status."""
+        meta = self.get(upload_id)
+        if meta is None:
+            raise KeyError(upload_id)
+        if meta['state'] == 'complete':
+            return meta
+        missing = sorted(set(range(meta['chunks'])) - set(meta['received']))
+        if missing:
+            raise UploadError(f'Missing chunks: {missing[:20]}')
+        with self._lock:
+            if upload_id in self._assembling:
+                return meta
+            self._assembling.add(upload_id)
+        meta['state'] = 'assembling'
+        meta['assembling_since'] = time.time()
+        self._write_meta({k: v for k, v in meta.items() if k != 'received'})
+        threading.Thread(target=self._assemble, args=(meta,), daemon=True).start()
+        return self.get(upload_id)
+
+    def _assemble(self, meta):
+        upload_id = meta['id']
+        try:
+            sha256, _ = self.store.put_stream(_ChunkReader(
+                [self._path(upload_id, str(i)) for i in range(meta['chunks'])]), meta['sha256'])
+            meta.update(state='complete', sha256=sha256)
+            # The chunks are in the store now
+            for i in range(meta['chunks']):
+                os.unlink(self._path(upload_id, str(i)))
+        except Exception as e:
+            meta.update(state='failed', error=str(e))
+        finally:
+            self._write_meta({k: v for k, v in meta.items() if k != 'received'})
+            with self._lock:
+                self._assembling.discard(upload_id)
+
+    def collect_garbage(self, min_age):
+        """Remove uploads that received nothing for ``min_age`` seconds.
+
+        This runs in the worker, while assembly runs in the web process, so
+        uploads are recognised as being assembled by their meta on disk, not
+        by ``_assembling``.
+        """
+        now = time.time()
+        cutoff = now - min_age
+        for upload_id in os.listdir(self.root):
+            meta = self._read_meta(upload_id)
+            if meta and meta['state'] == 'assembling' and now - meta.get('assembling_since', 0) < ASSEMBLY_TIMEOUT:
+                continue
+            # A directory's mtime changes whenever a chunk lands in it
+            path = os.path.join(self.root, upload_id)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    shutil.rmtree(os.path.join(self.root, upload_id), ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+
+class _ChunkReader:
+    """File-like reader over chunk files in order, so assembly streams without a second copy in memory."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.current = None
+
+    def read(self, size):
+        while True:
+            if self.current is None:
+                if not self.paths:
+                    return b''
+                self.current = open(self.paths.pop(0), 'rb')
+            data = self.current.read(size)
+            if data:
+                return data
+            self.current.close()
+            self.current = None
@@ -0,0 +1,183 @@
+import os
+import re
+import time
+import threading
+from datetime import datetime, timezone
+
+# Log sources of a box: the container's own output, and files inside it
+LOG_SOURCES = ('docker', 'autoprompt', 'bridge')
+BOX_LOG_FILES = {
+    'autoprompt': '/var/log/autoprompt.log',
+    'bridge': '/tmp/antigravity_bridge.log',
+}
+# Lines longer than this are cut, so one runaway line cannot hold the buffer
+MAX_LINE = 16 * 1024
+SEGMENT_SUFFIX = '.log'
+
+
+def _segments(directory):
+    """(generation, path) of a ring's segment files, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    segments = []
+    for name in names:
+        stem = name[:-len(SEGMENT_SUFFIX)]
+        if name.endswith(SEGMENT_SUFFIX) and stem.isdigit():
+            segments.append((int(stem), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+class LogRing:
+    """The last ``max_bytes`` of a box's log lines, kept on disk in two rotating segments.
+
+    Lines go to the newest segment. Once it holds half the budget, a new
+    segment is started and the one before it is the only older one kept, so
+    disk use stays under ``max_bytes`` however long the box runs. Being
+    files, the ring can be written by the worker and read by the web app.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.segment_bytes = max(1024, max_bytes // 2)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = _segments(directory)
+        self._generation = segments[-1][0] if segments else 0
+        self._file = None
+        self._size = 0
+
+    def is_empty(self):
+        return all(os.path.getsize(path) == 0 for _, path in _segments(self.directory))
+
+    def last_write(self):
+        """When a line was last appended (from the newest segment's mtime), or None."""
+        segments = _segments(self.directory)
+        return os.path.getmtime(segments[-1][1]) if segments else None
+
+    def append(self, source, line):
+        stamp = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        data = f"{stamp} {source} {line[:MAX_LINE]}\n".encode('utf-8', 'replace')
+        with self._lock:
+            if self._file is None:
+                path = os.path.join(self.directory, f'{self._generation}{SEGMENT_SUFFIX}')
+                self._file = open(path, 'ab')
+                self._size = self._file.tell()
+            if self._size and self._size + len(data) > self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+
+    def _rotate(self):
+        self._file.close()
+        self._generation += 1
+        self._file = open(os.path.join(self.directory, f'{self._generation}{SEGMENT_SUFFIX}'), 'ab')
+        self._size = 0
+        for generation, path in _segments(self.directory):
+            if generation < self._generation - 1:
+                os.unlink(path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class LineSplitter:
+    """Turns a stream of byte chunks into lines; a partial line is held up to MAX_LINE bytes."""
+
+    def __init__(self):
+        self._partial = b''
+
+    def feed(self, chunk):
+        data = self._partial + chunk
+        lines = data.split(b'\n')
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_LINE:
+            lines.append(self._partial)
+            self._partial = b''
+        return [line.rstrip(b'\r').decode('utf-8', 'replace') for line in lines]
+
+    def flush(self):
+        rest, self._partial = self._partial, b''
+        return [rest.decode('utf-8', 'replace')] if rest else []
+
+
+class LogFilter:
+    """Which ring lines to serve: by source, and by a regular expression on the message."""
+
+    def __init__(self, sources=None, pattern=None, ignore_case=False):
+        self.sources = set(sources) if sources else None
+        self.pattern = re.compile(pattern, re.IGNORECASE if ignore_case else 0) if pattern else None
+
+    def __call__(self, line):
+        parts = line.split(' ', 2)
+        if len(parts) < 3:
+            return False
+        if self.sources is not None and parts[1] not in self.sources:
+            return False
+        return self.pattern is None or bool(self.pattern.search(parts[2]))
+
+
+def tail(directory, count, keep):
+    """The last ``count`` lines ``keep`` accepts, and the position to follow from.
+
+    Reads at most the ring's budget; the position is (generation, offset) of
+    the end of what was read.
+    """
+    lines = []
+    position = (0, 0)
+    for generation, path in _segments(directory):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Rotated away while reading
+            continue
+        # Only whole lines; a line being written is picked up by follow()
+        end = data.rfind(b'\n') + 1
+        lines.extend(line for line in data[:end].decode('utf-8', 'replace').splitlines() if keep(line))
+        lines = lines[-count:] if count else []
+        position = (generation, end)
+    return lines, position
+
+
+def follow(directory, position, keep, poll_interval=0.5, timeout=None):
+    """Yield lines ``keep`` accepts as they are appended after ``position``.
+
+    Stops after ``timeout`` seconds, or when the ring's directory is gone (the
+    box was deleted). Moves on to the next segment once the current one is
+    finished; lines of a segment rotated away before being read are skipped.
+    """
+    generation, offset = position
+    splitter = LineSplitter()
+    deadline = time.time() + timeout if timeout else None
+    while deadline is None or time.time() < deadline:
+        if not os.path.isdir(directory):
+            return
+        segments = _segments(directory)
+        current = next((path for g, path in segments if g == generation), None)
+        data = b''
+        if current is not None:
+            try:
+                with open(current, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                current = None
+        if data:
+            offset += len(data)
+            for line in splitter.feed(data):
+                if keep(line):
+                    yield line
+            continue
+        newer = [g for g, _ in segments if g > generation]
+        if newer:
+            generation = newer[0]
+            offset = 0
+            splitter = LineSplitter()
+            continue
+        time.sleep(poll_interval)
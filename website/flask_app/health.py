@@ -0,0 +1,170 @@
+import time
+import threading
+from collections import deque
+
+# Box health states
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+WEDGED = 'wedged'
+
+# Box API calls remembered per box for the error rate
+CALL_WINDOW = 20
+# Error rate judged only over at least this many calls
+MIN_CALLS = 5
+ERROR_RATE_DEGRADED = 0.2
+ERROR_RATE_WEDGED = 0.9
+MEMORY_DEGRADED = 0.9
+CPU_DEGRADED = 0.95
+
+
+def parse_docker_stats(stats):
+    """CPU and memory use from a non-streaming Docker stats sample.
+
+    ``cpu_fraction`` is the share of the node's CPUs the box used since the
+    previous sample and ``cpus_used`` the same in CPUs; memory excludes the
+    page cache, like ``docker stats``.
+    """
+    result = {'cpu_fraction': None, 'cpus_used': None, 'memory_bytes': None, 'memory_limit': None,
+              'memory_fraction': None}
+    cpu, precpu = stats.get('cpu_stats') or {}, stats.get('precpu_stats') or {}
+    try:
+        cpu_delta = cpu['cpu_usage']['total_usage'] - precpu['cpu_usage']['total_usage']
+        system_delta = cpu['system_cpu_usage'] - precpu['system_cpu_usage']
+        if system_delta > 0:
+            result['cpu_fraction'] = max(0.0, cpu_delta / system_delta)
+            online = cpu.get('online_cpus') or len(cpu['cpu_usage'].get('percpu_usage') or [])
+            if online:
+                result['cpus_used'] = result['cpu_fraction'] * online
+    except (KeyError, TypeError):
+        pass
+    memory = stats.get('memory_stats') or {}
+    if memory.get('usage') is not None:
+        detail = memory.get('stats') or {}
+        # cgroup v2 reports inactive_file, v1 reports cache
+        cache = detail.get('inactive_file', detail.get('total_inactive_file', detail.get('cache', 0)))
+        result['memory_bytes'] = max(0, memory['usage'] - cache)
+        if memory.get('limit'):
+            result['memory_limit'] = memory['limit']
+            result['memory_fraction'] = result['memory_bytes'] / memory['limit']
+    return result
+
+
+class BoxHealth:
+    """What the manager recently observed of one box."""
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at or time.time()
+        self.calls = deque(maxlen=CALL_WINDOW)
+        self.probe = None
+        self.probe_failures = 0
+        self.resources = None
+        self.restarts = []
+        self.given_up = False
+
+    def record_call(self, ok):
+        self.calls.append(bool(ok))
+
+    def record_probe(self, probe):
+        """Record a readiness probe result ({"ready", "checks"}); ``None`` if the box did not answer."""
+        self.probe = probe
+        if probe and probe.get('ready'):
+            self.probe_failures = 0
+        else:
+            self.probe_failures += 1
+
+    def record_resources(self, resources):
+        self.resources = resources
+
+    def error_rate(self):
+        if len(self.calls) < MIN_CALLS:
+            return None
+        return self.calls.count(False) / len(self.calls)
+
+    def restarted(self, now=None):
+        """Forget observations from before a restart; the box starts over with a grace period."""
+        now = now or time.time()
+        self.restarts.append(now)
+        self.started_at = now
+        self.calls.clear()
+        self.probe = None
+        self.probe_failures = 0
+
+
+class HealthScorer:
+    """Turns a BoxHealth into healthy, degraded or wedged, with the reasons why.
+
+    A box is wedged when its readiness probe failed ``probe_failures`` times
+    in a row, or nearly every API call fails; one failed probe, an elevated
+    error rate or exhausted memory/CPU only degrade it. Within
+    ``startup_grace`` seconds of (re)starting, a box is at most degraded, as
+    the IDE takes a while to come up.
+    """
+
+    def __init__(self, probe_failures=3, startup_grace=300):
+        self.probe_failures = probe_failures
+        self.startup_grace = startup_grace
+
+    def score(self, health, now=None):
+        now = now or time.time()
+        wedged, degraded = [], []
+
+        if health.probe_failures:
+            failed = _failed_checks(health.probe)
+            reason = f"readiness probe failed {health.probe_failures}x ({failed})"
+            (wedged if health.probe_failures >= self.probe_failures else degraded).append(reason)
+
+        error_rate = health.error_rate()
+        if error_rate is not None:
+            reason = f"{error_rate:.0%} of the last {len(health.calls)} API calls failed"
+            if error_rate >= ERROR_RATE_WEDGED:
+                wedged.append(reason)
+            elif error_rate >= ERROR_RATE_DEGRADED:
+                degraded.append(reason)
+
+        resources = health.resources or {}
+        if (resources.get('memory_fraction') or 0) >= MEMORY_DEGRADED:
+            degraded.append(f"memory at {resources['memory_fraction']:.0%} of its limit")
+        if (resources.get('cpu_quota_fraction') or 0) >= CPU_DEGRADED:
+            degraded.append(f"CPU saturated ({resources['cpu_quota_fraction']:.0%} of its quota)")
+        elif (resources.get('cpu_fraction') or 0) >= CPU_DEGRADED:
+            degraded.append(f"CPU saturated ({resources['cpu_fraction']:.0%} of the node)")
+
+        if wedged and now - health.started_at < self.startup_grace:
+            degraded = ['starting up'] + wedged + degraded
+            wedged = []
+        if wedged:
+            return WEDGED, wedged + degraded
+        if degraded:
+            return DEGRADED, degraded
+        return HEALTHY, []
+
+
+def _failed_checks(probe):
+    if not probe:
+        return 'no answer'
+    failed = [f"{name}: {check.get('error') or 'failed'}"
+              for name, check in (probe.get('checks') or {}).items() if not check.get('ok')]
+    return '; '.join(failed) or 'not ready'
+
+
+class HealthTracker:
+    """BoxHealth per box name, shared by the worker's jobs."""
+
+    def __init__(self):
+        self._boxes = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, started_at=None):
+        with self._lock:
+            if name not in self._boxes:
+                self._boxes[name] = BoxHealth(started_at)
+            return self._boxes[name]
+
+    def record_call(self, name, ok):
+        self.get(name).record_call(ok)
+
+    def forget_except(self, names):
+        """Drop boxes that no longer exist."""
+        with self._lock:
+            for name in set(self._boxes) - set(names):
+                del self._boxes[name]
@@ -0,0 +1,146 @@
+import os
+import fnmatch
+import hashlib
+import threading
+
+IMAGE_REPOSITORY = 'antigravity_auto'
+# Images built by the manager are tagged <repository>:ctx-<context hash>
+TAG_PREFIX = 'ctx-'
+CONTEXT_LABEL = 'cpwn.context'
+# Characters of the context digest used in tags
+HASH_LENGTH = 12
+
+
+class ImageNotReady(Exception):
+    """A node has no box image to start boxes from yet."""
+
+
+def load_dockerignore(context):
+    """Patterns of the context's .dockerignore (negations with ! are not supported)."""
+    try:
+        with open(os.path.join(context, '.dockerignore'), 'r') as f:
+            lines = [line.strip() for line in f]
+    except FileNotFoundError:
+        return []
+    return [line.strip('/') for line in lines if line and not line.startswith(('#', '!'))]
+
+
+def is_ignored(relative_path, patterns):
+    """True if a path, or any directory above it, matches a .dockerignore pattern."""
+    parts = relative_path.split('/')
+    for i in range(1, len(parts) + 1):
+        prefix = '/'.join(parts[:i])
+        if any(fnmatch.fnmatch(prefix, pattern) for pattern in patterns):
+            return True
+    return False
+
+
+class ContextHasher:
+    """Digest of a Docker build context: every file's path, mode and content.
+
+    Files excluded by the context's .dockerignore do not count, so only
+    changes that reach the image change the digest. The digest is reused
+    while no file's size or mtime changed, so checking it costs a directory walk.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self._signature = None
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def _files(self):
+        patterns = load_dockerignore(self.context)
+        files = []
+        for root, dirs, names in os.walk(self.context):
+            relative_root = os.path.relpath(root, self.context)
+            relative_root = '' if relative_root == '.' else relative_root + '/'
+            dirs[:] = sorted(d for d in dirs if not is_ignored(relative_root + d, patterns))
+            for name in sorted(names):
+                if not is_ignored(relative_root + name, patterns):
+                    files.append((relative_root + name, os.path.join(root, name)))
+        return files
+
+    def hash(self):
+        with self._lock:
+            files = self._files()
+            signature = []
+            for relative, path in files:
+                st = os.stat(path)
+                signature.append((relative, st.st_mode, st.st_size, st.st_mtime_ns))
+            if signature != self._signature:
+                digest = hashlib.sha256()
+                for relative, path in files:
+                    digest.update(relative.encode('utf-8') + b'\0')
+                    digest.update(oct(os.stat(path).st_mode & 0o777).encode('ascii') + b'\0')
+                    with open(path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                            digest.update(chunk)
+                    digest.update(b'\0')
+                self._signature = signature
+                self._digest = digest.hexdigest()[:HASH_LENGTH]
+            return self._digest
+
+
+def image_tag(context_hash):
+    return f'{IMAGE_REPOSITORY}:{TAG_PREFIX}{context_hash}'
+
+
+def built_images(client):
+    """Manager-built box images on a node as (created, tag, image), newest first."""
+    found = []
+    for image in client.images.list(name=IMAGE_REPOSITORY):
+        for tag in image.tags:
+            if tag.startswith(f'{IMAGE_REPOSITORY}:{TAG_PREFIX}'):
+                found.append((image.attrs.get('Created', ''), tag, image))
+    found.sort(key=lambda item: item[0], reverse=True)
+    return found
+
+
+def pick_image(client, context_hash, pinned=None):
+    """The image to start a box from on a node; never builds.
+
+    A pinned tag wins (for rolling back). Otherwise the image of the current
+    context, or, while that is still being built, the newest earlier build,
+    or a hand-built ``antigravity_auto:latest``. Raises ImageNotReady if the
+    node has none of them.
+    """
+    tags = {tag for image in client.images.list(name=IMAGE_REPOSITORY) for tag in image.tags}
+    if pinned:
+        if pinned in tags:
+            return pinned
+        raise ImageNotReady(f'Pinned image {pinned} is not on this node')
+    if image_tag(context_hash) in tags:
+        return image_tag(context_hash)
+    built = built_images(client)
+    if built:
+        return built[0][1]
+    if f'{IMAGE_REPOSITORY}:latest' in tags:
+        return f'{IMAGE_REPOSITORY}:latest'
+    raise ImageNotReady('No box image built on this node yet')
+
+
+def build_image(client, context, context_hash):
+    """Build the box image of a context; tagged by its hash and as latest. Returns the tag."""
+    tag = image_tag(context_hash)
+    image, _ = client.images.build(path=context, tag=tag, labels={CONTEXT_LABEL: context_hash}, rm=True)
+    image.tag(IMAGE_REPOSITORY, 'latest')
+    return tag
+
+
+def prune_images(client, keep):
+    """Remove manager-built images beyond the ``keep`` newest, except ones a container uses.
+
+    Returns the removed tags. Older builds are kept for rolling back (BOX_IMAGE).
+    """
+    in_use = {container.attrs.get('Image') for container in client.containers.list(all=True)}
+    removed = []
+    for _, tag, image in built_images(client)[keep:]:
+        if image.id in in_use:
+            continue
+        try:
+            client.images.remove(tag)
+            removed.append(tag)
+        except Exception as e:
+            print(f"Could not remove old image {tag}: {e}")
+    return removed
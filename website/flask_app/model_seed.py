@@ -0,0 +1,174 @@
+import os
+import base64
+import binascii
+import sqlite3
+
+# Antigravity's global state DB, relative to its --user-data-dir (the box's antigravity-data)
+STATE_DB = os.path.join('User', 'globalStorage', 'state.vscdb')
+
+# Field numbers of exa.codeium_common_pb.UserSettings, as declared in the extension's proto descriptors
+REMEMBER_LAST_MODEL_SELECTION = 7
+LAST_SELECTED_CASCADE_MODEL = 9
+LAST_SELECTED_CASCADE_MODEL_OR_ALIAS = 30
+CACHED_CASCADE_MODEL_CONFIGS = 52
+REMEMBER_LAST_MODEL_SELECTION_ENABLED = 1
+# exa.codeium_common_pb.ClientModelConfig and ModelOrAlias
+CONFIG_LABEL = 1
+CONFIG_MODEL_OR_ALIAS = 2
+MODEL_OR_ALIAS_MODEL = 1
+
+VARINT = 0
+LENGTH_DELIMITED = 2
+FIXED_SIZES = {1: 8, 5: 4}
+
+
+class ModelSeedError(Exception):
+    """The model could not be written into a profile; the caller falls back to selecting it in the UI."""
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError('truncated varint')
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError('varint too long')
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def parse_message(data):
+    """Top-level fields of a protobuf message as (number, wire type, value), in order.
+
+    Varints are ints, everything else the raw bytes, so a message can be
+    re-encoded unchanged apart from the fields that are replaced.
+    """
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if number == 0:
+            raise ValueError('field number 0')
+        if wire_type == VARINT:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            length, pos = _read_varint(data, pos)
+            if pos + length > len(data):
+                raise ValueError('truncated field')
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type in FIXED_SIZES:
+            value, pos = data[pos:pos + FIXED_SIZES[wire_type]], pos + FIXED_SIZES[wire_type]
+        else:
+            raise ValueError(f'unsupported wire type {wire_type}')
+        fields.append((number, wire_type, value))
+    return fields
+
+
+def encode_message(fields):
+    out = bytearray()
+    for number, wire_type, value in fields:
+        out += _encode_varint(number << 3 | wire_type)
+        if wire_type == VARINT:
+            out += _encode_varint(value)
+        elif wire_type == LENGTH_DELIMITED:
+            out += _encode_varint(len(value)) + value
+        else:
+            out += value
+    return bytes(out)
+
+
+def cached_model_configs(settings_fields):
+    """(label, raw ModelOrAlias) of the models the IDE last fetched, from UserSettings fields."""
+    configs = []
+    for number, wire_type, value in settings_fields:
+        if number != CACHED_CASCADE_MODEL_CONFIGS or wire_type != LENGTH_DELIMITED:
+            continue
+        config = parse_message(value)
+        label = next((v for n, w, v in config if n == CONFIG_LABEL and w == LENGTH_DELIMITED), None)
+        model_or_alias = next((v for n, w, v in config if n == CONFIG_MODEL_OR_ALIAS and w == LENGTH_DELIMITED), None)
+        if label is not None and model_or_alias is not None:
+            configs.append((label.decode('utf-8', 'replace'), model_or_alias))
+    return configs
+
+
+def _decode_settings(value):
+    """UserSettings fields of a state DB value (base64 of the binary proto), or None if it is not one."""
+    if isinstance(value, bytes):
+        try:
+            value = value.decode('ascii')
+        except UnicodeDecodeError:
+            return None
+    if not isinstance(value, str) or len(value) < 8:
+        return None
+    try:
+        fields = parse_message(base64.b64decode(value, validate=True))
+        return fields if cached_model_configs(fields) else None
+    except (binascii.Error, ValueError):
+        return None
+
+
+def find_user_settings(conn):
+    """(key, value, fields) of the row holding Antigravity's UserSettings.
+
+    The IDE keeps them as a base64 binary proto under a key of its main
+    process; the row is recognized by its cached model configs rather than by
+    a key name that may change between releases.
+    """
+    for key, value in conn.execute('SELECT key, value FROM ItemTable'):
+        fields = _decode_settings(value)
+        if fields is not None:
+            return key, value, fields
+    raise ModelSeedError('No Antigravity user settings with cached models in the profile')
+
+
+def seed_model(user_data_dir, model_label):
+    """Make the profile in ``user_data_dir`` boot with ``model_label`` selected in the agent panel.
+
+    Looks the label up in the model configs the IDE cached in the profile and
+    stores it as the last selected model, with "remember last selection" on.
+    Must run while the IDE is not running. Raises ModelSeedError if the
+    profile has no settings to seed or does not know the model.
+    """
+    path = os.path.join(user_data_dir, STATE_DB)
+    if not os.path.exists(path):
+        raise ModelSeedError(f'No {STATE_DB} in the profile')
+    conn = sqlite3.connect(path)
+    try:
+        key, value, fields = find_user_settings(conn)
+        configs = cached_model_configs(fields)
+        model_or_alias = next((m for label, m in configs if label == model_label), None)
+        if model_or_alias is None:
+            raise ModelSeedError(f"{model_label!r} is not among the profile's models: "
+                                 f"{', '.join(label for label, _ in configs)}")
+        replaced = {REMEMBER_LAST_MODEL_SELECTION, LAST_SELECTED_CASCADE_MODEL, LAST_SELECTED_CASCADE_MODEL_OR_ALIAS}
+        fields = [f for f in fields if f[0] not in replaced]
+        fields.append((REMEMBER_LAST_MODEL_SELECTION, VARINT, REMEMBER_LAST_MODEL_SELECTION_ENABLED))
+        fields.append((LAST_SELECTED_CASCADE_MODEL_OR_ALIAS, LENGTH_DELIMITED, model_or_alias))
+        model = next((v for n, w, v in parse_message(model_or_alias) if n == MODEL_OR_ALIAS_MODEL and w == VARINT), None)
+        if model is not None:
+            fields.append((LAST_SELECTED_CASCADE_MODEL, VARINT, model))
+        encoded = base64.b64encode(encode_message(fields)).decode('ascii')
+        with conn:
+            conn.execute('UPDATE ItemTable SET value = ? WHERE key = ?',
+                         (encoded.encode('ascii') if isinstance(value, bytes) else encoded, key))
+    except sqlite3.Error as e:
+        raise ModelSeedError(f'Could not update {STATE_DB}: {e}')
+    finally:
+        conn.close()
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import threading
+
+import docker
+
+# Seconds a node that failed to answer is left out before it is tried again
+NODE_RETRY_INTERVAL = 30
+# Timeout for Docker API calls to a node
+NODE_TIMEOUT = 10
+# Slots assumed for a node without a capacity when comparing load
+UNLIMITED_WEIGHT = 8
+# Label set on every box so its node is known even from `docker ps`
+NODE_LABEL = 'cpwn.node'
+
+
+class Node:
+    """A Docker daemon that boxes can be placed on.
+
+    ``host`` is where the manager reaches the box's published ports and
+    ``public_host`` is where the browser reaches noVNC (default: the host the
+    manager page was loaded from). ``data_path`` is the directory on the node
+    that holds the manager's container_data (bind-mounted into boxes); without
+    it, challenge and account files are copied into each box instead.
+    ``capacity`` 0 means unlimited.
+    """
+
+    def __init__(self, name, base_url=None, host='host.docker.internal', public_host=None,
+                 capacity=0, data_path=None):
+        self.name = name
+        self.base_url = base_url
+        self.host = host
+        self.public_host = public_host
+        self.capacity = int(capacity or 0)
+        self.data_path = data_path
+
+    @property
+    def is_local(self):
+        """True for the daemon the manager itself talks to through DOCKER_HOST / the socket."""
+        return self.base_url is None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'base_url': self.base_url,
+            'host': self.host,
+            'public_host': self.public_host,
+            'capacity': self.capacity,
+            'shared_data': self.data_path is not None,
+        }
+
+
+def load_nodes(spec, default_host, default_data_path, default_capacity=0):
+    """Read the node list.
+
+    ``spec`` is a JSON list, a path to a file holding one, or empty for just
+    the local daemon. Each entry needs a ``name`` and ``base_url``
+    (e.g. "tcp://10.0.0.5:2375"); see Node for the other keys.
+    """
+    if not spec:
+        return [Node('local', None, default_host, None, default_capacity, default_data_path)]
+    if not spec.lstrip().startswith('['):
+        with open(spec, 'r') as f:
+            spec = f.read()
+    nodes = []
+    for entry in json.loads(spec):
+        if not entry.get('name'):
+            raise ValueError(f'Node entry without a name: {entry!r}')
+        nodes.append(Node(
+            entry['name'],
+            entry.get('base_url'),
+            entry.get('host', default_host),
+            entry.get('public_host'),
+            entry.get('capacity', default_capacity),
+            entry.get('data_path', default_data_path if entry.get('base_url') is None else None),
+        ))
+    if len({n.name for n in nodes}) != len(nodes):
+        raise ValueError('Node names must be unique')
+    return nodes
+
+
+class NodePool:
+    """Docker clients for every node, with nodes that stop answering set aside for a while."""
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self._clients = {}
+        self._down = {}  # node name -> (since, error)
+        self._resources = {}  # node name -> {'cpus', 'memory'}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        return next((n for n in self.nodes if n.name == name), None)
+
+    def client(self, node):
+        with self._lock:
+            if node.name not in self._clients:
+                if node.is_local:
+                    self._clients[node.name] = docker.from_env(timeout=NODE_TIMEOUT)
+                else:
+                    self._clients[node.name] = docker.DockerClient(base_url=node.base_url, timeout=NODE_TIMEOUT)
+            return self._clients[node.name]
+
+    def resources(self, node):
+        """CPUs and memory (bytes) of a node's Docker host, read from the daemon once."""
+        if node.name not in self._resources:
+            info = self.client(node).info()
+            self._resources[node.name] = {'cpus': info['NCPU'], 'memory': info['MemTotal']}
+        return self._resources[node.name]
+
+    def mark_down(self, node, error):
+        with self._lock:
+            if node.name not in self._down:
+                print(f"Node {node.name} is down: {error}")
+            self._down[node.name] = (time.time(), str(error))
+            # Drop the client so a restarted daemon gets a fresh connection
+            self._clients.pop(node.name, None)
+
+    def mark_up(self, node):
+        with self._lock:
+            if self._down.pop(node.name, None):
+                print(f"Node {node.name} is back up")
+
+    def is_available(self, node):
+        down = self._down.get(node.name)
+        return down is None or time.time() - down[0] >= NODE_RETRY_INTERVAL
+
+    def available_nodes(self):
+        return [n for n in self.nodes if self.is_available(n)]
+
+    def list_containers(self, name_prefix):
+        """(node, container) for every container whose name starts with ``name_prefix`` on reachable nodes."""
+        found = []
+        for node in self.available_nodes():
+            try:
+                containers = self.client(node).containers.list(all=True, filters={'name': name_prefix})
+            except Exception as e:
+                self.mark_down(node, e)
+                continue
+            self.mark_up(node)
+            found.extend((node, c) for c in containers if c.name.startswith(name_prefix))
+        return found
+
+    def find_container(self, name):
+        """(node, container) for the container called ``name``. Raises docker.errors.NotFound."""
+        for node in self.available_nodes():
+            try:
+                return node, self.client(node).containers.get(name)
+            except docker.errors.NotFound:
+                continue
+            except Exception as e:
+                self.mark_down(node, e)
+        raise docker.errors.NotFound(f'No such container on any reachable node: {name}')
+
+    def placement_order(self, load):
+        """Nodes with room for another box, least loaded (boxes / capacity) first.
+
+        ``load`` maps node name to its current box count. A node without a
+        capacity never fills up and is balanced as if it had UNLIMITED_WEIGHT slots.
+        """
+        candidates = []
+        for node in self.available_nodes():
+            boxes = load.get(node.name, 0)
+            if node.capacity and boxes >= node.capacity:
+                continue
+            candidates.append((boxes / (node.capacity or UNLIMITED_WEIGHT), boxes, node.name, node))
+        candidates.sort(key=lambda c: c[:3])
+        return [c[3] for c in candidates]
+
+    def status(self, load):
+        """Node list with reachability and box counts, for the API."""
+        result = []
+        for node in self.nodes:
+            down = self._down.get(node.name)
+            result.append(dict(node.to_dict(),
+                               up=down is None,
+                               error=down[1] if down else None,
+                               boxes=load.get(node.name, 0)))
+        return result
+
+
+def copy_into_container(container, source_dir, target_dir):
+    """Copy a directory's contents into a (created, not yet started) container."""
+    _put_tar(container, lambda tar: tar.add(source_dir, arcname=target_dir.lstrip('/'), filter=_regular_files_only))
+
+
+def copy_files_into_container(container, files, target_dir):
+    """Copy (source path, name) pairs into ``target_dir`` of a (created, not yet started) container."""
+    def add(tar):
+        for source, name in files:
+            tar.add(source, arcname=os.path.join(target_dir.lstrip('/'), name))
+    _put_tar(container, add)
+
+
+def _put_tar(container, add):
+    """Build a tar with ``add(tar)`` and extract it at / in the container.
+
+    The tar is written to a temporary file and the upload streams from it, so
+    a large account profile is never held in memory whole. (A spooled file
+    would gain nothing: the upload asks for its fileno, which moves it to disk.)
+    """
+    import tarfile
+    import tempfile
+    with tempfile.TemporaryFile() as archive:
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            add(tar)
+        archive.seek(0)
+        container.put_archive('/', archive)
+
+
+def _regular_files_only(info):
+    # Sockets, pipes and devices in account profiles cannot be recreated in the box
+    if info.isfile() or info.isdir() or info.issym():
+        return info
+    return None
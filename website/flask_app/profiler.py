@@ -0,0 +1,218 @@
+import bisect
+from datetime import datetime, timezone
+
+# Gaps shorter than this between consecutive activity are not reported as idle
+IDLE_GAP_THRESHOLD = 0.5
+
+MODEL_STEP_TYPES = {'CORTEX_STEP_TYPE_PLANNER_RESPONSE'}
+COMMAND_STEP_TYPES = {'CORTEX_STEP_TYPE_RUN_COMMAND', 'CORTEX_STEP_TYPE_COMMAND_STATUS'}
+FILE_STEP_TYPES = {
+    'CORTEX_STEP_TYPE_VIEW_FILE',
+    'CORTEX_STEP_TYPE_LIST_DIRECTORY',
+    'CORTEX_STEP_TYPE_CODE_ACTION',
+    'CORTEX_STEP_TYPE_READ_FILE',
+}
+
+# What each category means for "where is this run limited"
+CATEGORY_BOUND = {
+    'model': 'model',
+    'command': 'tools',
+    'file': 'tools',
+    'tool': 'tools',
+    'queue': 'box',
+    'system': 'box',
+    'idle': 'box',
+    'user': 'user',
+}
+
+
+def parse_timestamp(value):
+    """Parse an RFC 3339 timestamp with nanoseconds ("...T00:05:34.718240674Z") to epoch seconds."""
+    if not value:
+        return None
+    try:
+        value = value.rstrip('Z')
+        if '.' in value:
+            base, fraction = value.split('.', 1)
+        else:
+            base, fraction = value, '0'
+        seconds = datetime.strptime(base, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        return seconds + float('0.' + fraction)
+    except ValueError:
+        return None
+
+
+def step_category(step_type):
+    if step_type in MODEL_STEP_TYPES:
+        return 'model'
+    if step_type in COMMAND_STEP_TYPES:
+        return 'command'
+    if step_type in FILE_STEP_TYPES:
+        return 'file'
+    if step_type == 'CORTEX_STEP_TYPE_USER_INPUT':
+        return 'user'
+    if step_type in ('CORTEX_STEP_TYPE_EPHEMERAL_MESSAGE', 'CORTEX_STEP_TYPE_CONVERSATION_HISTORY',
+                     'CORTEX_STEP_TYPE_CHECKPOINT', 'CORTEX_STEP_TYPE_TASK_BOUNDARY'):
+        return 'system'
+    return 'tool'
+
+
+def step_segments(index, step):
+    """Split one step record into timed segments (start, end, category, phase)."""
+    step_type = step.type
+    created = step.created_at
+    times = dict(step.transitions)
+    done = times.get('CORTEX_STEP_STATUS_DONE') or step.completed_at
+    segments = []
+
+    def add(start, end, category, phase):
+        if start is not None and end is not None and end > start:
+            segments.append({'step': index, 'type': step_type, 'category': category,
+                             'phase': phase, 'start': start, 'end': end})
+
+    if step_type in MODEL_STEP_TYPES:
+        generating = times.get('CORTEX_STEP_STATUS_GENERATING') or step.viewable_at
+        finished = step.finished_generating_at or done
+        add(created, generating, 'model', 'time_to_first_token')
+        add(generating, finished, 'model', 'generating')
+    elif step_type == 'CORTEX_STEP_TYPE_USER_INPUT':
+        add(created, done, 'user', 'input')
+    else:
+        pending = times.get('CORTEX_STEP_STATUS_PENDING')
+        running = times.get('CORTEX_STEP_STATUS_RUNNING')
+        add(pending, running, 'queue', 'pending')
+        add(running or pending or created, done, step_category(step_type), 'running')
+    return segments
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list (0.0 for an empty one)."""
+    if not sorted_values:
+        return 0.0
+    position = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[position]
+
+
+def _critical_path(segments):
+    """Walk back from the last-finishing segment through whatever was active just before it.
+
+    Each predecessor is the segment started before the current one that ran the
+    longest into it; its time is counted only up to where the current one starts.
+    Returns (segment, counted_end) pairs in time order.
+    """
+    if not segments:
+        return []
+    ordered = sorted(segments, key=lambda s: s['start'])
+    starts = [s['start'] for s in ordered]
+    # best_before[i]: segment with the latest end among ordered[0..i]
+    best_before = []
+    for segment in ordered:
+        if not best_before or segment['end'] >= best_before[-1]['end']:
+            best_before.append(segment)
+        else:
+            best_before.append(best_before[-1])
+    current = max(segments, key=lambda s: s['end'])
+    path = [(current, current['end'])]
+    while True:
+        position = bisect.bisect_left(starts, current['start']) - 1
+        if position < 0:
+            break
+        current = best_before[position]
+        path.append((current, min(current['end'], path[-1][0]['start'])))
+    path.reverse()
+    return path
+
+
+def profile_trajectory(steps):
+    """Break a trajectory (a list of step records) down into where its wall-clock time went."""
+    segments = []
+    by_type = {}
+    for index, step in enumerate(steps):
+        step_segs = step_segments(index, step)
+        segments.extend(step_segs)
+        if step_segs:
+            duration = max(s['end'] for s in step_segs) - min(s['start'] for s in step_segs)
+            by_type.setdefault(step.type, []).append(duration)
+
+    # Waiting for the user: from a notification until the next user input
+    for index, step in enumerate(steps):
+        if step.type != 'CORTEX_STEP_TYPE_NOTIFY_USER':
+            continue
+        notified = max((s['end'] for s in segments if s['step'] == index), default=None)
+        for next_index in range(index + 1, len(steps)):
+            if steps[next_index].type == 'CORTEX_STEP_TYPE_USER_INPUT':
+                replied = steps[next_index].created_at
+                if notified is not None and replied is not None and replied > notified:
+                    segments.append({'step': index, 'type': step.type, 'category': 'user',
+                                     'phase': 'waiting_for_user', 'start': notified, 'end': replied})
+                break
+
+    if not segments:
+        return {'steps': len(steps), 'wall_seconds': 0, 'segments': [], 'by_step_type': {},
+                'categories': {}, 'critical_path': {'steps': [], 'seconds_by_category': {}},
+                'idle_gaps': [], 'bound': None}
+
+    segments.sort(key=lambda s: (s['start'], s['end']))
+    start = segments[0]['start']
+    end = max(s['end'] for s in segments)
+
+    # Idle gaps: stretches where no segment of any step is active
+    idle_gaps = []
+    covered_until = start
+    last_step = segments[0]['step']
+    for segment in segments:
+        if segment['start'] - covered_until >= IDLE_GAP_THRESHOLD:
+            idle_gaps.append({'start': covered_until - start, 'end': segment['start'] - start,
+                              'seconds': segment['start'] - covered_until,
+                              'after_step': last_step, 'before_step': segment['step']})
+        if segment['end'] > covered_until:
+            covered_until = segment['end']
+            last_step = segment['step']
+
+    categories = {}
+    for segment in segments:
+        categories[segment['category']] = categories.get(segment['category'], 0.0) + segment['end'] - segment['start']
+    categories['idle'] = sum(gap['seconds'] for gap in idle_gaps)
+
+    path = _critical_path(segments)
+    path_seconds = {}
+    previous_end = None
+    for segment, counted_end in path:
+        if previous_end is not None and segment['start'] > previous_end:
+            path_seconds['idle'] = path_seconds.get('idle', 0.0) + segment['start'] - previous_end
+        path_seconds[segment['category']] = path_seconds.get(segment['category'], 0.0) + counted_end - segment['start']
+        previous_end = counted_end
+
+    bound_seconds = {}
+    for category, seconds in path_seconds.items():
+        bound = CATEGORY_BOUND.get(category, 'tools')
+        bound_seconds[bound] = bound_seconds.get(bound, 0.0) + seconds
+
+    type_stats = {}
+    for step_type, durations in by_type.items():
+        durations.sort()
+        type_stats[step_type] = {
+            'count': len(durations),
+            'total': sum(durations),
+            'mean': sum(durations) / len(durations),
+            'p50': percentile(durations, 0.5),
+            'p95': percentile(durations, 0.95),
+            'max': durations[-1],
+        }
+
+    return {
+        'steps': len(steps),
+        'start': start,
+        'end': end,
+        'wall_seconds': end - start,
+        'categories': categories,
+        'by_step_type': type_stats,
+        'critical_path': {
+            'steps': sorted({segment['step'] for segment, _ in path}),
+            'seconds_by_category': path_seconds,
+            'seconds_by_bound': bound_seconds,
+        },
+        'idle_gaps': idle_gaps,
+        'bound': max(bound_seconds, key=bound_seconds.get) if bound_seconds else None,
+        'segments': [dict(s, start=s['start'] - start, end=s['end'] - start) for s in segments],
+    }
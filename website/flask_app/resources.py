@@ -0,0 +1,250 @@
+import os
+import json
+import math
+import fnmatch
+
+# Labels recording the resource profile a box was given
+PROFILE_LABEL = 'cpwn.profile'
+DEDICATED_LABEL = 'cpwn.dedicated'
+
+SIZE_UNITS = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+DEFAULT_PROFILE = 'standard'
+DEFAULT_PROFILES = {
+    DEFAULT_PROFILE: {'cpus': 2, 'memory': '6g', 'shm_size': '2g'},
+}
+
+
+def parse_size(value):
+    """Bytes of a size given as a number or like ``512m`` / ``6g``."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().lower().rstrip('ib')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def parse_cpuset(text):
+    """Core numbers of a cpuset like ``0-3,6``."""
+    cores = set()
+    for part in (text or '').split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            cores.update(range(int(first), int(last) + 1))
+        elif part:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def format_cpuset(cores):
+    """Cpuset string of core numbers, with runs collapsed (``0-3,6``)."""
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+class ResourceProfile:
+    """CPU, memory and shared-memory limits given to a box.
+
+    ``cpus`` is a quota (CFS), shared with other boxes' quotas on the node's
+    shared cores; a ``dedicated`` profile instead gets ceil(cpus) cores of
+    its own that no other box runs on. ``memory`` is a hard limit without swap.
+    """
+
+    def __init__(self, name, cpus=0, memory=None, shm_size='2g', dedicated=False):
+        self.name = name
+        self.cpus = float(cpus or 0)
+        self.memory = parse_size(memory) if memory else 0
+        self.shm_size = parse_size(shm_size)
+        self.dedicated = bool(dedicated)
+        if self.dedicated and self.cpus < 1:
+            raise ValueError(f'Resource profile {name!r} is dedicated but asks for less than one CPU')
+
+    @property
+    def cores(self):
+        """Cores a dedicated box takes."""
+        return math.ceil(self.cpus)
+
+    def container_kwargs(self, cpuset=None):
+        """docker-py ``containers.create`` arguments applying this profile."""
+        kwargs = {'shm_size': self.shm_size}
+        if self.cpus:
+            kwargs['nano_cpus'] = int(self.cpus * 1e9)
+        if self.memory:
+            kwargs['mem_limit'] = self.memory
+            # No swap: a box over its limit is OOM-killed instead of slowing the whole node down
+            kwargs['memswap_limit'] = self.memory
+        if cpuset:
+            kwargs['cpuset_cpus'] = format_cpuset(cpuset)
+        return kwargs
+
+    def labels(self):
+        return {PROFILE_LABEL: self.name, DEDICATED_LABEL: '1' if self.dedicated else '0'}
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'cpus': self.cpus or None,
+            'memory': self.memory or None,
+            'shm_size': self.shm_size,
+            'dedicated': self.dedicated,
+        }
+
+
+class ResourceProfiles:
+    """Named profiles and which one a box gets, by challenge (glob patterns) or else by model."""
+
+    def __init__(self, profiles, default=DEFAULT_PROFILE, models=None, challenges=None):
+        self.profiles = profiles
+        self.default = default
+        self.models = models or {}
+        self.challenges = challenges or {}
+        for name in [default] + list(self.models.values()) + list(self.challenges.values()):
+            if name not in profiles:
+                raise ValueError(f'Unknown resource profile: {name!r}')
+
+    def get(self, name):
+        return self.profiles[name]
+
+    def profile_for(self, model=None, challenge=None):
+        if challenge:
+            for pattern, name in self.challenges.items():
+                if fnmatch.fnmatch(challenge, pattern):
+                    return self.profiles[name]
+        if model in self.models:
+            return self.profiles[self.models[model]]
+        return self.profiles[self.default]
+
+    def to_dict(self):
+        return {
+            'default': self.default,
+            'profiles': {name: profile.to_dict() for name, profile in self.profiles.items()},
+            'models': self.models,
+            'challenges': self.challenges,
+        }
+
+
+def load_profiles(spec):
+    """Resource profiles from RESOURCE_PROFILES: JSON, or the path of a JSON file.
+
+    ``{"default": "standard", "profiles": {"standard": {"cpus": 2, "memory": "6g",
+    "shm_size": "2g"}, "solver": {"cpus": 4, "memory": "12g", "dedicated": true}},
+    "models": {"<model>": "solver"}, "challenges": {"rev-*": "solver"}}``. Empty
+    means one ``standard`` profile for every box.
+    """
+    spec = (spec or '').strip()
+    if not spec:
+        config = {}
+    elif spec.startswith('{'):
+        config = json.loads(spec)
+    else:
+        with open(os.path.expanduser(spec), 'r') as f:
+            config = json.load(f)
+    profiles = {name: ResourceProfile(name, **fields)
+                for name, fields in (config.get('profiles') or DEFAULT_PROFILES).items()}
+    default = config.get('default') or (DEFAULT_PROFILE if DEFAULT_PROFILE in profiles else next(iter(profiles)))
+    return ResourceProfiles(profiles, default, config.get('models'), config.get('challenges'))
+
+
+def box_limits(host_config, labels=None):
+    """The limits a container was created with, from its inspect ``HostConfig`` and labels."""
+    host_config = host_config or {}
+    labels = labels or {}
+    cpus = None
+    if host_config.get('NanoCpus'):
+        cpus = host_config['NanoCpus'] / 1e9
+    elif (host_config.get('CpuQuota') or 0) > 0 and host_config.get('CpuPeriod'):
+        cpus = host_config['CpuQuota'] / host_config['CpuPeriod']
+    return {
+        'profile': labels.get(PROFILE_LABEL),
+        'cpus': cpus,
+        'memory': host_config.get('Memory') or None,
+        'shm_size': host_config.get('ShmSize') or None,
+        'cpuset': host_config.get('CpusetCpus') or None,
+        'dedicated': labels.get(DEDICATED_LABEL) == '1',
+    }
+
+
+class NodeUsage:
+    """The CPU and memory the boxes on one node were given, against what the node has.
+
+    Cores of dedicated boxes are taken out of the shared pool; the quotas of
+    all other boxes share what is left, overcommitted by ``cpu_overcommit``
+    (most boxes idle while waiting on the model). Memory is never overcommitted.
+    """
+
+    def __init__(self, cpus, memory, cpu_overcommit=1.0):
+        self.cpus = cpus
+        self.memory = memory
+        self.cpu_overcommit = cpu_overcommit
+        self.shared_cpus = 0.0
+        self.committed_memory = 0
+        self.dedicated_cores = set()
+        self.boxes = 0
+
+    def add(self, limits):
+        self.boxes += 1
+        self.committed_memory += limits.get('memory') or 0
+        if limits.get('dedicated') and limits.get('cpuset'):
+            self.dedicated_cores.update(parse_cpuset(limits['cpuset']))
+        else:
+            self.shared_cpus += limits.get('cpus') or 0
+
+    def shared_cores(self):
+        return [core for core in range(self.cpus) if core not in self.dedicated_cores]
+
+    def _cpu_room(self, shared_cores):
+        return shared_cores * self.cpu_overcommit - self.shared_cpus
+
+    def fits(self, profile):
+        if profile.memory and self.committed_memory + profile.memory > self.memory:
+            return False
+        shared = len(self.shared_cores())
+        if profile.dedicated:
+            # The shared boxes' quotas must still fit on the cores left to them
+            left = shared - profile.cores
+            return left >= (1 if self.shared_cpus else 0) and self._cpu_room(left) >= 0
+        return self._cpu_room(shared) >= profile.cpus
+
+    def leftover(self, profile):
+        """Share of the node's CPU and memory still free after placing ``profile`` (lower = tighter fit)."""
+        shared = len(self.shared_cores())
+        if profile.dedicated:
+            cpu_free = self._cpu_room(shared - profile.cores) / (self.cpus * self.cpu_overcommit)
+        else:
+            cpu_free = (self._cpu_room(shared) - profile.cpus) / (self.cpus * self.cpu_overcommit)
+        memory_free = (self.memory - self.committed_memory - profile.memory) / self.memory if self.memory else 0
+        return (cpu_free + memory_free) / 2
+
+    def pick_cores(self, profile):
+        """Cores for a dedicated box: the highest free ones, leaving core 0 (interrupts, the daemon) shared."""
+        return sorted(self.shared_cores()[-profile.cores:])
+
+    def to_dict(self):
+        return {
+            'cpus': self.cpus,
+            'memory': self.memory,
+            'cpu_overcommit': self.cpu_overcommit,
+            'shared_cpus_committed': round(self.shared_cpus, 2),
+            'memory_committed': self.committed_memory,
+            'dedicated_cores': format_cpuset(self.dedicated_cores) or None,
+            'boxes': self.boxes,
+        }
+
+
+def best_fit(usages, profile):
+    """(node, usage) pairs with room for ``profile``, the tightest fit first.
+
+    Packing each box where it leaves the least room free keeps large gaps open
+    on other nodes for boxes with bigger profiles.
+    """
+    fitting = [(usage.leftover(profile), node.name, node, usage)
+               for node, usage in usages if usage.fits(profile)]
+    fitting.sort(key=lambda item: item[:2])
+    return [(node, usage) for _, _, node, usage in fitting]
@@ -1,3 +1,7 @@
 #!/bin/bash
 cd /home/cpwn/boxes/website/flask_app
+# Background jobs run in their own process; stop it when the web app exits
+python3 worker.py &
+WORKER_PID=$!
+trap "kill $WORKER_PID" EXIT
 python3 app.py
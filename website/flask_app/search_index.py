@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import time
+
+# Longest text indexed per step field; command outputs beyond this are cut
+MAX_BODY_CHARS = 200000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    step_index INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    container_name TEXT,
+    display_name TEXT,
+    UNIQUE (run_id, step_index, kind)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(body, tokenize = 'unicode61');
+'''
+
+
+def extract_step_texts(step):
+    """Return (kind, text) pairs worth searching in a trajectory step record."""
+    step_type = step.type
+    texts = []
+    if step_type == 'CORTEX_STEP_TYPE_RUN_COMMAND':
+        texts.append(('command', step.command_line))
+        texts.append(('output', step.output))
+    elif step_type == 'CORTEX_STEP_TYPE_COMMAND_STATUS':
+        texts.append(('output', step.output))
+    elif step_type == 'CORTEX_STEP_TYPE_VIEW_FILE':
+        texts.append(('file', f"{step.file_path}\n{step.file_content}"))
+    elif step_type == 'CORTEX_STEP_TYPE_PLANNER_RESPONSE':
+        texts.append(('response', step.response))
+        texts.append(('thinking', step.thinking))
+    return [(kind, text[:MAX_BODY_CHARS]) for kind, text in texts if text and text.strip()]
+
+
+def _quote_query(query):
+    """Turn free text into a single FTS5 phrase."""
+    return '"' + query.replace('"', '""') + '"'
+
+
+class SearchIndex:
+    """SQLite FTS5 index over the text of archived trajectory steps.
+
+    ``docs`` maps (run, step, kind) to a rowid so a changed step can be replaced
+    with a primary-key delete; ``docs_fts`` holds the searchable text.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def index_steps(self, run_id, steps, step_indices, run_info=None):
+        """(Re)index the given steps of a run. ``steps`` is the full list of step records."""
+        run_info = run_info or {}
+        rows = []
+        for index in step_indices:
+            if 0 <= index < len(steps):
+                for kind, text in extract_step_texts(steps[index]):
+                    rows.append((index, kind, text))
+        if not rows:
+            return 0
+        conn = self._connect()
+        try:
+            with conn:
+                for index, kind, text in rows:
+                    existing = conn.execute(
+                        'SELECT id FROM docs WHERE run_id = ? AND step_index = ? AND kind = ?',
+                        (run_id, index, kind)).fetchone()
+                    if existing:
+                        conn.execute('DELETE FROM docs_fts WHERE rowid = ?', (existing[0],))
+                        doc_id = existing[0]
+                    else:
+                        doc_id = conn.execute(
+                            'INSERT INTO docs (run_id, step_index, kind, container_name, display_name) VALUES (?, ?, ?, ?, ?)',
+                            (run_id, index, kind, run_info.get('container_name'), run_info.get('display_name'))).lastrowid
+                    conn.execute('INSERT INTO docs_fts (rowid, body) VALUES (?, ?)', (doc_id, text))
+        finally:
+            conn.close()
+        return len(rows)
+
+    def indexed_runs(self):
+        conn = self._connect()
+        try:
+            return {row[0] for row in conn.execute('SELECT DISTINCT run_id FROM docs')}
+        finally:
+            conn.close()
+
+    def search(self, query, kind=None, limit=50):
+        """Search step text. Returns (results, milliseconds taken)."""
+        start = time.perf_counter()
+        sql = '''
+            SELECT docs.run_id, docs.step_index, docs.kind, docs.container_name, docs.display_name,
+                   snippet(docs_fts, 0, '[[', ']]', '...', 16), bm25(docs_fts)
+            FROM docs_fts JOIN docs ON docs.id = docs_fts.rowid
+            WHERE docs_fts MATCH ? {kind_filter}
+            ORDER BY bm25(docs_fts)
+            LIMIT ?
+        '''.format(kind_filter='AND docs.kind = ?' if kind else '')
+        conn = self._connect()
+        try:
+            def run(match):
+                params = [match] + ([kind] if kind else []) + [limit]
+                return conn.execute(sql, params).fetchall()
+            try:
+                rows = run(query)
+            except sqlite3.OperationalError:
+                # Not valid FTS5 syntax (e.g. "flag{"), search it as a literal phrase
+                rows = run(_quote_query(query))
+        finally:
+            conn.close()
+        results = [{
+            'run_id': row[0],
+            'step_index': row[1],
+            'kind': row[2],
+            'container_name': row[3],
+            'display_name': row[4],
+            'snippet': row[5],
+            'score': row[6],
+        } for row in rows]
+        return results, (time.perf_counter() - start) * 1000
@@ -0,0 +1,666 @@
+import os
+import json
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    container_name TEXT,
+    display_name TEXT,
+    challenge TEXT,
+    account TEXT,
+    model TEXT,
+    status TEXT,
+    updated_at REAL,
+    deploy_id TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_container ON runs (container_name);
+CREATE TABLE IF NOT EXISTS step_usage (
+    run_id TEXT NOT NULL,
+    step_index INTEGER NOT NULL,
+    step_type TEXT,
+    generator_model TEXT,
+    model_cost REAL NOT NULL DEFAULT 0,
+    flow_credits REAL NOT NULL DEFAULT 0,
+    prompt_credits REAL NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at REAL,
+    PRIMARY KEY (run_id, step_index)
+);
+CREATE TABLE IF NOT EXISTS benchmarks (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    corpus TEXT NOT NULL,
+    account TEXT NOT NULL,
+    models TEXT NOT NULL,
+    repeats INTEGER NOT NULL,
+    concurrency INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS benchmark_attempts (
+    id INTEGER PRIMARY KEY,
+    benchmark_id INTEGER NOT NULL REFERENCES benchmarks (id),
+    challenge TEXT NOT NULL,
+    model TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    container_name TEXT,
+    run_id TEXT,
+    started_at REAL,
+    finished_at REAL,
+    wall_seconds REAL,
+    time_to_flag REAL,
+    steps INTEGER,
+    credits REAL,
+    model_cost REAL,
+    output_tokens INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS benchmark_attempts_benchmark ON benchmark_attempts (benchmark_id);
+CREATE TABLE IF NOT EXISTS flags (
+    id INTEGER PRIMARY KEY,
+    container_name TEXT NOT NULL,
+    display_name TEXT,
+    flag TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    deploy_id TEXT,
+    UNIQUE (container_name, flag, timestamp)
+);
+CREATE TABLE IF NOT EXISTS box_status (
+    name TEXT PRIMARY KEY,
+    status TEXT,
+    conversations TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS box_health (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    reasons TEXT NOT NULL,
+    probe TEXT,
+    error_rate REAL,
+    resources TEXT,
+    restarts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS run_events (
+    id INTEGER PRIMARY KEY,
+    container_name TEXT NOT NULL,
+    event TEXT NOT NULL,
+    detail TEXT,
+    created_at REAL NOT NULL,
+    deploy_id TEXT
+);
+CREATE INDEX IF NOT EXISTS run_events_container ON run_events (container_name);
+CREATE TABLE IF NOT EXISTS containers (
+    name TEXT PRIMARY KEY,
+    number INTEGER NOT NULL,
+    display_name TEXT,
+    container_id TEXT,
+    status TEXT,
+    node TEXT,
+    host TEXT,
+    public_host TEXT,
+    ip_address TEXT,
+    ports TEXT NOT NULL DEFAULT '{}',
+    account TEXT,
+    model TEXT,
+    group_name TEXT,
+    challenge TEXT,
+    limits TEXT,
+    removed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS containers_number ON containers (number);
+CREATE INDEX IF NOT EXISTS containers_updated ON containers (updated_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+# Columns added to tables after they first shipped, as (table, column, type); databases
+# created before then get them on open
+ADDED_COLUMNS = (
+    ('flags', 'deploy_id', 'TEXT'),
+    ('runs', 'deploy_id', 'TEXT'),
+    ('run_events', 'deploy_id', 'TEXT'),
+    ('containers', 'limits', 'TEXT'),
+)
+
+# Ways the analytics can be grouped; each maps to a column of run_totals()
+ANALYTICS_GROUPS = ('model', 'account', 'challenge', 'run')
+
+# Container listing filters and the registry columns they match
+CONTAINER_FILTERS = {
+    'status': 'status',
+    'group': 'group_name',
+    'model': 'model',
+    'account': 'account',
+    'node': 'node',
+}
+# Registry fields kept per container (besides name, removed and updated_at)
+CONTAINER_FIELDS = ('number', 'display_name', 'container_id', 'status', 'node', 'host', 'public_host',
+                    'ip_address', 'ports', 'account', 'model', 'group_name', 'challenge', 'limits')
+
+
+def step_usage(step):
+    """Pull the usage fields out of one trajectory step record."""
+    return {
+        'step_type': step.type,
+        'generator_model': step.generator_model,
+        'model_cost': step.model_cost,
+        'flow_credits': step.flow_credits,
+        'prompt_credits': step.prompt_credits,
+        'output_tokens': step.output_tokens,
+        'created_at': step.created_at,
+    }
+
+
+def _registry_container(row):
+    """A containers row in the shape of get_deployed_containers' entries."""
+    ports = json.loads(row['ports'])
+    return {
+        'name': row['name'],
+        'number': row['number'],
+        'display_name': row['display_name'],
+        'id': row['container_id'],
+        'status': row['status'],
+        'ip_address': row['ip_address'],
+        'ports': ports,
+        'novnc_port': ports.get('6080/tcp'),
+        'api_port': ports.get('4020/tcp'),
+        'node': row['node'],
+        'host': row['host'],
+        'public_host': row['public_host'],
+        'account': row['account'],
+        'model': row['model'],
+        'group': row['group_name'],
+        'challenge': row['challenge'],
+        # Rows from before limits were registered get them on the next sweep
+        'limits': json.loads(row['limits']) if row['limits'] else {},
+        'updated_at': row['updated_at'],
+    }
+
+
+class Store:
+    """The manager's SQLite database.
+
+    Usage is kept per step, keyed by (run, step), so the archiver only has to
+    upsert the steps that changed since its last sweep; totals per run, model,
+    account or challenge are sums over those rows.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            for table, column, column_type in ADDED_COLUMNS:
+                if column not in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+                    try:
+                        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+                    except sqlite3.OperationalError as e:
+                        # The other process added it first
+                        if 'duplicate column' not in str(e):
+                            raise
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # ---------- usage ----------
+
+    def record_usage(self, run_id, steps, step_indices, run_info=None):
+        """Record usage of the given steps of a run. ``steps`` is the full list of step records."""
+        run_info = run_info or {}
+        rows = []
+        for index in step_indices:
+            if 0 <= index < len(steps):
+                usage = step_usage(steps[index])
+                rows.append((run_id, index, usage['step_type'], usage['generator_model'],
+                             usage['model_cost'], usage['flow_credits'], usage['prompt_credits'],
+                             usage['output_tokens'], usage['created_at']))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO runs (run_id, container_name, display_name, challenge, account, model, status,
+                                      updated_at, deploy_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (run_id) DO UPDATE SET
+                        container_name = COALESCE(excluded.container_name, container_name),
+                        deploy_id = COALESCE(excluded.deploy_id, deploy_id),
+                        display_name = COALESCE(excluded.display_name, display_name),
+                        challenge = COALESCE(excluded.challenge, challenge),
+                        account = COALESCE(excluded.account, account),
+                        model = COALESCE(excluded.model, model),
+                        status = COALESCE(excluded.status, status),
+                        updated_at = excluded.updated_at
+                ''', (run_id, run_info.get('container_name'), run_info.get('display_name'),
+                      run_info.get('challenge') or run_info.get('display_name'),
+                      run_info.get('account'), run_info.get('model'), run_info.get('status'), time.time(),
+                      run_info.get('deploy_id')))
+                conn.executemany('''
+                    INSERT OR REPLACE INTO step_usage
+                        (run_id, step_index, step_type, generator_model, model_cost,
+                         flow_credits, prompt_credits, output_tokens, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+        finally:
+            conn.close()
+        return len(rows)
+
+    def usage_runs(self):
+        """Run ids with recorded usage."""
+        conn = self._connect()
+        try:
+            return {row[0] for row in conn.execute('SELECT run_id FROM runs')}
+        finally:
+            conn.close()
+
+    def run_totals(self):
+        """Usage summed per run, with the run's labels."""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute('''
+                SELECT runs.run_id AS run, runs.container_name, runs.deploy_id, runs.display_name, runs.challenge,
+                       runs.account, runs.status,
+                       COALESCE(runs.model, (
+                           SELECT generator_model FROM step_usage g
+                           WHERE g.run_id = runs.run_id AND generator_model IS NOT NULL
+                           GROUP BY generator_model ORDER BY COUNT(*) DESC LIMIT 1
+                       )) AS model,
+                       COUNT(u.step_index) AS steps,
+                       COALESCE(SUM(u.model_cost), 0) AS model_cost,
+                       COALESCE(SUM(u.flow_credits), 0) AS flow_credits,
+                       COALESCE(SUM(u.prompt_credits), 0) AS prompt_credits,
+                       COALESCE(SUM(u.output_tokens), 0) AS output_tokens,
+                       MIN(u.created_at) AS first_step_at,
+                       MAX(u.created_at) AS last_step_at
+                FROM runs LEFT JOIN step_usage u ON u.run_id = runs.run_id
+                GROUP BY runs.run_id
+            ''').fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    # ---------- benchmarks ----------
+
+    def create_benchmark(self, name, corpus, account, models, repeats, concurrency, challenges):
+        """Create a benchmark with one pending attempt per (challenge, model, repeat)."""
+        conn = self._connect()
+        try:
+            with conn:
+                benchmark_id = conn.execute('''
+                    INSERT INTO benchmarks (name, corpus, account, models, repeats, concurrency, status, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)
+                ''', (name, corpus, account, json.dumps(models), repeats, concurrency, time.time())).lastrowid
+                # Repeats outermost so every model gets its first attempt before any second one
+                conn.executemany('''
+                    INSERT INTO benchmark_attempts (benchmark_id, challenge, model, attempt, status)
+                    VALUES (?, ?, ?, ?, 'pending')
+                ''', [(benchmark_id, challenge, model, attempt)
+                      for attempt in range(1, repeats + 1)
+                      for challenge in challenges
+                      for model in models])
+        finally:
+            conn.close()
+        return benchmark_id
+
+    def _update(self, table, row_id, fields):
+        assignments = ', '.join(f'{column} = ?' for column in fields)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f'UPDATE {table} SET {assignments} WHERE id = ?', list(fields.values()) + [row_id])
+        finally:
+            conn.close()
+
+    def update_benchmark(self, benchmark_id, **fields):
+        self._update('benchmarks', benchmark_id, fields)
+
+    def update_attempt(self, attempt_id, **fields):
+        self._update('benchmark_attempts', attempt_id, fields)
+
+    def _query(self, sql, params=()):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def list_benchmarks(self):
+        """All benchmarks, newest first."""
+        benchmarks = self._query('SELECT * FROM benchmarks ORDER BY id DESC')
+        for benchmark in benchmarks:
+            benchmark['models'] = json.loads(benchmark['models'])
+        return benchmarks
+
+    def get_benchmark(self, benchmark_id):
+        rows = self._query('SELECT * FROM benchmarks WHERE id = ?', (benchmark_id,))
+        if not rows:
+            return None
+        rows[0]['models'] = json.loads(rows[0]['models'])
+        return rows[0]
+
+    def benchmark_attempts(self, benchmark_id):
+        return self._query('SELECT * FROM benchmark_attempts WHERE benchmark_id = ? ORDER BY id', (benchmark_id,))
+
+    def benchmarks_with_status(self, status):
+        return self._query('SELECT id FROM benchmarks WHERE status = ? ORDER BY id', (status,))
+
+    def reset_interrupted_attempts(self):
+        """Mark attempts left running by a stopped worker as errors; their boxes are gone or orphaned."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE benchmark_attempts SET status = 'error', error = 'Interrupted by worker restart',
+                        finished_at = ? WHERE status = 'running'
+                ''', (time.time(),))
+        finally:
+            conn.close()
+
+    # ---------- flags ----------
+
+    def add_flag(self, container_name, display_name, flag, timestamp, deploy_id=None):
+        """Record a flag; ``deploy_id`` tells apart boxes that were deployed under the same name."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO flags (container_name, display_name, flag, timestamp, deploy_id)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (container_name, display_name, flag, timestamp, deploy_id))
+        finally:
+            conn.close()
+
+    def list_flags(self):
+        """Found flags (and no-flag markers) in the order they were recorded."""
+        return self._query('SELECT container_name, display_name, flag, timestamp, deploy_id FROM flags ORDER BY id')
+
+    # ---------- box status ----------
+
+    def replace_box_status(self, boxes):
+        """Replace the status snapshot of all boxes with ``boxes`` (name, status, conversations)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM box_status')
+                conn.executemany(
+                    'INSERT INTO box_status (name, status, conversations, updated_at) VALUES (?, ?, ?, ?)',
+                    [(box['name'], box['status'], json.dumps(box['conversations']), now) for box in boxes])
+        finally:
+            conn.close()
+
+    def list_box_status(self):
+        boxes = self._query('SELECT * FROM box_status ORDER BY name')
+        for box in boxes:
+            box['conversations'] = json.loads(box['conversations'])
+        return boxes
+
+    # ---------- box health ----------
+
+    def replace_box_health(self, boxes):
+        """Replace the health snapshot of all boxes (name, state, reasons, probe, error_rate, resources, restarts)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM box_health')
+                conn.executemany('''
+                    INSERT INTO box_health (name, state, reasons, probe, error_rate, resources, restarts, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(box['name'], box['state'], json.dumps(box['reasons']), json.dumps(box['probe']),
+                       box['error_rate'], json.dumps(box['resources']), box['restarts'], now) for box in boxes])
+        finally:
+            conn.close()
+
+    def list_box_health(self):
+        boxes = self._query('SELECT * FROM box_health ORDER BY name')
+        for box in boxes:
+            for field in ('reasons', 'probe', 'resources'):
+                box[field] = json.loads(box[field]) if box[field] else None
+        return boxes
+
+    def add_run_event(self, container_name, event, detail=None, deploy_id=None):
+        """Record something that happened to a box's run (restart, redeploy, ...).
+
+        ``deploy_id`` ties the event to one deploy, as box names are reused.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO run_events (container_name, event, detail, created_at, deploy_id)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (container_name, event, json.dumps(detail or {}), time.time(), deploy_id))
+        finally:
+            conn.close()
+
+    def run_events(self, container_name=None, run_id=None, deploy_id=None):
+        """Events of one deploy of a box, or of the deploy an archived run ran on, oldest first.
+
+        Runs and events from before deploy ids were recorded have none, and
+        only match each other.
+        """
+        if run_id is not None:
+            events = self._query('''
+                SELECT e.* FROM run_events e JOIN runs r ON r.run_id = ?
+                WHERE e.container_name = r.container_name AND e.deploy_id IS r.deploy_id ORDER BY e.id
+            ''', (run_id,))
+        else:
+            events = self._query('SELECT * FROM run_events WHERE container_name = ? AND deploy_id IS ? ORDER BY id',
+                                 (container_name, deploy_id))
+        for event in events:
+            event['detail'] = json.loads(event['detail']) if event['detail'] else {}
+        return events
+
+    # ---------- container registry ----------
+
+    def _write_containers(self, upserts, removals=(), keep_names=None, skip_nodes=()):
+        """Apply registry changes in one write transaction; returns how many rows changed.
+
+        Rows are only touched when a field actually changed. Writers are
+        serialized (BEGIN IMMEDIATE) and stamp changes above every existing
+        ``updated_at``, so a reader that saw MAX(updated_at) = ``as_of`` misses
+        no later change when it asks for changes since ``as_of``.
+        """
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                existing = {row['name']: dict(row) for row in conn.execute('SELECT * FROM containers')}
+                stamp = max([time.time()] + [row['updated_at'] + 1e-6 for row in existing.values()])
+                changed = 0
+                for entry in upserts:
+                    row = {field: entry.get(field) for field in CONTAINER_FIELDS}
+                    row['ports'] = json.dumps(row['ports'] or {}, sort_keys=True)
+                    row['limits'] = json.dumps(row['limits'], sort_keys=True) if row['limits'] is not None else None
+                    old = existing.get(entry['name'])
+                    if old and not old['removed'] and all(old[f] == row[f] for f in CONTAINER_FIELDS):
+                        continue
+                    conn.execute(f'''
+                        INSERT OR REPLACE INTO containers (name, {', '.join(CONTAINER_FIELDS)}, removed, updated_at)
+                        VALUES (?, {', '.join('?' for _ in CONTAINER_FIELDS)}, 0, ?)
+                    ''', [entry['name']] + [row[f] for f in CONTAINER_FIELDS] + [stamp])
+                    changed += 1
+                removals = set(removals)
+                if keep_names is not None:
+                    # Everything not listed is gone, except on nodes that could not be asked
+                    removals.update(name for name, row in existing.items()
+                                    if name not in keep_names and row['node'] not in skip_nodes)
+                for name in removals:
+                    if name in existing and not existing[name]['removed']:
+                        conn.execute('UPDATE containers SET removed = 1, updated_at = ? WHERE name = ?', (stamp, name))
+                        changed += 1
+        finally:
+            conn.close()
+        return changed
+
+    def sync_containers(self, containers, unreachable_nodes=()):
+        """Make the registry match a full listing of ``containers``.
+
+        Containers missing from the listing become tombstones, unless their
+        node could not be listed (their state is unknown, so they stay as they are).
+        """
+        return self._write_containers(containers, keep_names={c['name'] for c in containers},
+                                      skip_nodes=set(unreachable_nodes))
+
+    def upsert_container(self, container):
+        return self._write_containers([container])
+
+    def remove_container(self, name):
+        """Tombstone a container, so clients following changes learn it is gone."""
+        return self._write_containers([], removals=[name])
+
+    def prune_container_tombstones(self, max_age):
+        """Drop tombstones older than ``max_age`` seconds.
+
+        Change listings from before the pruned horizon could miss those
+        removals, so they get a full listing instead (``reset``).
+        """
+        horizon = time.time() - max_age
+        conn = self._connect()
+        try:
+            with conn:
+                pruned = conn.execute('DELETE FROM containers WHERE removed = 1 AND updated_at < ?',
+                                      (horizon,)).rowcount
+                if pruned:
+                    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                 ('containers_pruned_before', json.dumps(horizon)))
+        finally:
+            conn.close()
+        return pruned
+
+    def list_containers(self, filters=None, cursor=None, limit=None, changed_since=None):
+        """One page of the container registry, in container number order.
+
+        ``filters`` maps CONTAINER_FILTERS keys to lists of accepted values;
+        ``cursor`` is the ``next_cursor`` of the previous page. With
+        ``changed_since``, only containers changed after that time are listed,
+        and ones that were removed or no longer match the filters come back as
+        ``{'name', 'removed': True}``. Returns (containers, next_cursor, as_of,
+        reset); ``as_of`` is the ``changed_since`` of the next refresh, and
+        ``reset`` means changes could not be listed and this is a full listing.
+        """
+        clauses, params = [], []
+        for key, values in (filters or {}).items():
+            if values:
+                clauses.append(f"{CONTAINER_FILTERS[key]} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+        matches = ' AND '.join(clauses) or '1'
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            # One read transaction, so as_of describes exactly the rows read
+            conn.execute('BEGIN')
+            as_of = conn.execute('SELECT COALESCE(MAX(updated_at), 0) FROM containers').fetchone()[0]
+            pruned_before = conn.execute("SELECT value FROM meta WHERE key = 'containers_pruned_before'").fetchone()
+            reset = (changed_since is not None and pruned_before is not None
+                     and changed_since < json.loads(pruned_before[0]))
+            where, where_params = ['number > ?'], [-1 if cursor is None else cursor]
+            if changed_since is not None and not reset:
+                where.append('updated_at > ?')
+                where_params.append(changed_since)
+            else:
+                where.append(f'removed = 0 AND {matches}')
+                where_params.extend(params)
+            sql = f"SELECT *, ({matches}) AS matches FROM containers WHERE {' AND '.join(where)} ORDER BY number"
+            query_params = params + where_params
+            if limit:
+                sql += ' LIMIT ?'
+                query_params.append(limit + 1)
+            rows = [dict(row) for row in conn.execute(sql, query_params).fetchall()]
+            conn.commit()
+        finally:
+            conn.close()
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]['number']
+        containers = []
+        for row in rows:
+            if row['removed'] or not row['matches']:
+                containers.append({'name': row['name'], 'removed': True, 'updated_at': row['updated_at']})
+                continue
+            containers.append(_registry_container(row))
+        return containers, next_cursor, as_of, reset
+
+    def get_container(self, name):
+        """One listed container (as in list_containers), or None if it is unknown or removed."""
+        rows = self._query('SELECT * FROM containers WHERE name = ? AND removed = 0', (name,))
+        return _registry_container(rows[0]) if rows else None
+
+    # ---------- meta ----------
+
+    def set_meta(self, key, value):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+        finally:
+            conn.close()
+
+    def get_meta(self, key, default=None):
+        rows = self._query('SELECT value FROM meta WHERE key = ?', (key,))
+        return json.loads(rows[0]['value']) if rows else default
+
+
+def summarize_usage(run_totals, group, solved_deploys=()):
+    """Group per-run totals by ``group`` and derive rates.
+
+    A flag counts as solved for the deploy that found it, keyed by
+    (container name, deploy id) since box names are reused, so "cost per
+    solved flag" divides a group's spend by the distinct solved deploys in it.
+    """
+    if group not in ANALYTICS_GROUPS:
+        raise ValueError(f'Unknown analytics group: {group!r}')
+    solved_deploys = set(solved_deploys)
+    groups = {}
+    for run in run_totals:
+        key = run.get(group) or 'unknown'
+        total = groups.setdefault(key, {
+            group: key, 'runs': 0, 'steps': 0, 'model_cost': 0.0, 'flow_credits': 0.0,
+            'prompt_credits': 0.0, 'output_tokens': 0, 'seconds': 0.0,
+            'containers': set(), 'solved': set(),
+        })
+        total['runs'] += 1
+        for field in ('steps', 'model_cost', 'flow_credits', 'prompt_credits', 'output_tokens'):
+            total[field] += run[field]
+        if run['first_step_at'] is not None and run['last_step_at'] is not None:
+            total['seconds'] += run['last_step_at'] - run['first_step_at']
+        if run['container_name']:
+            deploy = (run['container_name'], run.get('deploy_id'))
+            total['containers'].add(deploy)
+            if deploy in solved_deploys:
+                total['solved'].add(deploy)
+
+    results = []
+    for total in groups.values():
+        credits = total['flow_credits'] + total['prompt_credits']
+        hours = total['seconds'] / 3600
+        solved = len(total['solved'])
+        total.update({
+            'containers': len(total['containers']),
+            'solved': solved,
+            'credits': credits,
+            'hours': hours,
+            'credits_per_hour': credits / hours if hours else None,
+            'tokens_per_step': total['output_tokens'] / total['steps'] if total['steps'] else None,
+            'credits_per_solve': credits / solved if solved else None,
+            'cost_per_solve': total['model_cost'] / solved if solved else None,
+        })
+        del total['seconds']
+        results.append(total)
+    results.sort(key=lambda r: r['credits'], reverse=True)
+    return results
@@ -0,0 +1,181 @@
+import json
+
+from profiler import parse_timestamp
+
+# Payload keys the manager never reads. Dropped while a payload is decoded, so
+# they are gone before the rest of it is processed. generatorMetadata (the full
+# prompts sent to the model) is usually more than half of a conversation.
+PRUNED_KEYS = frozenset({'generatorMetadata', 'userConfig', 'activeUserState'})
+
+STEP_TYPE_PREFIX = 'CORTEX_STEP_TYPE_'
+# Step field holding the text payload of each step type that has one
+TEXT_SECTIONS = {
+    'CORTEX_STEP_TYPE_RUN_COMMAND': 'runCommand',
+    'CORTEX_STEP_TYPE_COMMAND_STATUS': 'commandStatus',
+    'CORTEX_STEP_TYPE_VIEW_FILE': 'viewFile',
+    'CORTEX_STEP_TYPE_PLANNER_RESPONSE': 'plannerResponse',
+}
+
+
+def _number(value):
+    """Step metadata numbers arrive as ints, floats or numeric strings."""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _step_texts(step_type, section):
+    """The text fields the manager reads from a step's payload section."""
+    section = section if isinstance(section, dict) else {}
+    if step_type == 'CORTEX_STEP_TYPE_RUN_COMMAND':
+        output = section.get('combinedOutput') or {}
+        return {
+            'command_line': section.get('commandLine') or section.get('proposedCommandLine') or '',
+            'output': output.get('full') or output.get('truncated') or section.get('stdout') or '',
+        }
+    if step_type == 'CORTEX_STEP_TYPE_COMMAND_STATUS':
+        return {'output': section.get('combined') or section.get('stdout') or ''}
+    if step_type == 'CORTEX_STEP_TYPE_VIEW_FILE':
+        return {
+            'file_path': section.get('absolutePathUri') or '',
+            'file_content': section.get('content') or section.get('rawContent') or '',
+        }
+    if step_type == 'CORTEX_STEP_TYPE_PLANNER_RESPONSE':
+        return {
+            'response': section.get('response') or section.get('modifiedResponse') or '',
+            'thinking': section.get('thinking') or '',
+        }
+    return {}
+
+
+class Step:
+    """One trajectory step, holding only the fields the manager reads.
+
+    Timing and usage come from the step's metadata and are parsed up front.
+    The text payload (command output, file content, planner response) is kept
+    as the raw payload section and only extracted when a text field is first
+    read, so listings, usage and status checks never pay for it; for an
+    archived step the section is a reference that is loaded at that point.
+    """
+
+    __slots__ = ('type', 'status', 'created_at', 'viewable_at', 'finished_generating_at', 'completed_at',
+                 'transitions', 'generator_model', 'model_cost', 'flow_credits', 'prompt_credits',
+                 'output_tokens', '_texts', '_section', '_resolve')
+
+    def __init__(self, step_type, status, metadata, section=None, resolve=None):
+        self.type = step_type
+        self.status = status
+        self.created_at = parse_timestamp(metadata.get('createdAt'))
+        self.viewable_at = parse_timestamp(metadata.get('viewableAt'))
+        self.finished_generating_at = parse_timestamp(metadata.get('finishedGeneratingAt'))
+        self.completed_at = parse_timestamp(metadata.get('completedAt'))
+        transitions = []
+        for transition in (metadata.get('internalMetadata') or {}).get('statusTransitions') or []:
+            timestamp = parse_timestamp(transition.get('timestamp'))
+            if timestamp is not None:
+                transitions.append((transition.get('updatedStatus', ''), timestamp))
+        self.transitions = tuple(transitions)
+        generator_model = metadata.get('generatorModel')
+        self.generator_model = None if generator_model == 'MODEL_UNSPECIFIED' else generator_model
+        self.model_cost = _number(metadata.get('modelCost'))
+        self.flow_credits = _number(metadata.get('flowCreditsUsed'))
+        self.prompt_credits = _number(metadata.get('promptCreditsUsed'))
+        self.output_tokens = int(_number(metadata.get('toolCallOutputTokens')))
+        self._texts = None
+        self._section = section
+        self._resolve = resolve
+
+    @classmethod
+    def from_dict(cls, step, resolve=None):
+        """Record of a step dict. With ``resolve``, sub-objects are references it turns into values."""
+        step_type = step.get('type', '')
+        metadata = step.get('metadata') or {}
+        if resolve is not None:
+            metadata = resolve(metadata)
+        section = step.get(TEXT_SECTIONS.get(step_type, ''))
+        return cls(step_type, step.get('status'), metadata, section, resolve)
+
+    def text(self, name):
+        if self._texts is None:
+            section = self._section if self._resolve is None else self._resolve(self._section)
+            self._texts = _step_texts(self.type, section)
+            self._section = None
+        return self._texts.get(name, '')
+
+    @property
+    def command_line(self):
+        return self.text('command_line')
+
+    @property
+    def output(self):
+        return self.text('output')
+
+    @property
+    def file_path(self):
+        return self.text('file_path')
+
+    @property
+    def file_content(self):
+        return self.text('file_content')
+
+    @property
+    def response(self):
+        return self.text('response')
+
+    @property
+    def thinking(self):
+        return self.text('thinking')
+
+
+class Trajectory:
+    """Status and step records of one conversation."""
+
+    __slots__ = ('status', 'steps')
+
+    def __init__(self, status, steps):
+        self.status = status
+        self.steps = steps
+
+
+def _prune(obj):
+    for key in PRUNED_KEYS.intersection(obj):
+        del obj[key]
+    return obj
+
+
+def _prune_to_steps(obj):
+    step_type = obj.get('type')
+    if isinstance(step_type, str) and step_type.startswith(STEP_TYPE_PREFIX) and 'metadata' in obj:
+        # The step dict is dropped right away; only its record stays
+        return Step.from_dict(obj)
+    return _prune(obj)
+
+
+def trajectory_steps(conv_data):
+    """Pull the step list out of a conversation payload (shape varies between API versions)."""
+    if conv_data.get('state') and conv_data['state'].get('trajectory'):
+        return conv_data['state']['trajectory'].get('steps', [])
+    if conv_data.get('trajectory'):
+        return conv_data['trajectory'].get('steps', [])
+    return conv_data.get('steps', [])
+
+
+def decode_conversation(text):
+    """A box's conversation JSON as dicts, without the PRUNED_KEYS subtrees."""
+    return json.loads(text, object_hook=_prune)
+
+
+def decode_trajectory(text):
+    """A box's conversation JSON as a Trajectory of step records.
+
+    Each step is turned into its record as soon as it is decoded, so the whole
+    payload is never held as dicts at once.
+    """
+    conv_data = json.loads(text, object_hook=_prune_to_steps)
+    return Trajectory(conv_data.get('status', ''), trajectory_steps(conv_data))
+
+
+def step_records(steps):
+    """Step records of a list of step dicts."""
+    return [Step.from_dict(step) for step in steps]
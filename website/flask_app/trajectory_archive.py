@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import fcntl
+import zlib
+import struct
+import hashlib
+import threading
+import time
+
+from trajectory import Step
+
+# Step statuses after which a step never changes again. Steps in any other
+# status keep being rewritten on every sweep until they settle.
+FINAL_STEP_STATUSES = {
+    'CORTEX_STEP_STATUS_DONE',
+    'CORTEX_STEP_STATUS_ERROR',
+    'CORTEX_STEP_STATUS_CANCELED',
+    'CORTEX_STEP_STATUS_CLEARED',
+    'CORTEX_STEP_STATUS_INTERRUPTED',
+    'CORTEX_STEP_STATUS_INVALID',
+}
+
+# Sub-objects at least this large (canonical JSON bytes) are stored as their own
+# object and referenced by hash, so configs repeated across steps are kept once.
+SPLIT_THRESHOLD = 256
+
+REF_KEY = '$ref'
+DIGEST_SIZE = 32
+# objects.idx record: digest, offset into objects.pack, compressed length
+INDEX_RECORD = struct.Struct('!32sQI')
+EMPTY_DIGEST = b'\x00' * DIGEST_SIZE
+RUN_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+# Preset zlib dictionary with the keys every step repeats. Changing it makes
+# existing archives unreadable, so only ever bump FORMAT_VERSION with a new one.
+FORMAT_VERSION = 1
+_ZDICT_KEYS = [
+    'absolutePathUri', 'combinedOutput', 'commandLine', 'proposedCommandLine',
+    'rawDebugOutput', 'usedIdeTerminal', 'terminalId', 'shouldAutoRun',
+    'autoRunDecision', 'userRejected', 'waitMsBeforeAsync', 'stdoutLinesAbove',
+    'stderrLinesAbove', 'stdoutBuffer', 'stderrBuffer', 'runCommand',
+    'viewFile', 'listDirectory', 'directoryPathUri', 'results', 'isDir',
+    'sizeBytes', 'commandStatus', 'combined', 'delta', 'exitCode', 'stdout',
+    'stderr', 'codeAction', 'actionSpec', 'actionResult', 'taskBoundary',
+    'taskName', 'taskStatus', 'taskSummary', 'ephemeralMessage',
+    'triggeredHeuristics', 'plannerResponse', 'response', 'thinking',
+    'thinkingDuration', 'stopReason', 'toolCalls', 'messageId', 'argumentsJson',
+    'invalidJsonStr', 'invalidJsonErr', 'thoughtSignature', 'toolCall',
+    'sourceTrajectoryStepInfo', 'trajectoryId', 'stepIndex', 'metadataIndex',
+    'cascadeId', 'requestedModel', 'lastCompletedChunkAt', 'viewableAt',
+    'finishedGeneratingAt', 'completedAt', 'retryInfos', 'waitForPreviousTools',
+    'statusTransitions', 'internalMetadata', 'toolCallOutputTokens',
+    'stepGenerationVersion', 'cortexRequestSource', 'nonStandardCreditReasons',
+    'toolCallChoiceReason', 'toolCallChoices', 'promptCreditsUsed',
+    'flowCreditsUsed', 'executionId', 'generatorModel', 'modelCost',
+    'argumentsOrder', 'source', 'createdAt', 'metadata', 'status', 'timestamp',
+    'updatedStatus', 'type',
+]
+ZDICT = (''.join(f'"{k}":' for k in _ZDICT_KEYS)
+         + 'CORTEX_STEP_STATUS_DONE CORTEX_STEP_SOURCE_MODEL CORTEX_STEP_TYPE_'
+         + 'MODEL_PLACEHOLDER_ file:///home/chal/').encode('utf-8')
+
+
+def canonical_json(value):
+    """Serialize a value the same way every time so equal content hashes equally."""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def is_valid_run_id(run_id):
+    return bool(run_id) and bool(RUN_ID_RE.match(run_id))
+
+
+class TrajectoryArchive:
+    """Append-only, content-addressed store of trajectory steps.
+
+    Layout under ``root``:
+        objects.pack          zlib-compressed objects, appended back to back
+        objects.idx           fixed-size records mapping digest -> pack offset
+        runs/<run_id>/steps   one 32-byte digest per step (slot i = step i)
+        runs/<run_id>/meta.json
+
+    Objects are written once and never modified. A step slot is rewritten only
+    while the step is still in progress; once it reaches a final status it is
+    frozen. Reading step i is one seek into ``steps`` plus one dict lookup and
+    one seek into ``objects.pack``.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.runs_path = os.path.join(root, 'runs')
+        self.pack_path = os.path.join(root, 'objects.pack')
+        self.index_path = os.path.join(root, 'objects.idx')
+        self.lock_path = os.path.join(root, 'lock')
+        os.makedirs(self.runs_path, exist_ok=True)
+        for path in (self.pack_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, 'ab').close()
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_offset = 0
+        self._pack = None
+        self._pending = []
+        self._refresh_index()
+
+    # ---------- object store ----------
+
+    def _refresh_index(self):
+        """Load index records appended since the last refresh (possibly by another process)."""
+        size = os.path.getsize(self.index_path)
+        if size <= self._index_offset:
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            data = f.read(size - self._index_offset)
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        for digest, offset, length in INDEX_RECORD.iter_unpack(data[:usable]):
+            self._index[digest] = (offset, length)
+        self._index_offset += usable
+
+    def _put_object(self, value):
+        """Store a JSON value and return its digest. Existing objects are not rewritten.
+
+        Must be called between _begin_batch() and _end_batch().
+        """
+        raw = canonical_json(value)
+        digest = hashlib.sha256(raw).digest()
+        if digest in self._index:
+            return digest
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, ZDICT)
+        blob = bytes([FORMAT_VERSION]) + compressor.compress(raw) + compressor.flush()
+        offset = self._pack.tell()
+        self._pack.write(blob)
+        self._pending.append(INDEX_RECORD.pack(digest, offset, len(blob)))
+        self._index[digest] = (offset, len(blob))
+        return digest
+
+    def _begin_batch(self):
+        """Start appending objects. Caller must hold _lock and the process lock."""
+        self._pack = open(self.pack_path, 'ab')
+        self._pending = []
+
+    def _end_batch(self):
+        """Make appended objects durable before publishing them in the index."""
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+        self._pack.close()
+        self._pack = None
+        if self._pending:
+            with open(self.index_path, 'ab') as index:
+                index.write(b''.join(self._pending))
+                index.flush()
+                os.fsync(index.fileno())
+            self._index_offset += INDEX_RECORD.size * len(self._pending)
+        self._pending = []
+
+    def _get_object(self, digest):
+        location = self._index.get(digest)
+        if location is None:
+            self._refresh_index()
+            location = self._index.get(digest)
+            if location is None:
+                raise KeyError(digest.hex())
+        offset, length = location
+        with open(self.pack_path, 'rb') as pack:
+            pack.seek(offset)
+            blob = pack.read(length)
+        if blob[0] != FORMAT_VERSION:
+            raise ValueError(f'Unsupported archive object version {blob[0]}')
+        decompressor = zlib.decompressobj(15, ZDICT)
+        return json.loads(decompressor.decompress(blob[1:]) + decompressor.flush())
+
+    def _split(self, value):
+        """Replace large sub-objects with references, deepest first."""
+        if isinstance(value, dict):
+            value = {k: self._split(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            value = [self._split(v) for v in value]
+        else:
+            return value
+        if value and len(canonical_json(value)) >= SPLIT_THRESHOLD:
+            return {REF_KEY: self._put_object(value).hex()}
+        return value
+
+    def _store_step(self, step):
+        """Store one step; its top level is kept inline and large children split out."""
+        return self._put_object({k: self._split(v) for k, v in step.items()})
+
+    def _join(self, value):
+        if isinstance(value, dict):
+            if len(value) == 1 and REF_KEY in value:
+                return self._join(self._get_object(bytes.fromhex(value[REF_KEY])))
+            return {k: self._join(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._join(v) for v in value]
+        return value
+
+    # ---------- runs ----------
+
+    def _run_dir(self, run_id):
+        if not is_valid_run_id(run_id):
+            raise ValueError(f'Invalid run id: {run_id!r}')
+        return os.path.join(self.runs_path, run_id)
+
+    def _steps_path(self, run_id):
+        return os.path.join(self._run_dir(run_id), 'steps')
+
+    def _meta_path(self, run_id):
+        return os.path.join(self._run_dir(run_id), 'meta.json')
+
+    def get_run(self, run_id):
+        """Return run metadata, or None if the run was never archived."""
+        try:
+            with open(self._meta_path(run_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, run_id, meta):
+        path = self._meta_path(run_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def list_runs(self):
+        """Return metadata of every archived run, most recently updated first."""
+        runs = []
+        for run_id in os.listdir(self.runs_path):
+            if not is_valid_run_id(run_id):
+                continue
+            meta = self.get_run(run_id)
+            if meta:
+                runs.append(meta)
+        runs.sort(key=lambda r: r.get('updated_at', 0), reverse=True)
+        return runs
+
+    def append_steps(self, run_id, steps, run_info=None):
+        """Archive the steps of one trajectory.
+
+        Steps already frozen in the archive are skipped; the rest are stored and
+        their slots (re)written. Returns the indices of steps that changed.
+        """
+        run_info = run_info or {}
+        # The web app and the worker both archive; the file lock keeps their appends apart
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            self._refresh_index()
+            os.makedirs(self._run_dir(run_id), exist_ok=True)
+            meta = self.get_run(run_id) or {
+                'run_id': run_id,
+                'created_at': time.time(),
+                'num_steps': 0,
+                'frozen_steps': 0,
+            }
+            frozen = meta.get('frozen_steps', 0)
+            steps_path = self._steps_path(run_id)
+            changed = []
+            self._begin_batch()
+            try:
+                digests = [(index, self._store_step(steps[index])) for index in range(frozen, len(steps))]
+            finally:
+                self._end_batch()
+            with open(steps_path, 'r+b' if os.path.exists(steps_path) else 'w+b') as f:
+                for index, digest in digests:
+                    f.seek(index * DIGEST_SIZE)
+                    if f.read(DIGEST_SIZE) != digest:
+                        f.seek(index * DIGEST_SIZE)
+                        f.write(digest)
+                        changed.append(index)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Advance the frozen prefix over steps that reached a final status
+            while frozen < len(steps) and steps[frozen].get('status') in FINAL_STEP_STATUSES:
+                frozen += 1
+
+            meta.update(run_info)
+            meta['num_steps'] = max(meta.get('num_steps', 0), len(steps))
+            meta['frozen_steps'] = frozen
+            meta['updated_at'] = time.time()
+            self._write_meta(run_id, meta)
+            return changed
+
+    def _get_step_object(self, run_id, index):
+        """The stored top level of step ``index`` (large children still references), or None."""
+        if index < 0:
+            return None
+        try:
+            with open(self._steps_path(run_id), 'rb') as f:
+                f.seek(index * DIGEST_SIZE)
+                digest = f.read(DIGEST_SIZE)
+        except OSError:
+            return None
+        if len(digest) != DIGEST_SIZE or digest == EMPTY_DIGEST:
+            return None
+        return self._get_object(digest)
+
+    def get_step(self, run_id, index):
+        """Return step ``index`` of a run, or None if it is not archived."""
+        step = self._get_step_object(run_id, index)
+        return None if step is None else self._join(step)
+
+    def get_steps(self, run_id, start=0, end=None):
+        """Return steps ``start``..``end`` of a run in order."""
+        meta = self.get_run(run_id)
+        if not meta:
+            return []
+        end = meta.get('num_steps', 0) if end is None else min(end, meta.get('num_steps', 0))
+        steps = []
+        for index in range(max(start, 0), end):
+            step = self.get_step(run_id, index)
+            if step is not None:
+                steps.append(step)
+        return steps
+
+    def get_step_records(self, run_id):
+        """Step records of a run, for profiling, usage and search.
+
+        Only each step's top level and metadata are read up front; a step's
+        text payload is loaded from the pack when one of its text fields is.
+        """
+        meta = self.get_run(run_id)
+        if not meta:
+            return []
+        records = []
+        for index in range(meta.get('num_steps', 0)):
+            step = self._get_step_object(run_id, index)
+            if step is not None:
+                records.append(Step.from_dict(step, resolve=self._join))
+        return records
+
+    def get_conversation(self, run_id):
+        """Rebuild a conversation in the same shape the box API returns."""
+        meta = self.get_run(run_id)
+        if not meta:
+            return None
+        steps = self.get_steps(run_id)
+        return {
+            'trajectory': {'cascadeId': run_id, 'steps': steps},
+            'status': meta.get('status', ''),
+            'numTotalSteps': len(steps),
+            'archived': True,
+            'run': meta,
+        }
@@ -0,0 +1,88 @@
+"""Background worker for the manager.
+
+Runs the periodic jobs (flag monitor, trajectory archiver, box status poller,
+box health monitor, log collector, image builder, benchmark scheduler, blob
+garbage collector) in a process of its own, so the web app only serves
+requests. Results are shared with the web app through the manager database
+and the data directories.
+
+Any number of workers may be started; the one holding the leader lock runs the
+jobs and the others wait to take over if it dies.
+"""
+import os
+import time
+import fcntl
+import socket
+import threading
+
+from app import (app, get_store, background_flag_monitor, background_archiver,
+                 background_status_poller, background_health_monitor, background_log_collector,
+                 background_image_builder, background_benchmark_scheduler, background_blob_gc,
+                 WORKER_HEARTBEAT_INTERVAL)
+
+JOBS = [
+    background_flag_monitor,
+    background_archiver,
+    background_status_poller,
+    background_health_monitor,
+    background_log_collector,
+    background_image_builder,
+    background_benchmark_scheduler,
+    background_blob_gc,
+]
+
+# Seconds a standby waits between attempts to take the leader lock
+LOCK_RETRY_INTERVAL = 5
+
+
+def acquire_leader_lock(path):
+    """Block until this process holds the leader lock; returns the open lock file.
+
+    flock locks are released by the kernel when the holder exits, so a crashed
+    leader never leaves a stale lock behind.
+    """
+    lock_file = open(path, 'a+')
+    announced = False
+    while True:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            if not announced:
+                print(f"Another worker holds {path}, waiting as standby...")
+                announced = True
+            time.sleep(LOCK_RETRY_INTERVAL)
+
+
+def main():
+    for path in ('CONTAINER_DATA_PATH', 'ARCHIVE_PATH', 'DATA_PATH'):
+        os.makedirs(app.config[path], exist_ok=True)
+
+    lock_file = acquire_leader_lock(app.config['WORKER_LOCK_PATH'])
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    print(f"Worker {os.getpid()} is leader, starting jobs...")
+
+    for job in JOBS:
+        threading.Thread(target=job, name=job.__name__, daemon=True).start()
+
+    store = get_store()
+    started_at = time.time()
+    while True:
+        try:
+            store.set_meta('worker', {
+                'pid': os.getpid(),
+                'host': socket.gethostname(),
+                'started_at': started_at,
+                'heartbeat_at': time.time(),
+                'jobs': [t.name for t in threading.enumerate() if t.name in {j.__name__ for j in JOBS}],
+            })
+        except Exception as e:
+            print(f"Worker heartbeat error: {e}")
+        time.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Fake antibox: the autoprompt HTTP API (port 4020) without an IDE behind it.
+
+Each box replays a recorded trajectory (website/out*.json), revealing one more
+step every ``step_interval`` seconds until it goes idle, like a real run. Steps
+are serialized once up front so the fake side stays cheap and the manager's
+cost dominates the measurements.
+"""
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+import http.server
+
+RUNNING = 'CASCADE_RUN_STATUS_RUNNING'
+IDLE = 'CASCADE_RUN_STATUS_IDLE'
+
+
+class Sample:
+    """A recorded trajectory, split into pre-serialized steps."""
+
+    def __init__(self, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        trajectory = data['trajectory']
+        self.name = path
+        self.steps = [json.dumps(step) for step in trajectory['steps']]
+        self.header = {k: v for k, v in trajectory.items() if k not in ('steps', 'cascadeId', 'trajectoryId')}
+
+
+class Faults:
+    """Latency and failure injection shared by the fake servers."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, failure_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    def should_fail(self):
+        return self.failure_rate > 0 and random.random() < self.failure_rate
+
+
+class FakeBox:
+    """One box: a conversation growing from a sample, served on its own port."""
+
+    def __init__(self, name, sample, port, step_interval=1.0, faults=None, start_delay=0.0):
+        self.name = name
+        self.sample = sample
+        self.port = port
+        self.step_interval = step_interval
+        self.faults = faults or Faults()
+        self.cascade_id = str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+        self.started_at = time.time() + start_delay
+        self.requests = 0
+        self.prompts = []
+        self._server = None
+
+    @property
+    def idle_at(self):
+        """When the last step is revealed and the run goes idle."""
+        return self.started_at + len(self.sample.steps) * self.step_interval
+
+    def visible_steps(self):
+        elapsed = time.time() - self.started_at
+        if elapsed < 0:
+            return 0
+        return min(len(self.sample.steps), int(elapsed / self.step_interval) + 1)
+
+    def conversations(self):
+        return [{'id': self.cascade_id, 'name': f'{self.name} run'}]
+
+    def conversation(self):
+        n = self.visible_steps()
+        header = dict(self.sample.header, cascadeId=self.cascade_id, trajectoryId=self.cascade_id)
+        status = IDLE if n == len(self.sample.steps) else RUNNING
+        # Splice the cached step JSON instead of re-encoding the whole trajectory
+        head = json.dumps({'trajectory': header})[:-2]
+        return (f'{head}, "steps": [{",".join(self.sample.steps[:n])}]}}, '
+                f'"status": "{status}", "numTotalSteps": {n}}}').encode('utf-8')
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', self.port), _BoxHandler)
+        self._server.box = self
+        threading.Thread(target=self._server.serve_forever, name=self.name, daemon=True).start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _QuietHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, body=b'', content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def inject_fault(self, faults):
+        """Delay the request; returns True if it was failed instead of answered."""
+        faults.delay()
+        if not faults.should_fail():
+            return False
+        if random.random() < 0.5:
+            self.reply(500, b'Proxy call failed: injected failure', 'text/plain')
+        else:
+            # Drop the connection without answering, like a box that died mid-request
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+        return True
+
+
+class _BoxHandler(_QuietHandler):
+    def do_GET(self):
+        box = self.server.box
+        box.requests += 1
+        if self.inject_fault(box.faults):
+            return
+        if self.path == '/health':
+            ok = {'ok': True, 'ms': 0, 'error': None}
+            self.reply(200, json.dumps({'ready': True, 'checks': {'window': ok, 'bridge': ok}}).encode('utf-8'))
+        elif self.path == '/conversations':
+            self.reply(200, json.dumps(box.conversations()).encode('utf-8'))
+        elif self.path == f'/conversation/{box.cascade_id}':
+            self.reply(200, box.conversation())
+        elif self.path.startswith('/conversation/'):
+            self.reply(500, b'"cascade not found"')
+        else:
+            self.reply(404)
+
+    def do_POST(self):
+        box = self.server.box
+        box.requests += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self.reply(400, b'Invalid JSON', 'text/plain')
+            return
+        if self.inject_fault(box.faults):
+            return
+        if self.path == '/prompt':
+            box.prompts.append(data.get('text', ''))
+            if data.get('mode') == 'rpc':
+                self.reply(200, json.dumps({'cascade_id': data.get('cascade_id') or box.cascade_id}).encode())
+            else:
+                self.reply(200, b'Prompt submitted', 'text/plain')
+        elif self.path == '/model':
+            self.reply(200, b'Model selected', 'text/plain')
+        else:
+            self.reply(404)
+
+
+FLAG_PATTERN = re.compile(r'[A-Za-z0-9_]{2,20}\{[^{}\s]{1,200}\}')
+
+
+class FakeGroq:
+    """Stands in for the Groq chat completions API the flag monitor calls."""
+
+    def __init__(self, port, faults=None):
+        self.port = port
+        self.faults = faults or Faults()
+        self.requests = 0
+        self._server = None
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', self.port), _GroqHandler)
+        self._server.groq = self
+        threading.Thread(target=self._server.serve_forever, name='fake-groq', daemon=True).start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class _GroqHandler(_QuietHandler):
+    def do_POST(self):
+        groq = self.server.groq
+        groq.requests += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if self.inject_fault(groq.faults):
+            return
+        text = body.get('messages', [{}])[-1].get('content', '')
+        found = FLAG_PATTERN.findall(text)
+        answer = found[-1] if found else 'NO_FLAG_FOUND'
+        self.reply(200, json.dumps({'choices': [{'message': {'role': 'assistant', 'content': answer}}]}).encode('utf-8'))
@@ -0,0 +1,108 @@
+"""Stub Docker Engine API listing fake boxes as running antibox containers.
+
+Implements just what the manager's container listing uses (``/version``,
+``/_ping``, ``/containers/json``, ``/containers/<id>/json``), so the manager can
+point a DOCKER_NODES entry at it. Paths may carry the ``/v1.xx`` prefix
+docker-py adds.
+"""
+import json
+import re
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+
+from fake_box import Faults, _Server, _QuietHandler
+
+API_VERSION = '1.43'
+NETWORK_NAME = 'boxnet'
+
+
+class FakeDocker:
+    """A daemon whose containers are the given fake boxes."""
+
+    def __init__(self, boxes, port, node_name='sim', faults=None):
+        self.boxes = boxes
+        self.port = port
+        self.node_name = node_name
+        self.faults = faults or Faults()
+        self.requests = 0
+        self._server = None
+
+    def container_id(self, box):
+        return hashlib.sha256(box.name.encode('utf-8')).hexdigest()
+
+    def find(self, ref):
+        """(number, box) for a container name or (short) id, or (None, None)."""
+        ref = ref.lstrip('/')
+        for number, box in enumerate(self.boxes, 1):
+            if ref == box.name or (len(ref) >= 12 and self.container_id(box).startswith(ref)):
+                return number, box
+        return None, None
+
+    def summary(self, box):
+        return {
+            'Id': self.container_id(box),
+            'Names': ['/' + box.name],
+            'Image': 'antigravity_auto',
+            'State': 'running',
+            'Status': 'Up',
+            'Labels': {'cpwn.node': self.node_name},
+            'Ports': [{'PrivatePort': 4020, 'PublicPort': box.port, 'Type': 'tcp'}],
+        }
+
+    def inspect(self, box, number):
+        return {
+            'Id': self.container_id(box),
+            'Name': '/' + box.name,
+            'State': {'Status': 'running', 'Running': True},
+            'Config': {'Image': 'antigravity_auto', 'Labels': {'cpwn.node': self.node_name}},
+            'NetworkSettings': {
+                'Networks': {NETWORK_NAME: {'IPAddress': f'10.4.4.{number + 1}'}},
+                'Ports': {
+                    '4020/tcp': [{'HostIp': '0.0.0.0', 'HostPort': str(box.port)}],
+                    '6080/tcp': None,
+                    '5000/tcp': None,
+                },
+            },
+        }
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', self.port), _DockerHandler)
+        self._server.docker = self
+        threading.Thread(target=self._server.serve_forever, name='fake-docker', daemon=True).start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class _DockerHandler(_QuietHandler):
+    def do_GET(self):
+        docker = self.server.docker
+        docker.requests += 1
+        if self.inject_fault(docker.faults):
+            return
+        url = urlparse(self.path)
+        path = re.sub(r'^/v[\d.]+', '', url.path)
+        if path == '/_ping':
+            self.reply(200, b'OK', 'text/plain')
+        elif path == '/version':
+            self.reply(200, json.dumps({'Version': 'fake', 'ApiVersion': API_VERSION,
+                                        'MinAPIVersion': '1.24', 'Os': 'linux'}).encode('utf-8'))
+        elif path == '/containers/json':
+            name_filter = ''
+            filters = parse_qs(url.query).get('filters')
+            if filters:
+                name_filter = (json.loads(filters[0]).get('name') or [''])[0]
+            listed = [docker.summary(box) for box in docker.boxes if name_filter in box.name]
+            self.reply(200, json.dumps(listed).encode('utf-8'))
+        elif path.startswith('/containers/') and path.endswith('/json'):
+            ref = path[len('/containers/'):-len('/json')]
+            number, box = docker.find(ref)
+            if box is None:
+                self.reply(404, json.dumps({'message': f'No such container: {ref}'}).encode('utf-8'))
+            else:
+                self.reply(200, json.dumps(docker.inspect(box, number)).encode('utf-8'))
+        else:
+            self.reply(404, json.dumps({'message': f'not implemented in stub: {path}'}).encode('utf-8'))
@@ -0,0 +1,295 @@
+"""Load test the manager against a simulated fleet.
+
+Starts N fake boxes, a stub Docker API listing them and a stub Groq endpoint,
+then runs the manager web app and worker against them in a scratch directory.
+Monitor clients poll the same endpoints as monitor.html, while the worker's
+flag monitor sweeps the boxes as they finish. Reports per-endpoint throughput
+and p50/p99 latency, flag detection lag and manager CPU.
+
+    python run.py --boxes 200 --clients 16 --duration 60
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+from fake_box import Sample, Faults, FakeBox, FakeGroq
+from fake_docker import FakeDocker
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WEBSITE = os.path.dirname(HERE)
+FLASK_APP = os.path.join(WEBSITE, 'flask_app')
+
+sys.path.insert(0, FLASK_APP)
+from profiler import percentile  # noqa: E402
+
+# (weight, name, method, path) - weights follow monitor.html's poll intervals:
+# open conversation every 3s, status every 5s, container list every 30s
+MIX = [
+    (10, 'conversation', 'GET', '/api/container/{name}/conversation/{cascade_id}'),
+    (6, 'status', 'GET', '/api/containers/status'),
+    (2, 'check_flag', 'POST', '/api/container/{name}/check_flag'),
+    (1, 'containers', 'GET', '/api/containers'),
+    (1, 'conversations', 'GET', '/api/container/{name}/conversations'),
+]
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def process_tree_cpu(pid):
+    """CPU seconds (user + system) used by a process and its descendants, from /proc."""
+    stats = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # Fields after "(comm)": state, ppid, ..., utime (14th), stime (15th)
+        stats[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]))
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        if current in stats:
+            total += stats[current][1]
+        pending.extend(p for p, (ppid, _) in stats.items() if ppid == current)
+    return total / CLOCK_TICKS
+
+
+def request(base_url, method, path, timeout=30):
+    req = urllib.request.Request(base_url + path, method=method, data=b'' if method == 'POST' else None)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def wait_for_manager(base_url, processes, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for p in processes:
+            if p.poll() is not None:
+                raise RuntimeError(f'Manager process exited with {p.returncode}, see the logs in the work directory')
+        try:
+            if request(base_url, 'GET', '/api/worker', timeout=2) == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'Manager did not come up at {base_url} within {timeout}s')
+
+
+def seed_container_data(workdir, boxes):
+    """Metadata the manager expects next to each box (flag detection on)."""
+    for box in boxes:
+        path = os.path.join(workdir, 'container_data', box.name)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'metadata.json'), 'w') as f:
+            json.dump({
+                'nickname': f'sim {box.name}',
+                'account': 'loadtest',
+                'model': 'Gemini 3 Flash',
+                'flag_detection': True,
+                'challenge': os.path.splitext(os.path.basename(box.sample.name))[0],
+                'node': 'sim',
+            }, f)
+
+
+def start_manager(args, workdir, docker_port, groq_port):
+    env = dict(os.environ,
+               PORT=str(args.manager_port),
+               UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+               CONTAINER_DATA_PATH=os.path.join(workdir, 'container_data'),
+               ARCHIVE_PATH=os.path.join(workdir, 'archive'),
+               DATA_PATH=os.path.join(workdir, 'data'),
+               BENCHMARK_CORPUS_PATH=os.path.join(workdir, 'benchmarks'),
+               FLAGS_FILE=os.path.join(workdir, 'flags.json'),
+               DOCKER_NODES=json.dumps([{'name': 'sim', 'base_url': f'tcp://127.0.0.1:{docker_port}',
+                                         'host': '127.0.0.1', 'data_path': os.path.join(workdir, 'container_data')}]),
+               GROQ_API_URL=f'http://127.0.0.1:{groq_port}/openai/v1/chat/completions',
+               GROQ_API_KEY='loadtest',
+               FLAG_CHECK_INTERVAL=str(args.flag_interval),
+               STATUS_INTERVAL=str(args.status_interval),
+               ARCHIVE_INTERVAL=str(args.archive_interval),
+               # Fake boxes cannot be restarted or redeployed; injected faults should only show as health states
+               HEALTH_AUTO_REMEDIATE='0',
+               # The stub Docker API has no logs, exec or image endpoints
+               LOG_BUFFER_KB='0',
+               IMAGE_CHECK_INTERVAL='0')
+    processes = {}
+    for name, script in (('web', 'app.py'), ('worker', 'worker.py')):
+        log = open(os.path.join(workdir, f'{name}.log'), 'w')
+        processes[name] = subprocess.Popen([sys.executable, script], cwd=FLASK_APP, env=env,
+                                           stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    return processes
+
+
+def monitor_client(base_url, boxes, deadline, think, results):
+    weights = [m[0] for m in MIX]
+    while time.time() < deadline:
+        _, name, method, path = random.choices(MIX, weights)[0]
+        box = random.choice(boxes)
+        started = time.perf_counter()
+        try:
+            ok = request(base_url, method, path.format(name=box.name, cascade_id=box.cascade_id)) == 200
+        except OSError:
+            ok = False
+        results.append((name, time.perf_counter() - started, ok))
+        if think:
+            time.sleep(random.uniform(0, 2 * think))
+
+
+def watch_flags(base_url, boxes, deadline, seen):
+    """Record how long after each box went idle its flag check landed in the store."""
+    idle_at = {box.name: box.idle_at for box in boxes}
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/api/flags', timeout=30) as response:
+                flags = json.loads(response.read())
+            now = time.time()
+            for flag in flags:
+                name = flag['container_name']
+                if name in idle_at and name not in seen:
+                    seen[name] = now - idle_at[name]
+        except (OSError, ValueError):
+            pass
+        time.sleep(1)
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.1f}'
+
+
+def report(args, results, elapsed, flag_lags, boxes, docker, groq, cpu):
+    lines = [
+        f'Fleet: {args.boxes} boxes, {args.clients} clients, {elapsed:.0f}s, step every {args.step_interval}s, '
+        f'box latency {args.latency_ms}±{args.jitter_ms} ms, failure rate {args.failure_rate:.1%}',
+        '',
+        f'{"endpoint":<16}{"requests":>10}{"errors":>8}{"req/s":>9}{"p50 ms":>10}{"p99 ms":>10}',
+    ]
+    summary = {'endpoints': {}}
+    for name in [m[1] for m in MIX] + ['total']:
+        rows = results if name == 'total' else [r for r in results if r[0] == name]
+        latencies = sorted(r[1] for r in rows)
+        errors = sum(1 for r in rows if not r[2])
+        p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+        lines.append(f'{name:<16}{len(rows):>10}{errors:>8}{len(rows) / elapsed:>9.1f}'
+                     f'{format_ms(p50):>10}{format_ms(p99):>10}')
+        summary['endpoints'][name] = {'requests': len(rows), 'errors': errors,
+                                      'rps': len(rows) / elapsed, 'p50': p50, 'p99': p99}
+
+    finished = [b for b in boxes if b.idle_at <= time.time()]
+    lags = sorted(flag_lags.values())
+    lines += ['',
+              f'Flag sweeps: {len(flag_lags)}/{len(finished)} finished boxes checked, detection lag '
+              f'p50 {percentile(lags, 0.5):.1f}s, p99 {percentile(lags, 0.99):.1f}s '
+              f'(FLAG_CHECK_INTERVAL {args.flag_interval}s)',
+              f'Fake side: {sum(b.requests for b in boxes)} box API calls, {docker.requests} Docker API calls, '
+              f'{groq.requests} Groq calls']
+    for name, seconds in cpu.items():
+        lines.append(f'Manager CPU ({name}): {seconds:.1f}s, {100 * seconds / elapsed:.1f}% of a core')
+    summary.update(flag_checks=len(flag_lags), finished_boxes=len(finished),
+                   flag_lag_p50=percentile(lags, 0.5), flag_lag_p99=percentile(lags, 0.99),
+                   box_calls=sum(b.requests for b in boxes), docker_calls=docker.requests,
+                   groq_calls=groq.requests, cpu_seconds=cpu, elapsed=elapsed)
+    return '\n'.join(lines), summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--boxes', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=8, help='concurrent monitor clients')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of load')
+    parser.add_argument('--think-ms', type=float, default=0, help='mean pause between a client\'s requests')
+    parser.add_argument('--step-interval', type=float, default=1.0, help='seconds per revealed trajectory step')
+    parser.add_argument('--ramp', type=float, default=30, help='box start times are spread over this many seconds')
+    parser.add_argument('--latency-ms', type=float, default=20, help='added latency of box API calls')
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of box API calls that fail')
+    parser.add_argument('--docker-latency-ms', type=float, default=5)
+    parser.add_argument('--samples', nargs='+',
+                        default=sorted(os.path.join(WEBSITE, f) for f in os.listdir(WEBSITE)
+                                       if f.startswith('out') and f.endswith('.json')))
+    parser.add_argument('--base-port', type=int, default=24000, help='first fake box port')
+    parser.add_argument('--manager-port', type=int, default=18080)
+    parser.add_argument('--flag-interval', type=int, default=10)
+    parser.add_argument('--status-interval', type=int, default=5)
+    parser.add_argument('--archive-interval', type=int, default=5)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the work directory (manager logs and data)')
+    args = parser.parse_args()
+
+    samples = [Sample(path) for path in args.samples]
+    box_faults = Faults(args.latency_ms, args.jitter_ms, args.failure_rate)
+    boxes = [FakeBox(f'antibox_{i}', samples[(i - 1) % len(samples)], args.base_port + i - 1,
+                     args.step_interval, box_faults)
+             for i in range(1, args.boxes + 1)]
+    docker = FakeDocker(boxes, args.base_port + args.boxes, faults=Faults(args.docker_latency_ms))
+    groq = FakeGroq(args.base_port + args.boxes + 1, faults=Faults(200, 100))
+    for server in boxes + [docker, groq]:
+        server.start()
+
+    workdir = tempfile.mkdtemp(prefix='cpwn-loadtest-')
+    seed_container_data(workdir, boxes)
+    base_url = f'http://127.0.0.1:{args.manager_port}'
+    processes = start_manager(args, workdir, docker.port, groq.port)
+    try:
+        wait_for_manager(base_url, processes.values())
+        print(f'Manager up, work directory {workdir}; running {args.duration:.0f}s of load...')
+
+        now = time.time()
+        for box in boxes:
+            box.started_at = now + random.uniform(0, args.ramp)
+        cpu_before = {name: process_tree_cpu(p.pid) for name, p in processes.items()}
+        started = time.time()
+        deadline = started + args.duration
+
+        results, flag_lags = [], {}
+        threads = [threading.Thread(target=monitor_client,
+                                    args=(base_url, boxes, deadline, args.think_ms / 1000, results))
+                   for _ in range(args.clients)]
+        threads.append(threading.Thread(target=watch_flags, args=(base_url, boxes, deadline, flag_lags)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        elapsed = time.time() - started
+        cpu = {name: process_tree_cpu(p.pid) - cpu_before[name] for name, p in processes.items()}
+        text, summary = report(args, results, elapsed, flag_lags, boxes, docker, groq, cpu)
+        print(text)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(dict(summary, args=vars(args)), f, indent=2)
+    finally:
+        # Signal the whole session: the debug reloader serves from a child process
+        for p in processes.values():
+            os.killpg(p.pid, signal.SIGTERM)
+        for p in processes.values():
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(p.pid, signal.SIGKILL)
+        for server in boxes + [docker, groq]:
+            server.stop()
+        if args.keep:
+            print(f'Kept {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()